@@ -0,0 +1,442 @@
+import os
+import csv
+import signal
+import sqlite3
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from urine_core.constants import DB_PATH, METRICS, STATISTICS
+from urine_core.pipeline import extract_pad_rgbs, load_reference_index, predict_all_pads
+from urine_core.pipeline_metrics import count, metrics, profiled, timed
+from urine_core.quality_gate import ImageRejected, QualityGate
+from urine_core.results_store import ResultStore
+from urine_core.strip_folders import find_strip_folders, find_strip_images
+
+# ==============================
+# CONFIG
+# ==============================
+CHUNK_SIZE = 16
+
+RESULT_COLUMNS = ["Folder", "Pad", "Analyte", "Level", "Value", "Unit", "R", "G", "B"]
+
+# ==============================
+# WORKER
+# ==============================
+_worker_index = None
+_worker_extraction = {}
+_worker_correction = None
+_worker_registry = None
+_worker_calibration = None
+_worker_fingerprint = None
+_worker_cache = None
+_worker_settings = {}
+_worker_gate = None
+
+
+def init_worker(db_path, reduction=1, roi_fraction=1.0, statistic="mean", metric="rgb",
+                use_lut=False, device=None, calibration=None, cache_path=None, gate=None):
+    """Load the reference table (or map the prebuilt LUT) once per worker process"""
+    # Ctrl+C is handled by run_batch, which lets running strips finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    load_worker_state(db_path, reduction, roi_fraction, statistic, metric, use_lut, device,
+                      calibration, cache_path, gate)
+
+
+def load_worker_state(db_path, reduction=1, roi_fraction=1.0, statistic="mean", metric="rgb",
+                      use_lut=False, device=None, calibration=None, cache_path=None,
+                      gate=None):
+    global _worker_index, _worker_extraction, _worker_correction
+    global _worker_registry, _worker_calibration, _worker_fingerprint
+    global _worker_cache, _worker_settings, _worker_gate
+    _worker_gate = gate
+    _worker_extraction = {"reduction": reduction, "roi_fraction": roi_fraction,
+                          "statistic": statistic, "gate": gate}
+    _worker_correction = None
+    if device is not None:
+        from urine_core.color_correction import load_correction
+        _worker_correction = load_correction(db_path, device)
+
+    _worker_cache, _worker_fingerprint = None, None
+    if cache_path:
+        from urine_core.lookup_db import calibration_fingerprint
+        from urine_core.result_cache import ResultCache, strip_settings
+        _worker_cache = ResultCache(cache_path)
+        _worker_settings = strip_settings(reduction, roi_fraction, statistic, metric,
+                                          use_lut, _worker_correction, gate)
+        conn = sqlite3.connect(db_path)
+        try:
+            _worker_fingerprint = calibration_fingerprint(conn)
+        finally:
+            conn.close()
+
+    # Named calibrations are loaded on first use and hot-swapped when they change
+    _worker_registry, _worker_calibration = None, calibration
+    if calibration:
+        from urine_core.calibration_registry import CalibrationRegistry
+        _worker_registry = CalibrationRegistry(db_path, statistic, metric, use_lut)
+        _worker_index = None
+        return
+
+    if use_lut:
+        from urine_core.color_lut import LutClassifier
+        _worker_index = LutClassifier.load(db_path, statistic=statistic, metric=metric)
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        _worker_index = load_reference_index(conn, statistic, metric)
+    finally:
+        conn.close()
+
+
+def analyze_folder(folder):
+    """Run extraction and prediction for one strip folder.
+
+    Returns (folder, rows, error, metrics), where metrics holds this
+    worker's stage timings since its previous strip.
+    """
+    from urine_core.pad_extraction import list_patch_files
+    try:
+        index, fingerprint = _worker_index_for(folder)
+        paths = [os.path.join(folder, f) for f in list_patch_files(folder)]
+        rows, key = _cached_rows(folder, paths, fingerprint, strip_image=False)
+        if rows is not None:
+            return folder, rows, None, metrics.drain()
+        pad_rgb_map = extract_pad_rgbs(folder, **_worker_extraction)
+    except Exception as e:
+        return (*_failure(folder, e), metrics.drain())
+    return (*_predict(folder, pad_rgb_map, index, key, fingerprint), metrics.drain())
+
+
+def analyze_strip_image(path):
+    """Run pad localization and prediction for one full-strip photo"""
+    from urine_core.strip_localization import extract_strip_rgbs
+    try:
+        index, fingerprint = _worker_index_for(path)
+        rows, key = _cached_rows(path, [path], fingerprint, strip_image=True)
+        if rows is not None:
+            return path, rows, None, metrics.drain()
+        pad_rgb_map = extract_strip_rgbs(path, gate=_worker_gate)
+    except Exception as e:
+        return (*_failure(path, e), metrics.drain())
+    return (*_predict(path, pad_rgb_map, index, key, fingerprint), metrics.drain())
+
+
+def _worker_index_for(source):
+    """(reference index, calibration fingerprint) a strip is matched with"""
+    if _worker_registry is None:
+        return _worker_index, _worker_fingerprint
+    from urine_core.calibration_registry import AUTO_CALIBRATION
+    name = _worker_calibration
+    if name == AUTO_CALIBRATION:
+        name = _worker_registry.resolve(source)
+    return _worker_registry.lookup(name)
+
+
+def _cached_rows(source, paths, fingerprint, strip_image):
+    """(rows of a cached strip or None, its cache key); (None, None) without a cache"""
+    if _worker_cache is None:
+        return None, None
+    from urine_core.result_cache import strip_key
+    key = strip_key(paths, fingerprint, {**_worker_settings, "strip_image": strip_image})
+    results = _worker_cache.get(key, source)
+    return (None if results is None else list(results.rows())), key
+
+
+class StripError(str):
+    """Error message of a failed strip; permanent when only new images can fix it"""
+
+    def __new__(cls, message, permanent=False):
+        error = super().__new__(cls, message)
+        error.permanent = permanent
+        return error
+
+
+def _failure(source, error):
+    """(source, no rows, StripError) of a strip that failed or was rejected"""
+    if isinstance(error, ImageRejected):
+        count("strips_rejected")
+        return source, [], StripError(f"Rejected: {error}", permanent=True)
+    return source, [], StripError(str(error))
+
+
+def _predict(source, pad_rgb_map, index, key=None, fingerprint=None):
+    try:
+        if _worker_correction is not None:
+            with timed("color_correction"):
+                pad_rgb_map = _worker_correction.apply_map(pad_rgb_map)
+        results = predict_all_pads(None, pad_rgb_map, index=index, source=source,
+                                   gate=_worker_gate)
+    except Exception as e:
+        return _failure(source, e)
+    if key is not None:
+        try:
+            _worker_cache.put(key, fingerprint, results)
+        except sqlite3.Error:
+            count("result_cache_errors")
+    return source, list(results.rows()), None
+
+# ==============================
+# BATCH PIPELINE
+# ==============================
+def check_color_correction(db_path, device):
+    """Fail fast if a color correction was requested but never stored"""
+    from urine_core.color_correction import correction_path, load_correction
+    correction = load_correction(db_path, device)
+    if correction is None:
+        raise ValueError(f"No color correction for '{device or 'this machine'}' in "
+                         f"{correction_path(db_path)}; run python -m urine_core.color_correction")
+    return correction
+
+
+def check_calibration(db_path, calibration=None, statistic="mean", metric="rgb"):
+    """check_lookup_table on the database of a named calibration (auto: the default one)"""
+    from urine_core.calibration_registry import AUTO_CALIBRATION, calibration_db
+    if calibration and calibration != AUTO_CALIBRATION:
+        db_path = calibration_db(calibration, db_path)
+    check_lookup_table(db_path, statistic, metric)
+    return db_path
+
+
+def open_result_cache(db_path, cache_path):
+    """Path of the result cache to use (None: no cache), cleared of stale calibrations"""
+    if cache_path is None:
+        return None
+    from urine_core.result_cache import ResultCache, cache_path as default_path
+    from urine_core.result_cache import current_fingerprints
+    cache_path = cache_path or default_path(db_path)
+    cache = ResultCache(cache_path)
+    try:
+        stale = cache.invalidate(current_fingerprints(db_path))
+    finally:
+        cache.close()
+    if stale:
+        print(f"Dropped {stale} cached strips of earlier calibrations")
+    return cache_path
+
+
+def trim_result_cache(cache_path):
+    """Evict the least recently used strips beyond the cache size limit"""
+    from urine_core.result_cache import ResultCache
+    cache = ResultCache(cache_path)
+    try:
+        cache.evict()
+    finally:
+        cache.close()
+
+
+def check_lookup_table(db_path, statistic="mean", metric="rgb"):
+    """Fail fast if the reference table is missing or predates the requested matching"""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Lookup database not found: {db_path}")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        index = load_reference_index(conn, statistic, metric)
+    except sqlite3.OperationalError as e:
+        raise ValueError(f"{db_path} was built by an older version ({e}); "
+                         "initialize the database again") from e
+    finally:
+        conn.close()
+
+    if len(index) == 0:
+        raise ValueError(f"color_lookup in {db_path} is empty; initialize the database first")
+
+
+def run_batch(root, output, db_path=DB_PATH, workers=None, chunk_size=CHUNK_SIZE,
+              reduction=1, roi_fraction=1.0, statistic="mean", metric="rgb",
+              strip_images=False, use_lut=False, store_path=None, metrics_path=None,
+              profile_path=None, device=None, calibration=None, cache_path=None, gate=None):
+    """Analyze every strip under root and write one consolidated CSV.
+
+    Strips are folders of 10 patch images, or with strip_images=True
+    single photos of the whole strip (always matched on the pad mean).
+    With use_lut=True workers classify through the memory-mapped LUT,
+    which is (re)built first if missing or stale. With store_path every
+    result is also appended to that ResultStore database.
+
+    metrics_path receives the stage timings and counters of every worker
+    (Prometheus text for .prom, JSON otherwise). profile_path runs all
+    strips in this process under cProfile instead of a worker pool.
+    With device set, pad colors are first mapped through that reader's
+    stored color correction ("" for this machine). calibration names a
+    registered calibration to match against, or "auto" to pick one per
+    strip from the folders of its path. With cache_path ("" for the
+    default next to db_path) strips whose images and calibration are
+    unchanged are answered from the result cache without decoding.
+    With a QualityGate, strips with a blurry, glaring or badly exposed
+    pad image, or a pad matching no reference, are rejected (listed
+    with the failures) instead of analyzed.
+    """
+    if strip_images:
+        statistic = "mean"
+        sources, analyze = list(find_strip_images(root)), analyze_strip_image
+    else:
+        sources, analyze = list(find_strip_folders(root)), analyze_folder
+    lookup_path = check_calibration(db_path, calibration, statistic, metric)
+    if device is not None:
+        check_color_correction(db_path, device)
+    if use_lut:
+        from urine_core.color_lut import LutClassifier
+        LutClassifier.load_or_build(lookup_path, statistic=statistic, metric=metric)
+    cache_path = open_result_cache(db_path, cache_path)
+    workers = 1 if profile_path else workers or os.cpu_count() or 1
+    print(f"Found {len(sources)} strips, using {workers} workers")
+
+    failures = []
+    processed = 0
+    interrupted = False
+    store = ResultStore(store_path) if store_path else None
+
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_COLUMNS)
+
+        worker_args = (db_path, reduction, roi_fraction, statistic, metric, use_lut, device,
+                       calibration, cache_path, gate)
+
+        def consume(results):
+            nonlocal processed
+            for folder, rows, error, worker_metrics in results:
+                metrics.merge(worker_metrics)
+                if error:
+                    failures.append((folder, error))
+                    count("strips_failed")
+                    continue
+                writer.writerows(rows)
+                if store:
+                    store.append(rows)
+                processed += 1
+                count("strips_processed")
+
+        # Ctrl+C keeps everything finished so far: queued strips are
+        # cancelled and the results, failures and store are still written
+        if profile_path:
+            load_worker_state(*worker_args)
+            try:
+                with profiled(profile_path):
+                    consume(map(analyze, sources))
+            except KeyboardInterrupt:
+                interrupted = True
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                       initargs=worker_args)
+            try:
+                consume(pool.map(analyze, sources, chunksize=chunk_size))
+            except KeyboardInterrupt:
+                interrupted = True
+                print("Stopping, waiting for running strips...")
+            finally:
+                pool.shutdown(cancel_futures=True)
+
+    if store:
+        store.close()
+    if cache_path:
+        trim_result_cache(cache_path)
+
+    if failures:
+        failed_path = os.path.splitext(output)[0] + "_failed.csv"
+        with open(failed_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Folder", "Error"])
+            writer.writerows(failures)
+        rejected = metrics.snapshot()["counters"]["strips_rejected"]
+        print(f"✗ {len(failures)} folders failed ({rejected} rejected by the quality gate), "
+              f"see {failed_path}")
+
+    if interrupted:
+        print(f"⚠ Interrupted after {processed + len(failures)} of {len(sources)} strips")
+    print(f"✓ Analyzed {processed} strips into {output}")
+    if metrics_path:
+        metrics.write(metrics_path)
+        print(f"✓ Metrics written to {metrics_path}")
+    return processed, failures
+
+# ==============================
+# MAIN
+# ==============================
+def add_worker_args(parser):
+    parser.add_argument("--reduction", type=int, default=1, choices=[1, 2, 4, 8],
+                        help="decode patch images at 1/N resolution")
+    parser.add_argument("--roi", type=float, default=1.0,
+                        help="fraction of each side sampled around the patch center")
+    parser.add_argument("--statistic", default="mean", choices=STATISTICS,
+                        help="pad color statistic to match on")
+    parser.add_argument("--metric", default="rgb", choices=METRICS,
+                        help="color distance: RGB Euclidean, CIE76 or CIEDE2000")
+    parser.add_argument("--lut", action="store_true",
+                        help="classify through the precomputed color -> level LUT "
+                             "(no reference distance, so --max-distance does not apply)")
+    parser.add_argument("--device", nargs="?", const="", default=None,
+                        help="apply this reader's stored color correction "
+                             "(no name: this machine)")
+    parser.add_argument("--calibration", default=None,
+                        help="match against this registered calibration; 'auto' picks one "
+                             "per strip from the folder names in its path")
+    parser.add_argument("--cache", nargs="?", const="", default=None,
+                        help="reuse results of unchanged strips from this result cache "
+                             "(no path: next to the lookup database)")
+    add_quality_args(parser)
+
+
+def add_quality_args(parser):
+    gate = parser.add_argument_group("quality gate")
+    gate.add_argument("--quality", action="store_true",
+                      help="reject blurry, glaring or badly exposed captures and pads "
+                           "matching no reference")
+    gate.add_argument("--min-sharpness", type=float, default=None,
+                      help="smallest variance of the Laplacian of a strip photo or frame")
+    gate.add_argument("--max-saturated", type=float, default=None,
+                      help="largest share of clipped pixels in a pad image")
+    gate.add_argument("--luminance", type=int, nargs=2, default=None, metavar=("MIN", "MAX"),
+                      help="the brightest pixels must reach MIN, the darkest stay below MAX")
+    gate.add_argument("--max-distance", type=float, default=None,
+                      help="largest distance to the nearest reference "
+                           "(default depends on --metric)")
+
+
+def quality_gate(args):
+    """QualityGate from add_quality_args options (None without --quality)"""
+    if not args.quality:
+        return None
+    thresholds = {
+        "min_sharpness": args.min_sharpness,
+        "max_saturated": args.max_saturated,
+        "min_luminance": args.luminance[0] if args.luminance else None,
+        "max_luminance": args.luminance[1] if args.luminance else None,
+    }
+    return QualityGate(**{name: value for name, value in thresholds.items() if value is not None},
+                       max_distance=args.max_distance, metric=args.metric)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze every 10-patch strip folder under a root directory")
+    parser.add_argument("root", help="directory containing strip folders")
+    parser.add_argument("--strip-images", action="store_true",
+                        help="root holds one photo per whole strip instead of patch folders")
+    parser.add_argument("-o", "--output",
+                        default=f"urine_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                        help="consolidated results CSV")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="folders handed to a worker at a time")
+    parser.add_argument("--store", help="also append results to this results database")
+    parser.add_argument("--metrics", help="write stage timings and counters here "
+                                          "(.prom for Prometheus text, else JSON)")
+    parser.add_argument("--profile", help="run in-process under cProfile and save the stats here")
+    add_worker_args(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_batch(args.root, args.output, db_path=args.db,
+              workers=args.workers, chunk_size=args.chunk_size,
+              reduction=args.reduction, roi_fraction=args.roi,
+              statistic=args.statistic, metric=args.metric, strip_images=args.strip_images,
+              use_lut=args.lut, store_path=args.store, metrics_path=args.metrics,
+              profile_path=args.profile, device=args.device, calibration=args.calibration,
+              cache_path=args.cache, gate=quality_gate(args))
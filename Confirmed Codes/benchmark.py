@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:      # not available on Windows
+    resource = None
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from urine_core import lookup_db
+from urine_core.constants import METRICS, PAD_SEQUENCE, PAD_ANALYTE_MAP, STATISTICS, VALUE_LABELS
+from urine_core.pad_extraction import extract_pad_rgbs, list_patch_files
+from urine_core.pipeline import predict_all_pads
+from urine_core.reference_index import ReferenceIndex
+
+# ==============================
+# CONFIG
+# ==============================
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_FOLDER = os.path.join(HERE, "..", "patch_csv_files")
+SAMPLE_PATCH_DIR = os.path.join(HERE, "images")
+
+RESOLUTIONS = [40, 200, 800]      # patch side in pixels
+SAMPLE_COUNTS = [20, 100]         # strips per run
+BUILD_REPEATS = 5
+SEED = 0
+REGRESSION_THRESHOLD = 0.2        # relative slowdown flagged by --compare
+
+# ==============================
+# SYNTHETIC STRIPS
+# ==============================
+def load_reference_colors(csv_folder=CSV_FOLDER):
+    """{pad_index: [(level_index, (R, G, B)), ...]} from the calibration CSVs"""
+    csv_map = lookup_db.find_analyte_csvs(csv_folder, PAD_SEQUENCE)
+    colors = {}
+    for pad_index, analyte_code in enumerate(PAD_SEQUENCE, start=1):
+        df = pd.read_csv(os.path.join(csv_folder, csv_map[analyte_code]))
+        df = df.dropna(subset=["R_mean", "G_mean", "B_mean"])
+        colors[pad_index] = [
+            (level, tuple(rgb))
+            for level, rgb in enumerate(df[["R_mean", "G_mean", "B_mean"]].values)
+        ]
+    return colors
+
+
+def load_textures(patch_dir=SAMPLE_PATCH_DIR):
+    """Zero-mean pixel texture of each real sample patch (float32, BGR)"""
+    textures = []
+    for f in list_patch_files(patch_dir):
+        img = cv2.imread(os.path.join(patch_dir, f)).astype(np.float32)
+        textures.append(img - img.reshape(-1, 3).mean(axis=0))
+    return textures
+
+
+def make_synthetic_strips(out_dir, count, size, colors, textures, seed=SEED, ext=".png"):
+    """Write count strip folders of 10 size x size patches under out_dir.
+
+    Each pad takes a random reference color from its calibration CSV and
+    the texture of a real sample patch. Returns {folder: {pad: level}}.
+    """
+    rng = np.random.default_rng(seed)
+    truth = {}
+    for s in range(count):
+        folder = os.path.join(out_dir, f"strip_{s:05d}")
+        os.makedirs(folder)
+        truth[folder] = {}
+        for pad_index in range(1, len(PAD_SEQUENCE) + 1):
+            level, (r, g, b) = colors[pad_index][rng.integers(len(colors[pad_index]))]
+            texture = textures[rng.integers(len(textures))]
+            texture = cv2.resize(texture, (size, size), interpolation=cv2.INTER_LINEAR)
+            patch = np.clip(texture + np.array([b, g, r], dtype=np.float32), 0, 255)
+            cv2.imwrite(os.path.join(folder, f"patch_{pad_index:03d}{ext}"),
+                        patch.astype(np.uint8))
+            truth[folder][pad_index] = level
+    return truth
+
+# ==============================
+# MEASUREMENT
+# ==============================
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(stage, latencies, **extra):
+    """Latency percentiles and throughput for one stage"""
+    latencies = np.asarray(latencies)
+    total = latencies.sum()
+    return {
+        "stage": stage,
+        "count": len(latencies),
+        "mean_ms": round(float(latencies.mean()) * 1000, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "per_sec": round(len(latencies) / total, 2) if total else None,
+        **extra,
+    }
+
+
+def bench_build(csv_folder, work_dir, repeats=BUILD_REPEATS):
+    """Full lookup build into a fresh database, then a no-change rebuild"""
+    full, unchanged = [], []
+    db_path = os.path.join(work_dir, "bench_lookup.db")
+
+    for _ in range(repeats):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        conn = lookup_db.create_database(db_path)
+        try:
+            start = time.perf_counter()
+            lookup_db.build_lookup_table(conn, csv_folder, PAD_SEQUENCE,
+                                         PAD_ANALYTE_MAP, VALUE_LABELS)
+            full.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            lookup_db.build_lookup_table(conn, csv_folder, PAD_SEQUENCE,
+                                         PAD_ANALYTE_MAP, VALUE_LABELS)
+            unchanged.append(time.perf_counter() - start)
+        finally:
+            conn.close()
+
+    return db_path, [summarize("build_lookup_table", full),
+                     summarize("build_lookup_table_unchanged", unchanged)]
+
+
+def bench_strips(db_path, truth, statistic="mean", metric="rgb"):
+    """Per-strip extraction, prediction and end-to-end latency plus accuracy"""
+    conn = sqlite3.connect(db_path)
+    try:
+        start = time.perf_counter()
+        index = ReferenceIndex.from_connection(conn, statistic, metric)
+        load_time = time.perf_counter() - start
+    finally:
+        conn.close()
+
+    extract, predict, total = [], [], []
+    correct = pads = 0
+
+    for folder, levels in truth.items():
+        start = time.perf_counter()
+        pad_rgb_map = extract_pad_rgbs(folder, statistic=statistic)
+        extracted = time.perf_counter()
+        results = predict_all_pads(None, pad_rgb_map, index=index)
+        done = time.perf_counter()
+
+        extract.append(extracted - start)
+        predict.append(done - extracted)
+        total.append(done - start)
+
+        for _, pad_index, _, level_index, *_ in results.rows():
+            correct += level_index == levels[pad_index]
+            pads += 1
+
+    return [
+        summarize("index_load", [load_time]),
+        summarize("extract_pad_rgbs", extract),
+        summarize("predict_all_pads", predict),
+        summarize("end_to_end", total, accuracy=round(correct / pads, 4) if pads else None),
+    ]
+
+
+def run_benchmark(resolutions=RESOLUTIONS, sample_counts=SAMPLE_COUNTS, csv_folder=CSV_FOLDER,
+                  seed=SEED, ext=".png", statistic="mean", metric="rgb", work_dir=None):
+    """Run every stage for every (resolution, sample count) pair"""
+    colors = load_reference_colors(csv_folder)
+    textures = load_textures()
+    keep = work_dir is not None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="urine_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "pandas": pd.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {"seed": seed, "format": ext, "statistic": statistic, "metric": metric},
+        "results": [],
+    }
+
+    try:
+        db_path, build_results = bench_build(csv_folder, work_dir)
+        for result in build_results:
+            report["results"].append({"resolution": None, "strips": None, **result})
+        print(f"✓ build_lookup_table: {build_results[0]['p50_ms']} ms")
+
+        for size in resolutions:
+            for count in sample_counts:
+                data_dir = os.path.join(work_dir, f"strips_{size}px_{count}")
+                shutil.rmtree(data_dir, ignore_errors=True)
+                truth = make_synthetic_strips(data_dir, count, size, colors, textures,
+                                              seed, ext)
+
+                for result in bench_strips(db_path, truth, statistic, metric):
+                    report["results"].append({"resolution": size, "strips": count, **result})
+
+                end_to_end = report["results"][-1]
+                print(f"✓ {size}px x {count} strips: {end_to_end['per_sec']} strips/s, "
+                      f"p50 {end_to_end['p50_ms']} ms, p99 {end_to_end['p99_ms']} ms")
+
+                if not keep:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+# ==============================
+# COMPARISON
+# ==============================
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Print p50 changes per stage; returns the number of regressions"""
+    def keyed(report):
+        return {(r["stage"], r["resolution"], r["strips"]): r for r in report["results"]}
+
+    old, new = keyed(baseline), keyed(current)
+    regressions = 0
+
+    for key, result in new.items():
+        if key not in old or not old[key]["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / old[key]["p50_ms"]
+        stage, size, count = key
+        label = stage if size is None else f"{stage} {size}px x {count}"
+        mark = "✓"
+        if ratio > 1 + threshold:
+            mark = "⚠"
+            regressions += 1
+        print(f"{mark} {label}: {old[key]['p50_ms']} -> {result['p50_ms']} ms ({ratio:.2f}x)")
+
+    return regressions
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark lookup build, extraction and prediction on synthetic strips")
+    parser.add_argument("-o", "--output",
+                        default=f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                        help="JSON results file")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=RESOLUTIONS,
+                        help="patch sizes in pixels")
+    parser.add_argument("--samples", type=int, nargs="+", default=SAMPLE_COUNTS,
+                        help="strip counts per run")
+    parser.add_argument("--csv-folder", default=CSV_FOLDER, help="calibration CSV folder")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--format", default="png", choices=["png", "jpg"],
+                        help="synthetic patch image format")
+    parser.add_argument("--statistic", default="mean", choices=STATISTICS)
+    parser.add_argument("--metric", default="rgb", choices=METRICS)
+    parser.add_argument("--keep", metavar="DIR",
+                        help="generate data in DIR and keep it instead of a temp folder")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.resolutions, args.samples, args.csv_folder, args.seed,
+                           "." + args.format, args.statistic, args.metric, args.keep)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Results written to {args.output} (peak RSS {report['peak_rss_mb']} MB)")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report)
+        if regressions:
+            print(f"⚠ {regressions} stages slower than baseline by more than "
+                  f"{REGRESSION_THRESHOLD:.0%}")
+            sys.exit(1)
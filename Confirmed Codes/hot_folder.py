@@ -0,0 +1,384 @@
+import os
+import csv
+import math
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from urine_core.constants import DB_PATH, IMAGE_EXTENSIONS
+from urine_core.pipeline_metrics import count, metrics
+from urine_core.results_store import ResultStore
+from urine_core.strip_folders import PADS_PER_STRIP
+from batch_analysis import (
+    RESULT_COLUMNS, init_worker, analyze_folder, check_calibration,
+    check_color_correction, open_result_cache, trim_result_cache, add_worker_args, quality_gate
+)
+
+# ==============================
+# CONFIG
+# ==============================
+POLL_INTERVAL = 2.0      # seconds between inbox scans
+MTIME_SLACK = 2.0        # directory mtimes this close to a listing may hide a change
+SETTLE_POLLS = 2         # scans a folder must stay unchanged before it counts as complete
+QUEUE_SIZE = 64          # strips waiting for a worker before the scanner blocks
+RETRY_DELAY = 60.0       # seconds before a failed strip with unchanged images is tried again
+MAX_ATTEMPTS = 3         # failures with unchanged images before a strip waits for new files
+
+# ==============================
+# FOLDER SCANNING
+# ==============================
+def folder_signature(folder):
+    """(name, size, mtime) of every patch image; changes while a reader is still writing"""
+    signature = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(signature))
+
+
+class InboxListing:
+    """find_strip_folders that only re-lists directories whose mtime changed.
+
+    Adding, removing or renaming an entry changes its directory's mtime,
+    so an unchanged directory keeps its cached subdirectories and image
+    count; each poll then costs one stat per directory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.listings = {}  # path -> (mtime_ns, subdirs, image count, trusted)
+
+    def strip_folders(self):
+        """[folder] holding exactly one strip of patch images, in walk order"""
+        folders = []
+        listings = {}
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            listing = self._listing(path)
+            if listing is None:
+                continue
+            listings[path] = listing
+            _, subdirs, images, _ = listing
+            if images == PADS_PER_STRIP:
+                folders.append(path)
+            stack.extend(reversed(subdirs))
+        self.listings = listings
+        return folders
+
+    def _listing(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self.listings.get(path)
+        if cached is not None and cached[0] == mtime and cached[3]:
+            return cached
+
+        listed_at = time.time_ns()
+        subdirs, images = [], 0
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        images += 1
+        except OSError:
+            return None
+        # On coarse-mtime filesystems a file added right after the listing
+        # can leave the mtime unchanged; list such directories again
+        trusted = mtime < listed_at - MTIME_SLACK * 1e9
+        return mtime, sorted(subdirs), images, trusted
+
+
+class FolderScanner:
+    """Finds strip folders whose 10 images have stopped changing.
+
+    A strip that failed is handed out again as soon as its images change
+    (a half-copied file rewritten). With unchanged images it is retried
+    after retry_delay seconds (a locked database), at most max_attempts
+    times; permanent failures (quality gate rejections) only come back
+    with new images.
+    """
+
+    def __init__(self, inbox, seen=(), settle_polls=SETTLE_POLLS, failed=(),
+                 retry_delay=RETRY_DELAY, max_attempts=MAX_ATTEMPTS):
+        self.inbox = inbox
+        self.listing = InboxListing(inbox)
+        self.settle_polls = settle_polls
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.seen = set(seen)
+        self.pending = {}   # folder -> (signature, unchanged polls)
+        # folder -> (signature at failure, retry time); failures of an
+        # earlier run have no signature and are tried once more
+        self.failed = {folder: (None, 0.0) for folder in failed if folder not in self.seen}
+        self.attempts = {}  # folder -> failures with unchanged images
+        self.lock = threading.Lock()
+
+    def poll(self):
+        """[(folder, signature)] of strips that are complete and due for analysis"""
+        with self.lock:
+            return self._poll()
+
+    def _poll(self):
+        ready = []
+        current = set()
+        now = time.monotonic()
+
+        for folder in self.listing.strip_folders():
+            if folder in self.seen:
+                continue
+
+            try:
+                signature = folder_signature(folder)
+            except OSError:
+                continue
+
+            if folder in self.failed:
+                failed_signature, retry_at = self.failed[folder]
+                if signature == failed_signature and now < retry_at:
+                    continue
+                del self.failed[folder]
+                if signature != failed_signature:
+                    self.attempts.pop(folder, None)
+            current.add(folder)
+
+            previous, stable = self.pending.get(folder, (None, 0))
+            stable = stable + 1 if signature == previous else 1
+            self.pending[folder] = (signature, stable)
+
+            if stable >= self.settle_polls:
+                ready.append((folder, signature))
+
+        # Forget folders that disappeared or no longer hold exactly 10 images
+        for folder in list(self.pending):
+            if folder not in current:
+                del self.pending[folder]
+
+        for folder, _ in ready:
+            del self.pending[folder]
+            self.seen.add(folder)
+
+        return ready
+
+    def mark_done(self, folder):
+        with self.lock:
+            self.attempts.pop(folder, None)
+
+    def mark_failed(self, folder, signature, permanent=False):
+        """Put a failed strip back under watch; a permanent failure waits for new images"""
+        with self.lock:
+            attempts = self.attempts.get(folder, 0) + 1
+            self.attempts[folder] = attempts
+            if not permanent and attempts < self.max_attempts:
+                retry_at = time.monotonic() + self.retry_delay
+            else:
+                retry_at = math.inf
+            self.seen.discard(folder)
+            self.failed[folder] = (signature, retry_at)
+
+# ==============================
+# INGESTION SERVICE
+# ==============================
+def _read_folders(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row["Folder"] for row in csv.DictReader(f)}
+
+
+def _open_append(path, header):
+    is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+    f = open(path, "a", newline="", encoding="utf-8")
+    writer = csv.writer(f)
+    if is_new:
+        writer.writerow(header)
+        f.flush()
+    return f, writer
+
+
+class HotFolderService:
+    """Watch an inbox and analyze strip folders as soon as they are complete.
+
+    A scanner thread feeds a bounded queue; when workers fall behind the
+    queue fills up and the scanner blocks instead of piling up work.
+    At most `workers` strips are in flight at once. Strips that failed
+    are retried as FolderScanner describes, including once after a
+    restart, so _failed.csv can list a strip that later succeeded.
+    """
+
+    def __init__(self, inbox, output, db_path=DB_PATH, workers=None,
+                 poll_interval=POLL_INTERVAL, queue_size=QUEUE_SIZE,
+                 settle_polls=SETTLE_POLLS, reduction=1, roi_fraction=1.0,
+                 statistic="mean", metric="rgb", use_lut=False, store_path=None,
+                 metrics_path=None, device=None, calibration=None, cache_path=None,
+                 gate=None):
+        self.inbox = inbox
+        self.output = output
+        self.failed_output = os.path.splitext(output)[0] + "_failed.csv"
+        self.db_path = db_path
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.statistic = statistic
+        self.metric = metric
+        self.use_lut = use_lut
+        self.device = device
+        self.calibration = calibration
+        self.cache_path = cache_path
+        self.gate = gate
+        self.store_path = store_path
+        self.store = None
+        self.metrics_path = metrics_path
+        self.worker_args = (db_path, reduction, roi_fraction, statistic, metric, use_lut, device,
+                            calibration)
+
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.write_lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        self.scanner = FolderScanner(inbox, _read_folders(self.output), settle_polls,
+                                     _read_folders(self.failed_output))
+
+        self.processed = 0
+        self.failed = 0
+
+    def _scan_loop(self):
+        while not self.stop_event.is_set():
+            for item in self.scanner.poll():
+                while not self.stop_event.is_set():
+                    try:
+                        self.work_queue.put(item, timeout=self.poll_interval)
+                        break
+                    except queue.Full:
+                        print(f"⚠ Workers behind, {self.work_queue.qsize()} strips queued")
+            if self.metrics_path:
+                metrics.write(self.metrics_path)
+            if self.cache_path:
+                trim_result_cache(self.cache_path)
+            self.stop_event.wait(self.poll_interval)
+
+    def _on_done(self, future):
+        try:
+            folder, rows, error, worker_metrics = future.result()
+        except Exception as e:
+            folder, rows, error, worker_metrics = future.folder, [], str(e), None
+
+        metrics.merge(worker_metrics)
+        count("strips_failed" if error else "strips_processed")
+        if error:
+            self.scanner.mark_failed(folder, future.signature,
+                                     permanent=getattr(error, "permanent", False))
+        else:
+            self.scanner.mark_done(folder)
+
+        with self.write_lock:
+            if error:
+                self.failed += 1
+                self.failed_writer.writerow((folder, error))
+                self.failed_file.flush()
+                print(f"✗ {folder}: {error}")
+            else:
+                self.processed += 1
+                self.result_writer.writerows(rows)
+                self.result_file.flush()
+                if self.store:
+                    self.store.append(rows)
+                print(f"✓ {folder}")
+
+        self.slots.release()
+
+    def run(self):
+        lookup_path = check_calibration(self.db_path, self.calibration, self.statistic,
+                                        self.metric)
+        if self.device is not None:
+            check_color_correction(self.db_path, self.device)
+        if self.use_lut:
+            from urine_core.color_lut import LutClassifier
+            LutClassifier.load_or_build(lookup_path, statistic=self.statistic,
+                                        metric=self.metric)
+        self.cache_path = open_result_cache(self.db_path, self.cache_path)
+
+        self.result_file, self.result_writer = _open_append(self.output, RESULT_COLUMNS)
+        self.failed_file, self.failed_writer = _open_append(self.failed_output, ["Folder", "Error"])
+        if self.store_path:
+            self.store = ResultStore(self.store_path)
+
+        scanner = threading.Thread(target=self._scan_loop, daemon=True)
+        print(f"Watching {self.inbox} with {self.workers} workers")
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=init_worker,
+                                     initargs=(*self.worker_args, self.cache_path,
+                                               self.gate)) as pool:
+                scanner.start()
+                while not self.stop_event.is_set():
+                    try:
+                        folder, signature = self.work_queue.get(timeout=self.poll_interval)
+                    except queue.Empty:
+                        continue
+                    self.slots.acquire()
+                    future = pool.submit(analyze_folder, folder)
+                    future.folder = folder
+                    future.signature = signature
+                    future.add_done_callback(self._on_done)
+        except KeyboardInterrupt:
+            print("Stopping, waiting for running strips...")
+        finally:
+            self.stop_event.set()
+            self.result_file.close()
+            self.failed_file.close()
+            if self.store:
+                self.store.close()
+            if self.metrics_path:
+                metrics.write(self.metrics_path)
+
+        rejected = metrics.snapshot()["counters"]["strips_rejected"]
+        print(f"Processed {self.processed} strips, {self.failed} failed "
+              f"({rejected} rejected by the quality gate)")
+
+    def stop(self):
+        self.stop_event.set()
+
+# ==============================
+# MAIN
+# ==============================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze strip folders as they appear in an inbox directory")
+    parser.add_argument("inbox", help="directory the strip readers write into")
+    parser.add_argument("-o", "--output", default="urine_hot_folder.csv",
+                        help="results CSV, appended to as strips complete")
+    parser.add_argument("--store", help="also append results to this results database")
+    parser.add_argument("--metrics", help="keep stage timings and counters up to date here "
+                                          "(.prom for Prometheus text, else JSON)")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="seconds between inbox scans")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="strips queued before the scanner waits for workers")
+    parser.add_argument("--settle-polls", type=int, default=SETTLE_POLLS,
+                        help="unchanged scans before a folder counts as complete")
+    add_worker_args(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    HotFolderService(args.inbox, args.output, db_path=args.db, workers=args.workers,
+                     poll_interval=args.poll_interval, queue_size=args.queue_size,
+                     settle_polls=args.settle_polls, reduction=args.reduction,
+                     roi_fraction=args.roi, statistic=args.statistic,
+                     metric=args.metric, use_lut=args.lut,
+                     store_path=args.store, metrics_path=args.metrics,
+                     device=args.device, calibration=args.calibration,
+                     cache_path=args.cache, gate=quality_gate(args)).run()
@@ -0,0 +1,447 @@
+import re
+import json
+import signal
+import asyncio
+import argparse
+import email.parser
+import email.policy
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch_analysis import (
+    add_quality_args, check_calibration, check_color_correction, quality_gate
+)
+from urine_core.calibration_registry import CalibrationRegistry
+from urine_core.constants import DB_PATH, METRICS, PAD_ANALYTE_MAP, STATISTICS
+from urine_core.pad_extraction import REDUCED_READ_FLAGS, decode_pad_bgr, pad_color
+from urine_core.pipeline_metrics import count, metrics, timed
+from urine_core.quality_gate import ImageRejected
+from urine_core.strip_localization import strip_rgbs
+
+# ==============================
+# CONFIG
+# ==============================
+HOST = "127.0.0.1"       # localhost only unless --host says otherwise
+PORT = 8765
+MAX_BODY = 64 * 1024 * 1024
+BATCH_WINDOW = 0.005     # seconds a micro-batch waits for more strips
+MAX_BATCH = 64           # strips matched in one vectorized call
+
+PAD_FIELD = re.compile(r"pad_?(\d+)$", re.IGNORECASE)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# ==============================
+# DECODE WORKERS
+# ==============================
+def init_decoder():
+    # Ctrl+C is handled by the server process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def decode_patches(images, reduction=1, roi_fraction=1.0, statistic="mean", gate=None):
+    """{pad_index: [R, G, B]} for [(pad_index, encoded bytes)], decoded in memory"""
+    pad_rgb_map = {}
+    for pad_index, data in images:
+        img = decode_pad_bgr(data, reduction, roi_fraction)
+        if gate is not None:
+            gate.check(img, f"pad {pad_index}")
+        pad_rgb_map[pad_index] = pad_color(img, statistic)
+    return pad_rgb_map, metrics.drain()
+
+
+def decode_strip_photo(data, gate=None):
+    """{pad_index: [R, G, B]} for one encoded photo of the whole strip"""
+    return strip_rgbs(decode_pad_bgr(data), gate=gate), metrics.drain()
+
+# ==============================
+# MICRO-BATCHING
+# ==============================
+class MicroBatcher:
+    """Collects strips from concurrent requests and matches them together.
+
+    Strips with every reference pad present are stacked into one
+    (N, pads, 3) array for a single ReferenceIndex.match call per
+    calibration; partial strips fall back to a per-strip predict.
+    """
+
+    def __init__(self, index, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.index = index
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+
+    async def submit(self, pad_rgb_map, index=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((pad_rgb_map, self.index if index is None else index, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[1]), []).append(item)
+            for group in groups.values():
+                maps = [pad_rgb_map for pad_rgb_map, _, _ in group]
+                try:
+                    results = await loop.run_in_executor(None, self.match, maps, group[0][1])
+                except Exception as e:
+                    for _, _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, _, future), result in zip(group, results):
+                    if not future.done():
+                        future.set_result((result, len(group)))
+
+    def match(self, maps, index=None):
+        """(pad_index, level_index, value_label, distance) lists, one per strip"""
+        index = self.index if index is None else index
+        pads = [int(p) for p in index.pad_indices]
+        complete = [i for i, m in enumerate(maps) if all(p in m for p in pads)]
+        results = [None] * len(maps)
+
+        with timed("match"):
+            if complete:
+                rgbs = np.array([[maps[i][p] for p in pads] for i in complete], dtype=np.float64)
+                best, distance = index.match(rgbs)
+                for row, i in enumerate(complete):
+                    results[i] = [
+                        (pad_index,
+                         int(index.level_indices[pos, best[row, pos]]),
+                         index.value_labels[pos, best[row, pos]],
+                         float(distance[row, pos]))
+                        for pos, pad_index in enumerate(pads)
+                    ]
+            for i, pad_rgb_map in enumerate(maps):
+                if results[i] is None:
+                    results[i] = index.predict(pad_rgb_map)
+
+        return results
+
+# ==============================
+# HTTP
+# ==============================
+async def read_request(reader):
+    """(method, path, query, headers, body) of the next request, or None at EOF"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "Send a Content-Length instead of a chunked body")
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise HttpError(400, "Content-Length must be a number")
+    if length < 0:
+        raise HttpError(400, "Content-Length must not be negative")
+    if length > MAX_BODY:
+        raise HttpError(413, f"Body larger than {MAX_BODY} bytes")
+    body = await reader.readexactly(length) if length else b""
+
+    path, _, query = target.partition("?")
+    return method.upper(), path, dict(parse_qsl(query)), headers, body
+
+
+def http_response(status, body, content_type="application/json", keep_alive=True):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+def parse_patch_images(content_type, body):
+    """[(pad_index, bytes)] from a multipart/form-data upload of patch images.
+
+    Fields named pad1..pad10 give the pad directly; otherwise the upload
+    must hold 10 files, numbered in file name order like a strip folder.
+    """
+    if not content_type.lower().startswith("multipart/form-data"):
+        raise HttpError(415, "Upload the patch images as multipart/form-data")
+
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    parts = [
+        (part.get_param("name", header="content-disposition") or "",
+         part.get_filename() or "",
+         part.get_payload(decode=True) or b"")
+        for part in message.iter_parts()
+    ]
+    if not parts:
+        raise HttpError(400, "No images in the upload")
+
+    fields = [PAD_FIELD.match(name) for name, _, _ in parts]
+    if all(fields):
+        images = [(int(m.group(1)), data) for m, (_, _, data) in zip(fields, parts)]
+        unknown = [p for p, _ in images if p not in PAD_ANALYTE_MAP]
+        if unknown:
+            raise HttpError(400, f"Unknown pads: {unknown}")
+        duplicates = _duplicates(p for p, _ in images)
+        if duplicates:
+            raise HttpError(400, f"Pads sent more than once: {duplicates}")
+        return images
+
+    if len(parts) != 10:
+        raise HttpError(400, "Exactly 10 patch images are required")
+    duplicates = _duplicates(filename for _, filename, _ in parts)
+    if duplicates:
+        raise HttpError(400, f"File names sent more than once: {duplicates}")
+    ordered = sorted(parts, key=lambda part: part[1])
+    return [(idx, data) for idx, (_, _, data) in enumerate(ordered, start=1)]
+
+
+def _duplicates(keys):
+    seen, duplicates = set(), []
+    for key in keys:
+        if key in seen and key not in duplicates:
+            duplicates.append(key)
+        seen.add(key)
+    return duplicates
+
+
+def result_records(matches, pad_rgb_map):
+    records = []
+    for pad_index, level_index, value_label, distance in matches:
+        _, analyte, unit = PAD_ANALYTE_MAP[pad_index]
+        records.append({
+            "pad": pad_index,
+            "analyte": analyte,
+            "level": level_index,
+            "value": value_label,
+            "unit": unit,
+            "rgb": pad_rgb_map[pad_index],
+            "distance": round(distance, 4),
+        })
+    return records
+
+# ==============================
+# INFERENCE SERVER
+# ==============================
+class InferenceServer:
+    """Async HTTP front end; decoding runs on a process pool, matching is micro-batched.
+
+    POST /analyze        multipart/form-data with the 10 patch images
+    POST /analyze/strip  one whole-strip photo as the raw request body
+    GET  /health         reference table summary
+    GET  /metrics        Prometheus text of the stage timings
+
+    Both analyze endpoints take ?calibration=<name> to match against a
+    registered calibration instead of the server's default one. Strip
+    photos are always matched on the mean color, like in batch mode,
+    whatever statistic the patch endpoint uses. With a
+    quality gate, strips with a poor capture are answered 422 with the
+    reason, so the reader can retake them.
+    """
+
+    def __init__(self, db_path=DB_PATH, host=HOST, port=PORT, workers=None,
+                 reduction=1, roi_fraction=1.0, statistic="mean", metric="rgb",
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, device=None,
+                 calibration=None, gate=None):
+        self.db_path = db_path
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.extraction = (reduction, roi_fraction, statistic, gate)
+        self.gate = gate
+        self.statistic = statistic
+        self.metric = metric
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.device = device
+        self.correction = None
+        self.calibration = calibration
+        self.registry = CalibrationRegistry(db_path, statistic, metric)
+        # Pads cut from a strip photo only have a mean color
+        self.strip_registry = (self.registry if statistic == "mean"
+                               else CalibrationRegistry(db_path, "mean", metric))
+
+    def load_index(self):
+        check_calibration(self.db_path, self.calibration, self.statistic, self.metric)
+        if self.device is not None:
+            self.correction = check_color_correction(self.db_path, self.device)
+        return self.registry.index(self.calibration)
+
+    async def decode(self, func, *args):
+        pad_rgb_map, worker_metrics = await asyncio.get_running_loop().run_in_executor(
+            self.pool, func, *args)
+        metrics.merge(worker_metrics)
+        return pad_rgb_map
+
+    async def analyze(self, method, path, query, headers, body):
+        if path in ("/analyze", "/analyze/strip") and method != "POST":
+            raise HttpError(405, "Use POST")
+
+        if path == "/analyze":
+            images = parse_patch_images(headers.get("content-type", ""), body)
+            pad_rgb_map = await self.decode(decode_patches, images, *self.extraction)
+            registry = self.registry
+        elif path == "/analyze/strip":
+            if not body:
+                raise HttpError(400, "Send the strip photo as the request body")
+            pad_rgb_map = await self.decode(decode_strip_photo, body, self.gate)
+            registry = self.strip_registry
+        else:
+            raise HttpError(404, f"No such endpoint: {path}")
+
+        if self.correction is not None:
+            with timed("color_correction"):
+                pad_rgb_map = self.correction.apply_map(pad_rgb_map)
+
+        # Cached calibrations are a dict lookup; a new or changed one loads off the event loop
+        calibration = query.get("calibration") or self.calibration
+        index = await asyncio.get_running_loop().run_in_executor(
+            None, registry.index, calibration)
+
+        matches, batch_size = await self.batcher.submit(pad_rgb_map, index)
+        if self.gate is not None:
+            self.gate.check_matches(matches)
+        return {"results": result_records(matches, pad_rgb_map), "batch_size": batch_size,
+                "calibration": calibration or "default"}
+
+    async def respond(self, method, path, query, headers, body):
+        """(status, body, content type) for one request"""
+        if method == "GET" and path == "/health":
+            # The live registry entry, so a reloaded calibration shows up here
+            index, fingerprint = await asyncio.get_running_loop().run_in_executor(
+                None, self.registry.lookup, self.calibration)
+            return 200, {"status": "ok", "pads": len(index),
+                         "fingerprint": fingerprint,
+                         "color_correction": self.correction.device if self.correction else None,
+                         "calibration": self.calibration or "default",
+                         "calibrations": self.registry.names(),
+                         "statistic": self.statistic, "metric": self.metric}, "application/json"
+        if method == "GET" and path == "/metrics":
+            return 200, metrics.to_prometheus(), "text/plain; version=0.0.4"
+
+        with timed("request"):
+            try:
+                result = await self.analyze(method, path, query, headers, body)
+            except HttpError:
+                raise
+            except ImageRejected as e:
+                count("strips_rejected")
+                raise HttpError(422, f"Rejected: {e}")
+            except ValueError as e:
+                count("strips_failed")
+                raise HttpError(400, str(e))
+        count("strips_processed")
+        return 200, result, "application/json"
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                # A request that cannot be framed leaves the stream unreadable
+                keep_alive = False
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, query, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload, content_type = await self.respond(
+                        method, path, query, headers, body)
+                except HttpError as e:
+                    status, payload, content_type = e.status, {"error": str(e)}, "application/json"
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    status, payload, content_type = 500, {"error": str(e)}, "application/json"
+
+                writer.write(http_response(status, payload, content_type, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.index = self.load_index()
+        self.batcher = MicroBatcher(self.index, self.batch_window, self.max_batch)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_decoder)
+        batch_task = asyncio.create_task(self.batcher.run())
+
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"✓ Serving {len(self.index)} pads on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server stopped")
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve strip analysis over HTTP")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--host", default=HOST, help="interface to bind (default: localhost only)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="decode processes (default: all cores)")
+    parser.add_argument("--reduction", type=int, default=1, choices=sorted(REDUCED_READ_FLAGS),
+                        help="decode patch images at 1/N resolution")
+    parser.add_argument("--roi", type=float, default=1.0,
+                        help="fraction of each side sampled around the patch center")
+    parser.add_argument("--statistic", default="mean", choices=STATISTICS,
+                        help="pad color statistic to match on")
+    parser.add_argument("--metric", default="rgb", choices=METRICS,
+                        help="color distance: RGB Euclidean, CIE76 or CIEDE2000")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW,
+                        help="seconds to wait for more strips before matching a batch")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH,
+                        help="largest number of strips matched at once")
+    parser.add_argument("--device", nargs="?", const="", default=None,
+                        help="apply this reader's stored color correction (no name: this machine)")
+    parser.add_argument("--calibration", default=None,
+                        help="registered calibration used when a request names none")
+    add_quality_args(parser)
+    args = parser.parse_args()
+
+    InferenceServer(args.db, args.host, args.port, args.workers, args.reduction, args.roi,
+                    args.statistic, args.metric, args.batch_window, args.max_batch,
+                    args.device, args.calibration, quality_gate(args)).run()
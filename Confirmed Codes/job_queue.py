@@ -0,0 +1,503 @@
+import os
+import csv
+import json
+import time
+import socket
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from urine_core.constants import DB_PATH
+from urine_core.pipeline_metrics import count, metrics
+from urine_core.quality_gate import QualityGate
+from urine_core.strip_folders import find_strip_folders, find_strip_images
+from batch_analysis import (
+    CHUNK_SIZE, RESULT_COLUMNS,
+    init_worker, analyze_folder, analyze_strip_image,
+    check_calibration, check_color_correction, open_result_cache, trim_result_cache,
+    add_worker_args, quality_gate
+)
+
+# ==============================
+# CONFIG
+# ==============================
+UNIT_SIZE = 256          # strips per work unit, the checkpoint granularity
+LEASE_SECONDS = 600.0    # a unit not renewed within this long is handed to another worker
+MAX_ATTEMPTS = 3         # leases of one unit before it is marked failed
+POLL_INTERVAL = 5.0      # seconds an idle worker waits for leases to expire
+BUSY_TIMEOUT = 60.0      # seconds to wait for another worker's queue transaction
+
+# ==============================
+# JOB QUEUE
+# ==============================
+# The queue is one SQLite file next to the archive, shared by every host.
+# It keeps the default rollback journal: WAL needs shared memory, which
+# network filesystems do not provide. Each unit's results are written to
+# its own CSV in <queue>_results/ before the unit is marked done, so a
+# crash loses at most the units in flight, and a lease that is not
+# renewed in time (a dead worker) is simply leased again.
+
+class JobQueue:
+    """Work units of strip sources in SQLite, leased to workers on any host"""
+
+    def __init__(self, path):
+        self.path = path
+        self.results_dir = os.path.splitext(path)[0] + "_results"
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS queue_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                sources TEXT,
+                strips INTEGER,
+                state TEXT DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER DEFAULT 0,
+                processed INTEGER,
+                failed INTEGER,
+                finished REAL
+            );
+            CREATE TABLE IF NOT EXISTS sources (
+                source TEXT NOT NULL UNIQUE,
+                unit_id INTEGER
+            );
+        """)
+        self._index_sources()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _index_sources(self):
+        # Queues created before the sources table only list sources per unit
+        if self.conn.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is not None:
+            return
+        self._transaction()
+        try:
+            for unit_id, unit_sources in self.conn.execute("SELECT id, sources FROM units"):
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO sources VALUES (?, ?)",
+                    ((source, unit_id) for source in unit_sources.split("\n")))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers
+        # can never lease the same unit
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def settings(self):
+        row = self.conn.execute(
+            "SELECT value FROM queue_meta WHERE key = 'settings'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_sources(self, sources, settings, unit_size=UNIT_SIZE):
+        """Queue the sources not queued yet in units of unit_size; returns (units, strips) added"""
+        self._transaction()
+        try:
+            stored = self.settings()
+            if stored is None:
+                self.conn.execute("INSERT INTO queue_meta VALUES ('settings', ?)",
+                                  (json.dumps(settings, sort_keys=True),))
+            elif stored != settings:
+                raise ValueError(f"{self.path} was created with other analysis settings; "
+                                 "use a new queue file")
+
+            # The UNIQUE source column skips sources already in a unit
+            new = [source for source in sources if self.conn.execute(
+                "INSERT OR IGNORE INTO sources (source) VALUES (?)", (source,)).rowcount]
+            for start in range(0, len(new), unit_size):
+                unit = new[start:start + unit_size]
+                unit_id = self.conn.execute("INSERT INTO units (sources, strips) VALUES (?, ?)",
+                                            ("\n".join(unit), len(unit))).lastrowid
+                self.conn.executemany("UPDATE sources SET unit_id = ? WHERE source = ?",
+                                      ((unit_id, source) for source in unit))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return -(-len(new) // unit_size), len(new)
+
+    def lease(self, owner, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        """(unit id, sources, reclaimed) of the next free unit, or None if none is free.
+
+        A unit whose lease expired is reclaimed; after max_attempts
+        leases it is marked failed instead.
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            while True:
+                row = self.conn.execute("""
+                    SELECT id, sources, state, attempts FROM units
+                    WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                    ORDER BY id LIMIT 1
+                """, (now,)).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                unit_id, sources, state, attempts = row
+                if attempts >= max_attempts:
+                    self.conn.execute("UPDATE units SET state = 'failed', owner = NULL "
+                                      "WHERE id = ?", (unit_id,))
+                    count("units_failed")
+                    continue
+                self.conn.execute("""
+                    UPDATE units SET state = 'leased', owner = ?, lease_expires = ?,
+                                     attempts = attempts + 1
+                    WHERE id = ?
+                """, (owner, now + lease_seconds, unit_id))
+                self.conn.execute("COMMIT")
+                return unit_id, sources.split("\n"), state == "leased"
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def renew(self, unit_id, owner, lease_seconds=LEASE_SECONDS):
+        """Extend a lease; False if it expired and another worker took the unit"""
+        with self.conn:
+            return self.conn.execute("""
+                UPDATE units SET lease_expires = ?
+                WHERE id = ? AND owner = ? AND state = 'leased'
+            """, (time.time() + lease_seconds, unit_id, owner)).rowcount == 1
+
+    def complete(self, unit_id, owner, processed, failed):
+        """Checkpoint a finished unit; False if the lease was lost meanwhile"""
+        with self.conn:
+            return self.conn.execute("""
+                UPDATE units SET state = 'done', lease_expires = NULL, processed = ?,
+                                 failed = ?, finished = ?
+                WHERE id = ? AND owner = ? AND state = 'leased'
+            """, (processed, failed, time.time(), unit_id, owner)).rowcount == 1
+
+    def release(self, unit_id, owner):
+        """Hand an unfinished unit back at once (e.g. on Ctrl+C)"""
+        with self.conn:
+            self.conn.execute("""
+                UPDATE units SET state = 'pending', owner = NULL, lease_expires = NULL,
+                                 attempts = attempts - 1
+                WHERE id = ? AND owner = ? AND state = 'leased'
+            """, (unit_id, owner))
+
+    def retry_failed(self):
+        with self.conn:
+            return self.conn.execute("""
+                UPDATE units SET state = 'pending', owner = NULL, attempts = 0
+                WHERE state = 'failed'
+            """).rowcount
+
+    def next_expiry(self):
+        """Earliest expiry of a running lease, None if no unit is leased"""
+        return self.conn.execute(
+            "SELECT MIN(lease_expires) FROM units WHERE state = 'leased'").fetchone()[0]
+
+    def open_units(self):
+        """Units still pending or leased"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM units WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def status(self):
+        """{state: (units, strips)} plus the running leases"""
+        states = {state: (units, strips) for state, units, strips in self.conn.execute(
+            "SELECT state, COUNT(*), SUM(strips) FROM units GROUP BY state")}
+        leases = self.conn.execute("""
+            SELECT id, owner, lease_expires FROM units WHERE state = 'leased' ORDER BY id
+        """).fetchall()
+        return states, leases
+
+    def done_units(self):
+        return [unit_id for (unit_id,) in self.conn.execute(
+            "SELECT id FROM units WHERE state = 'done' ORDER BY id")]
+
+    def unit_paths(self, unit_id):
+        """(results CSV, failures CSV) of one unit"""
+        stem = os.path.join(self.results_dir, f"unit_{unit_id:06d}")
+        return stem + ".csv", stem + "_failed.csv"
+
+    def close(self):
+        self.conn.close()
+
+
+def _write_csv(path, header, rows, owner):
+    # Another worker may be writing the same unit after a reclaimed lease
+    tmp = f"{path}.{owner.replace(':', '_')}.tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+# ==============================
+# COORDINATOR
+# ==============================
+def create_jobs(queue_path, root, strip_images=False, unit_size=UNIT_SIZE, settings=None):
+    """Shard every strip under root into work units; on an existing queue, add only new strips"""
+    root = os.path.abspath(root)
+    sources = list(find_strip_images(root) if strip_images else find_strip_folders(root))
+    settings = dict(settings or {}, strip_images=strip_images)
+
+    queue = JobQueue(queue_path)
+    try:
+        units, strips = queue.add_sources(sources, settings, unit_size)
+        states, _ = queue.status()
+    finally:
+        queue.close()
+    total = sum(unit_count for unit_count, _ in states.values())
+    print(f"✓ Queued {strips} new strips in {units} units "
+          f"({len(sources) - strips} already queued, {total} units in {queue_path})")
+    return units, strips
+
+# ==============================
+# WORKER
+# ==============================
+def run_worker(queue_path, workers=None, chunk_size=CHUNK_SIZE, db_path=None,
+               metrics_path=None, wait=True, lease_seconds=LEASE_SECONDS):
+    """Lease units until none are left, analyzing each one's strips on a process pool.
+
+    The lease is renewed while a unit runs; if it is lost anyway (this
+    host stalled past its expiry), the unit is left to its new owner.
+    With wait=True an idle worker stays until units leased elsewhere are
+    finished, and takes over any whose lease expires. db_path overrides
+    the lookup database recorded in the queue (another mount point).
+    """
+    queue = JobQueue(queue_path)
+    settings = queue.settings()
+    if settings is None:
+        raise ValueError(f"{queue_path} holds no jobs; run init first")
+
+    db_path = db_path or settings["db_path"]
+    statistic, metric = settings["statistic"], settings["metric"]
+    lookup_path = check_calibration(db_path, settings["calibration"], statistic, metric)
+    if settings["device"] is not None:
+        check_color_correction(db_path, settings["device"])
+    if settings["use_lut"]:
+        from urine_core.color_lut import LutClassifier
+        LutClassifier.load_or_build(lookup_path, statistic=statistic, metric=metric)
+    cache_path = open_result_cache(db_path, settings["cache_path"])
+    gate = QualityGate(**settings["quality"]) if settings["quality"] else None
+    analyze = analyze_strip_image if settings["strip_images"] else analyze_folder
+
+    os.makedirs(queue.results_dir, exist_ok=True)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    workers = workers or os.cpu_count() or 1
+    worker_args = (db_path, settings["reduction"], settings["roi_fraction"], statistic, metric,
+                   settings["use_lut"], settings["device"], settings["calibration"],
+                   cache_path, gate)
+    print(f"Worker {owner} using {workers} processes")
+
+    completed = processed = failed = 0
+    unit_id = None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=worker_args) as pool:
+            while True:
+                unit = queue.lease(owner, lease_seconds)
+                if unit is None:
+                    if not wait or queue.open_units() == 0:
+                        break
+                    expiry = queue.next_expiry()
+                    delay = POLL_INTERVAL if expiry is None else expiry - time.time() + 0.1
+                    time.sleep(min(max(delay, 0.1), POLL_INTERVAL))
+                    continue
+
+                unit_id, sources, reclaimed = unit
+                if reclaimed:
+                    count("units_reclaimed")
+                    print(f"⚠ Unit {unit_id}: lease expired, taking it over")
+
+                rows, failures, lost = [], [], False
+                renew_at = time.monotonic() + lease_seconds / 3
+                for source, strip_rows, error, worker_metrics in pool.map(
+                        analyze, sources, chunksize=chunk_size):
+                    metrics.merge(worker_metrics)
+                    if error:
+                        failures.append((source, error))
+                        count("strips_failed")
+                    else:
+                        rows.extend(strip_rows)
+                        count("strips_processed")
+                    if time.monotonic() >= renew_at:
+                        if not queue.renew(unit_id, owner, lease_seconds):
+                            lost = True
+                            break
+                        renew_at = time.monotonic() + lease_seconds / 3
+
+                if lost:
+                    print(f"⚠ Unit {unit_id}: lease lost to another worker, skipping it")
+                    unit_id = None
+                    continue
+
+                results_path, failed_path = queue.unit_paths(unit_id)
+                _write_csv(results_path, RESULT_COLUMNS, rows, owner)
+                _write_csv(failed_path, ["Folder", "Error"], failures, owner)
+                if queue.complete(unit_id, owner, len(sources) - len(failures), len(failures)):
+                    count("units_completed")
+                    completed += 1
+                    processed += len(sources) - len(failures)
+                    failed += len(failures)
+                    print(f"✓ Unit {unit_id}: {len(sources) - len(failures)} strips, "
+                          f"{len(failures)} failed")
+                else:
+                    print(f"⚠ Unit {unit_id}: lease lost before the checkpoint")
+                unit_id = None
+                if cache_path:
+                    trim_result_cache(cache_path)
+                if metrics_path:
+                    metrics.write(metrics_path)
+    except KeyboardInterrupt:
+        print("Stopping, handing the current unit back...")
+    finally:
+        if unit_id is not None:
+            queue.release(unit_id, owner)
+        queue.close()
+        if metrics_path:
+            metrics.write(metrics_path)
+
+    print(f"Completed {completed} units: {processed} strips, {failed} failed")
+    return completed
+
+# ==============================
+# RESULTS
+# ==============================
+def merge_results(queue_path, output):
+    """Concatenate the finished units' CSVs (in unit order) into one results CSV"""
+    queue = JobQueue(queue_path)
+    try:
+        units = queue.done_units()
+        states, _ = queue.status()
+        paths = [queue.unit_paths(unit_id) for unit_id in units]
+    finally:
+        queue.close()
+
+    failed_output = os.path.splitext(output)[0] + "_failed.csv"
+    failures = 0
+    with open(output, "w", newline="", encoding="utf-8") as out, \
+            open(failed_output, "w", newline="", encoding="utf-8") as failed_out:
+        writer, failed_writer = csv.writer(out), csv.writer(failed_out)
+        writer.writerow(RESULT_COLUMNS)
+        failed_writer.writerow(["Folder", "Error"])
+        for results_path, failed_path in paths:
+            with open(results_path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader)
+                writer.writerows(reader)
+            with open(failed_path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader)
+                rows = list(reader)
+                failures += len(rows)
+                failed_writer.writerows(rows)
+
+    strips = sum(strip_count for state, (_, strip_count) in states.items() if state == "done")
+    unfinished = sum(unit_count for state, (unit_count, _) in states.items() if state != "done")
+    if unfinished:
+        print(f"⚠ {unfinished} units are not finished; their strips are missing")
+    print(f"✓ Merged {len(units)} units ({strips - failures} strips, {failures} failed) "
+          f"into {output}")
+    return len(units)
+
+
+def print_status(queue_path):
+    queue = JobQueue(queue_path)
+    try:
+        states, leases = queue.status()
+    finally:
+        queue.close()
+    for state in ("pending", "leased", "done", "failed"):
+        units, strips = states.get(state, (0, 0))
+        print(f"{state}: {units} units, {strips or 0} strips")
+    now = time.time()
+    for unit_id, owner, expires in leases:
+        note = "expired" if expires < now else f"expires in {expires - now:.0f} s"
+        print(f"  unit {unit_id}: {owner}, {note}")
+
+# ==============================
+# MAIN
+# ==============================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Resumable sharded processing of a strip archive on one or more hosts")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init = commands.add_parser("init", help="shard the strips under a root into work units")
+    init.add_argument("queue", help="queue database on a filesystem every worker can reach")
+    init.add_argument("root", help="directory containing strip folders")
+    init.add_argument("--strip-images", action="store_true",
+                      help="root holds one photo per whole strip instead of patch folders")
+    init.add_argument("--unit-size", type=int, default=UNIT_SIZE,
+                      help="strips per work unit")
+    init.add_argument("--db", default=DB_PATH, help="color lookup database")
+    add_worker_args(init)
+
+    work = commands.add_parser("work", help="process units until the queue is empty")
+    work.add_argument("queue")
+    work.add_argument("-j", "--workers", type=int, default=None,
+                      help="worker processes (default: all cores)")
+    work.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                      help="strips handed to a worker process at a time")
+    work.add_argument("--db", default=None,
+                      help="lookup database, if mounted elsewhere on this host")
+    work.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                      help="seconds before an unrenewed unit goes to another worker")
+    work.add_argument("--no-wait", action="store_true",
+                      help="exit when no unit is free instead of waiting for running ones")
+    work.add_argument("--metrics", help="write stage timings and counters here "
+                                        "(.prom for Prometheus text, else JSON)")
+
+    status = commands.add_parser("status", help="show unit states and running leases")
+    status.add_argument("queue")
+
+    merge = commands.add_parser("merge", help="collect the finished units into one CSV")
+    merge.add_argument("queue")
+    merge.add_argument("-o", "--output", required=True, help="consolidated results CSV")
+
+    retry = commands.add_parser("retry", help="queue failed units again")
+    retry.add_argument("queue")
+    return parser.parse_args(argv)
+
+
+def worker_settings(args):
+    """Analysis settings recorded in the queue, so every worker runs the same analysis"""
+    gate = quality_gate(args)
+    return {
+        "db_path": os.path.abspath(args.db),
+        "reduction": args.reduction,
+        "roi_fraction": args.roi,
+        "statistic": "mean" if args.strip_images else args.statistic,
+        "metric": args.metric,
+        "use_lut": args.lut,
+        "device": args.device,
+        "calibration": args.calibration,
+        "cache_path": args.cache,
+        "quality": gate.thresholds() if gate is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command != "init" and not os.path.exists(args.queue):
+        raise SystemExit(f"✗ No job queue at {args.queue}")
+    try:
+        if args.command == "init":
+            create_jobs(args.queue, args.root, args.strip_images, args.unit_size,
+                        worker_settings(args))
+        elif args.command == "work":
+            run_worker(args.queue, args.workers, args.chunk_size, args.db, args.metrics,
+                       wait=not args.no_wait, lease_seconds=args.lease)
+        elif args.command == "status":
+            print_status(args.queue)
+        elif args.command == "merge":
+            merge_results(args.queue, args.output)
+        else:
+            with JobQueue(args.queue) as queue:
+                print(f"✓ {queue.retry_failed()} failed units queued again")
+    except ValueError as e:
+        raise SystemExit(f"✗ {e}")
@@ -0,0 +1,366 @@
+import os
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from batch_analysis import (
+    RESULT_COLUMNS, add_quality_args, check_calibration, check_color_correction, quality_gate
+)
+from hot_folder import _open_append
+from urine_core.constants import DB_PATH, METRICS, STATISTICS
+from urine_core.pad_extraction import center_roi, pad_color
+from urine_core.calibration_registry import CalibrationRegistry
+from urine_core.pipeline import predict_all_pads
+from urine_core.pipeline_metrics import count, metrics, timed
+from urine_core.quality_gate import ImageRejected
+from urine_core.results_store import ResultStore
+
+# ==============================
+# CONFIG
+# ==============================
+WINDOW = 15              # processed frames averaged into one reading
+STABLE_SPREAD = 4.0      # largest per-channel std (RGB units) of a settled reading
+LOCATE_EVERY = 10        # processed frames between pad relocalizations
+DEFAULT_FPS = 30.0       # pacing of a video file that reports no frame rate
+FRAME_TIMEOUT = 1.0      # seconds to wait for a frame before checking for the end
+
+# ==============================
+# CAPTURE
+# ==============================
+# The capture thread keeps only the newest frame. When analysis is slower
+# than the camera, older frames are overwritten (and counted as dropped)
+# instead of queueing, so a reading is never more than one frame behind.
+
+def open_capture(source):
+    """cv2.VideoCapture of a camera index ("0") or a video file / stream URL"""
+    import cv2
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+    return capture
+
+
+class LatestFrame:
+    """One-slot frame buffer filled by a capture thread"""
+
+    def __init__(self, capture, pace=False):
+        self.capture = capture
+        self.interval = 0.0
+        if pace:
+            import cv2
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            self.interval = 1.0 / (fps if fps and fps > 0 else DEFAULT_FPS)
+
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_number = -1
+        self.finished = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _capture_loop(self):
+        frame_number = 0
+        next_due = time.perf_counter()
+        while not self.stop_event.is_set():
+            ok, frame = self.capture.read()
+            if not ok:
+                break
+            with self.condition:
+                if self.frame is not None:
+                    count("frames_dropped")
+                self.frame, self.frame_number = frame, frame_number
+                self.condition.notify()
+            frame_number += 1
+
+            # A file reads far faster than a camera records; play it back in real time
+            if self.interval:
+                next_due += self.interval
+                delay = next_due - time.perf_counter()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+        with self.condition:
+            self.finished = True
+            self.condition.notify()
+
+    def get(self, timeout=FRAME_TIMEOUT):
+        """(frame number, frame) of the newest unread frame; None at the end of the stream"""
+        with self.condition:
+            while self.frame is None:
+                if self.finished:
+                    return None
+                self.condition.wait(timeout)
+            frame, self.frame = self.frame, None
+            return self.frame_number, frame
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.capture.release()
+
+
+class EveryFrame:
+    """Reads frames in order without dropping any (offline analysis of a recording)"""
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.frame_number = -1
+
+    def start(self):
+        return self
+
+    def get(self, timeout=None):
+        ok, frame = self.capture.read()
+        if not ok:
+            return None
+        self.frame_number += 1
+        return self.frame_number, frame
+
+    def stop(self):
+        self.capture.release()
+
+# ==============================
+# TEMPORAL AVERAGING
+# ==============================
+class ReadingWindow:
+    """Sliding window over the last `size` frames' pad colors.
+
+    A reading is settled once the window is full and no pad channel
+    varies by more than `spread` (standard deviation); it is reported
+    once, and again only after the colors have moved and settled anew
+    (the strip was swapped or is still developing).
+    """
+
+    def __init__(self, size=WINDOW, spread=STABLE_SPREAD):
+        self.size = size
+        self.spread = spread
+        self.colors = None
+        self.filled = 0
+        self.next_slot = 0
+        self.reported = False
+
+    def add(self, rgbs):
+        """Add one frame's (pads, 3) colors; returns the averaged colors when newly settled"""
+        rgbs = np.asarray(rgbs, dtype=np.float64)
+        if self.colors is None or self.colors.shape[1:] != rgbs.shape:
+            self.colors = np.zeros((self.size, *rgbs.shape))
+            self.filled = self.next_slot = 0
+        self.colors[self.next_slot] = rgbs
+        self.next_slot = (self.next_slot + 1) % self.size
+        self.filled = min(self.filled + 1, self.size)
+
+        if self.filled < self.size:
+            return None
+        if self.colors.std(axis=0).max() > self.spread:
+            self.reported = False
+            return None
+        if self.reported:
+            return None
+        self.reported = True
+        return self.colors.mean(axis=0)
+
+# ==============================
+# STREAM ANALYSIS
+# ==============================
+class StreamAnalyzer:
+    """Analyze a live strip video: pad colors per frame, one result per settled reading.
+
+    The reference table is loaded once (and again only if its
+    calibration changes); frames only run pad localization (every
+    LOCATE_EVERY frames), the pad color statistic and the window update.
+    Matching runs once per settled reading.
+    """
+
+    def __init__(self, source, output=None, db_path=DB_PATH, roi_fraction=1.0,
+                 statistic="mean", metric="rgb", use_lut=False, device=None,
+                 window=WINDOW, spread=STABLE_SPREAD, locate_every=LOCATE_EVERY,
+                 every_frame=False, orientation="auto", store_path=None, metrics_path=None,
+                 calibration=None, gate=None):
+        self.source = source
+        self.output = output
+        self.db_path = db_path
+        self.roi_fraction = roi_fraction
+        self.statistic = statistic
+        self.metric = metric
+        self.use_lut = use_lut
+        self.device = device
+        self.locate_every = locate_every
+        self.every_frame = every_frame
+        self.orientation = orientation
+        self.store_path = store_path
+        self.metrics_path = metrics_path
+        self.calibration = calibration
+        self.gate = gate
+        self.registry = CalibrationRegistry(db_path, statistic, metric, use_lut)
+
+        self.window = ReadingWindow(window, spread)
+        self.correction = None
+        self.boxes = None
+        self.frames_since_locate = 0
+        self.readings = 0
+
+    def pad_colors(self, frame):
+        """(pads, 3) colors of one frame, relocating the pads every locate_every frames"""
+        from urine_core.strip_localization import locate_pads
+
+        if self.boxes is None or self.frames_since_locate >= self.locate_every:
+            with timed("locate_pads"):
+                self.boxes = locate_pads(frame, orientation=self.orientation)
+            self.frames_since_locate = 0
+        self.frames_since_locate += 1
+
+        if self.gate is not None:
+            self.gate.check_focus(frame, "frame")
+        colors = []
+        for idx, (y0, y1, x0, x1) in enumerate(self.boxes, start=1):
+            pad = center_roi(frame[y0:y1, x0:x1], self.roi_fraction)
+            if self.gate is not None:
+                self.gate.check(pad, f"pad {idx}")
+            colors.append(pad_color(pad, self.statistic))
+        return colors
+
+    def report(self, frame_number, averaged):
+        pad_rgb_map = {idx: [int(round(v)) for v in rgb]
+                       for idx, rgb in enumerate(averaged, start=1)}
+        if self.correction is not None:
+            with timed("color_correction"):
+                pad_rgb_map = self.correction.apply_map(pad_rgb_map)
+
+        source = f"{self.source}@{frame_number}"
+        index = self.registry.index(self.calibration)
+        try:
+            results = predict_all_pads(None, pad_rgb_map, index=index, source=source,
+                                       gate=self.gate)
+        except ImageRejected as e:
+            count("readings_rejected")
+            print(f"⚠ frame {frame_number}: Rejected: {e}")
+            return
+        rows = list(results.rows())
+        count("readings_reported")
+        self.readings += 1
+
+        if self.result_writer:
+            self.result_writer.writerows(rows)
+            self.result_file.flush()
+        if self.store:
+            self.store.append(rows)
+        levels = " ".join(f"{analyte}={value}" for _, _, analyte, _, value, *_ in rows)
+        print(f"✓ frame {frame_number}: {levels}")
+
+    def load_index(self):
+        """Load the reference index up front; it stays in memory (no SQLite per frame)"""
+        check_calibration(self.db_path, self.calibration, self.statistic, self.metric)
+        if self.device is not None:
+            self.correction = check_color_correction(self.db_path, self.device)
+        return self.registry.index(self.calibration)
+
+    def run(self):
+        self.load_index()
+
+        self.result_file = self.result_writer = self.store = None
+        if self.output:
+            self.result_file, self.result_writer = _open_append(self.output, RESULT_COLUMNS)
+        if self.store_path:
+            self.store = ResultStore(self.store_path)
+
+        capture = open_capture(self.source)
+        live_file = not self.source.isdigit() and os.path.exists(self.source)
+        frames = (EveryFrame(capture) if self.every_frame
+                  else LatestFrame(capture, pace=live_file)).start()
+        print(f"Analyzing {self.source} ({'every frame' if self.every_frame else 'live'})")
+
+        processed = 0
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                frame_number, frame = item
+                count("frames_processed")
+                processed += 1
+                try:
+                    rgbs = self.pad_colors(frame)
+                except ImageRejected:
+                    # The pads are where they were; only this capture was poor
+                    count("frames_rejected")
+                    continue
+                except Exception as e:
+                    count("frames_rejected")
+                    self.boxes = None
+                    print(f"⚠ frame {frame_number}: {e}")
+                    continue
+
+                averaged = self.window.add(rgbs)
+                if averaged is not None:
+                    self.report(frame_number, averaged)
+                if self.metrics_path and processed % 100 == 0:
+                    metrics.write(self.metrics_path)
+        except KeyboardInterrupt:
+            print("Stopping stream...")
+        finally:
+            frames.stop()
+            if self.result_file:
+                self.result_file.close()
+            if self.store:
+                self.store.close()
+            if self.metrics_path:
+                metrics.write(self.metrics_path)
+
+        counters = metrics.snapshot()["counters"]
+        print(f"Processed {processed} frames ({counters.get('frames_dropped', 0)} dropped, "
+              f"{counters.get('frames_rejected', 0)} rejected), "
+              f"reported {self.readings} readings")
+
+# ==============================
+# MAIN
+# ==============================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze a live video of a strip, reporting each settled reading")
+    parser.add_argument("source", help="camera index (e.g. 0), video file or stream URL")
+    parser.add_argument("-o", "--output", help="results CSV, appended to as readings settle")
+    parser.add_argument("--store", help="also append results to this results database")
+    parser.add_argument("--metrics", help="keep stage timings and counters up to date here "
+                                          "(.prom for Prometheus text, else JSON)")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--roi", type=float, default=1.0,
+                        help="fraction of each pad box sampled around its center")
+    parser.add_argument("--statistic", default="mean", choices=STATISTICS,
+                        help="pad color statistic to match on")
+    parser.add_argument("--metric", default="rgb", choices=METRICS,
+                        help="color distance: RGB Euclidean, CIE76 or CIEDE2000")
+    parser.add_argument("--lut", action="store_true",
+                        help="classify through the precomputed color LUT "
+                             "(no reference distance, so --max-distance does not apply)")
+    parser.add_argument("--device", nargs="?", const="", default=None,
+                        help="apply this reader's stored color correction (no name: this machine)")
+    parser.add_argument("--calibration", default=None,
+                        help="match against this registered calibration")
+    parser.add_argument("--orientation", default="auto", choices=["auto", "forward", "reverse"])
+    parser.add_argument("--window", type=int, default=WINDOW,
+                        help="frames averaged into one reading")
+    parser.add_argument("--spread", type=float, default=STABLE_SPREAD,
+                        help="largest per-channel std (RGB) of a settled reading")
+    parser.add_argument("--locate-every", type=int, default=LOCATE_EVERY,
+                        help="frames between pad relocalizations")
+    parser.add_argument("--every-frame", action="store_true",
+                        help="analyze every frame of a recording instead of keeping up in real time")
+    add_quality_args(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    StreamAnalyzer(args.source, args.output, db_path=args.db, roi_fraction=args.roi,
+                   statistic=args.statistic, metric=args.metric, use_lut=args.lut,
+                   device=args.device, window=args.window, spread=args.spread,
+                   locate_every=args.locate_every, every_frame=args.every_frame,
+                   orientation=args.orientation, store_path=args.store,
+                   metrics_path=args.metrics, calibration=args.calibration,
+                   gate=quality_gate(args)).run()
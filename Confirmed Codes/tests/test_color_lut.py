@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from urine_core.color_lut import LutClassifier, build_lut  # noqa: E402
+from urine_core.pipeline import build_lookup_table, create_database  # noqa: E402
+from urine_core.pipeline import load_reference_index  # noqa: E402
+
+CSV_FOLDER = os.path.join(os.path.dirname(ROOT), "patch_csv_files")
+BITS = 4
+
+
+@pytest.fixture(scope="module")
+def lookup_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("lut") / "lookup.db")
+    conn = create_database(path)
+    try:
+        build_lookup_table(conn, CSV_FOLDER)
+        index = load_reference_index(conn)
+    finally:
+        conn.close()
+    return path, index
+
+
+def cell_centers(count, seed=0):
+    step = 256 >> BITS
+    cells = np.random.default_rng(seed).integers(0, 1 << BITS, (count, 3))
+    return cells * step + (step - 1) / 2
+
+
+def test_classify_matches_reference_index(lookup_db):
+    path, index = lookup_db
+    classifier = LutClassifier.load_or_build(path, bits=BITS)
+
+    # At cell centers the table holds exactly the nearest reference level
+    rgbs = cell_centers(200).reshape(20, 10, 3)[:, :len(index)]
+    best, distance = index.match(rgbs)
+    expected = np.where(np.isfinite(distance), best, 255)
+    np.testing.assert_array_equal(classifier.classify(rgbs), expected)
+
+
+def test_pixel_votes_of_a_uniform_patch_go_to_its_level(lookup_db):
+    path, index = lookup_db
+    classifier = LutClassifier.load_or_build(path, bits=BITS)
+
+    for pad_index in index.pad_indices[:3]:
+        rgb = cell_centers(1, seed=int(pad_index))[0]
+        img = np.broadcast_to(rgb[::-1].astype(np.uint8), (8, 8, 3))
+        votes = classifier.pixel_votes(img, pad_index)
+        (_, level, _, _), = index.predict({int(pad_index): rgb})
+        slot = int(votes.argmax())
+        assert votes[slot] == 64
+        assert classifier.level_indices[classifier.pad_position[int(pad_index)], slot] == level
+
+
+def test_rebuild_publishes_a_new_table_and_removes_the_old_one(lookup_db):
+    path, _ = lookup_db
+    first = build_lut(path, bits=BITS)
+    second = build_lut(path, bits=BITS)
+    assert first != second
+    assert not os.path.exists(first)
+    assert LutClassifier.load(path, bits=BITS).lut.filename == os.path.abspath(second)
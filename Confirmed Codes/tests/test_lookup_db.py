@@ -0,0 +1,81 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from urine_core.lookup_db import (  # noqa: E402
+    calibration_fingerprint, current_calibration_versions, list_calibration_versions,
+    restore_calibration_version
+)
+from urine_core.pipeline import build_lookup_table, create_database  # noqa: E402
+
+CSV_FOLDER = os.path.join(os.path.dirname(ROOT), "patch_csv_files")
+
+
+def glucose_colors(conn):
+    return conn.execute("""
+        SELECT level_index, r_mean, g_mean, b_mean FROM color_lookup
+        WHERE analyte_code = 'GLU' ORDER BY level_index
+    """).fetchall()
+
+
+def shift_csv(path, delta):
+    with open(path, encoding="utf-8") as f:
+        header, *lines = f.read().splitlines()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(header + "\n")
+        for line in lines:
+            name, r, g, b = line.split(",")
+            if r:
+                r = int(r) + delta
+            f.write(f"{name},{r},{g},{b}\n")
+
+
+@pytest.fixture
+def calibration(tmp_path):
+    csv_folder = tmp_path / "csv"
+    shutil.copytree(CSV_FOLDER, csv_folder)
+    conn = create_database(str(tmp_path / "lookup.db"))
+    yield conn, csv_folder
+    conn.close()
+
+
+def test_restore_then_rebuild(calibration):
+    conn, csv_folder = calibration
+    build_lookup_table(conn, str(csv_folder))
+    first = glucose_colors(conn)
+
+    shift_csv(csv_folder / "GLU.csv", 1)
+    imported, _, _ = build_lookup_table(conn, str(csv_folder))
+    assert imported == ["GLU"]
+    assert glucose_colors(conn) != first
+    assert [v for code, v, _ in list_calibration_versions(conn, "GLU")] == [1, 2]
+    second_fingerprint = calibration_fingerprint(conn)
+
+    restore_calibration_version(conn, "GLU", 1)
+    assert glucose_colors(conn) == first
+    assert current_calibration_versions(conn)["GLU"][0] == 1
+    # Cached results and LUTs of version 2 no longer apply
+    assert calibration_fingerprint(conn) != second_fingerprint
+
+    # An unchanged CSV keeps the restored version; a changed one is imported as a new version
+    imported, _, _ = build_lookup_table(conn, str(csv_folder))
+    assert imported == []
+    assert glucose_colors(conn) == first
+
+    shift_csv(csv_folder / "GLU.csv", 1)
+    imported, _, _ = build_lookup_table(conn, str(csv_folder))
+    assert imported == ["GLU"]
+    assert current_calibration_versions(conn)["GLU"][0] == 3
+    assert glucose_colors(conn) != first
+
+
+def test_restore_unknown_version(calibration):
+    conn, csv_folder = calibration
+    build_lookup_table(conn, str(csv_folder))
+    with pytest.raises(ValueError):
+        restore_calibration_version(conn, "GLU", 5)
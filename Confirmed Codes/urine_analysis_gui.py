@@ -1,12 +1,32 @@
 import os
-import cv2
-import sqlite3
-import numpy as np
-import pandas as pd
+import queue
+import threading
+import traceback
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# PIL, cv2, numpy and pandas are imported on first use so the window opens fast
+from urine_core import pipeline
+from urine_core.calibration_registry import DEFAULT_CALIBRATION, CalibrationRegistry
+from urine_core.constants import IMAGE_EXTENSIONS
+from urine_core.pipeline_metrics import count, metrics, profiled, timed
+from urine_core.quality_gate import ImageRejected, QualityGate
+from urine_core.result_cache import (
+    ResultCache, cache_path, current_fingerprints, strip_key, strip_settings
+)
+from urine_core.results_store import RESULTS_DB_PATH, ResultStore
+from urine_core.thumbnail_cache import THUMBNAIL_SIZE, ThumbnailCache, thumbnail_dir
+
+QUEUE_POLL_MS = 50
+PAGE_SIZE = 50            # strips per page of the results table
+THUMBNAIL_SLOT = 100      # canvas pixels per thumbnail
+THUMBNAIL_WORKERS = 2     # threads decoding thumbnails that scrolled into view
+
+
+class TaskCancelled(Exception):
+    """Raised inside a background task when the operator presses Cancel"""
 
 # ==============================
 # CONFIG
@@ -23,41 +43,39 @@ class UrineAnalysisApp:
         self.csv_folder = r"c:\Users\Ashvatth\OneDrive\Desktop\AshWorks\J\urine\patch_csv_files"
         self.db_path = r"c:\Users\Ashvatth\OneDrive\Desktop\AshWorks\J\urine\Confirmed Codes\urine_color_lookup.db"
         
-        self.PAD_SEQUENCE = [
-            "GLU", "BIL", "KET", "SG", "BLO",
-            "PH", "PRO", "URO", "NIT", "LEU"
-        ]
-        
-        self.PAD_ANALYTE_MAP = {
-            1: ("GLU", "Glucose", "mg/dL (mmol/L)"),
-            2: ("BIL", "Bilirubin", "mg/dL (µmol/L)"),
-            3: ("KET", "Ketone", "mg/dL (mmol/L)"),
-            4: ("SG",  "Specific Gravity", ""),
-            5: ("BLO", "Blood", "Ery/µL"),
-            6: ("PH",  "pH", ""),
-            7: ("PRO", "Protein", "mg/dL (g/L)"),
-            8: ("URO", "Urobilinogen", "mg/dL (µmol/L)"),
-            9: ("NIT", "Nitrite", ""),
-            10: ("LEU", "Leukocyte", "Leu/µL")
-        }
-        
-        self.VALUE_LABELS = {
-            "LEU": ["-", "15 ±", "70 +", "125 ++", "500 +++"],
-            "NIT": ["-", "+"],
-            "URO": ["0.2(3.5)", "1(17)", "2(35)", "4(70)", "8(140)", "12(200)"],
-            "PRO": ["-", "15(0.15)", "30(0.3)", "100(1.0)", "300(3.0)", "2000(20)"],
-            "PH":  ["5.0", "6.0", "6.5", "7.0", "7.5", "8.0", "9.0"],
-            "BLO": ["-", "±", "+", "++", "+++", "5–10", "50 Ery/µL"],
-            "SG":  ["1.000", "1.005", "1.010", "1.015", "1.020", "1.025", "1.030"],
-            "KET": ["-", "5(0.5)", "15(1.5)", "40(4.0)", "80(8.0)", "160(16)"],
-            "BIL": ["-", "1(17)", "2(35)", "4(70)"],
-            "GLU": ["-", "100(5)", "250(15)", "500(30)", "1000(60)", "≥2000(110)"]
-        }
-        
         self.patch_images = []
-        self.results_df = None
+        self.results = None
+        self.calibrations = CalibrationRegistry(self.db_path)
+        self.results_store = None
+        self.result_cache = None
+        self.color_correction = None
+        self.color_correction_loaded = False
+        
+        # Thumbnails: (label, image paths) per item; only the visible ones
+        # hold a PhotoImage, keyed by item index
+        self.thumbnail_cache = None
+        self.thumbnail_lock = threading.Lock()
+        self.thumbnail_items = []
+        self.image_refs = {}
+        self.thumbnail_pending = set()
+        self.thumbnail_generation = 0
+        self.visible_thumbnails = range(0)
+        self.thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        
+        # Batch review: the patch images of every strip in self.results
+        self.strip_paths = []
+        self.page = 0
+        
+        # Background work runs on one worker thread; everything that touches
+        # Tk is marshalled back through ui_queue and handled in process_queue.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.ui_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.busy = False
         
         self.create_widgets()
+        self.root.after(QUEUE_POLL_MS, self.process_queue)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def create_widgets(self):
         # Title
@@ -99,6 +117,11 @@ class UrineAnalysisApp:
                                     activebackground="#229954", **btn_style, state=tk.DISABLED)
         self.btn_analyze.pack(pady=5)
         
+        self.btn_batch = tk.Button(control_frame, text="📚 Review Batch",
+                                  command=self.review_batch, bg="#1abc9c", fg="white",
+                                  activebackground="#17a589", **btn_style)
+        self.btn_batch.pack(pady=5)
+        
         self.btn_export = tk.Button(control_frame, text="💾 Export Results",
                                    command=self.export_results, bg="#e67e22", fg="white",
                                    activebackground="#d35400", **btn_style, state=tk.DISABLED)
@@ -109,6 +132,42 @@ class UrineAnalysisApp:
                                   activebackground="#c0392b", **btn_style)
         self.btn_clear.pack(pady=5)
         
+        self.btn_cancel = tk.Button(control_frame, text="⏹ Cancel",
+                                   command=self.cancel_task, bg="#7f8c8d", fg="white",
+                                   activebackground="#616a6b", **btn_style, state=tk.DISABLED)
+        self.btn_cancel.pack(pady=5)
+        
+        self.btn_metrics = tk.Button(control_frame, text="📊 Export Metrics",
+                                    command=self.export_metrics, bg="#34495e", fg="white",
+                                    activebackground="#2c3e50", **btn_style)
+        self.btn_metrics.pack(pady=5)
+        
+        self.btn_calibrate = tk.Button(control_frame, text="🎯 Calibrate Reader",
+                                      command=self.calibrate_reader, bg="#16a085", fg="white",
+                                      activebackground="#138d75", **btn_style)
+        self.btn_calibrate.pack(pady=5)
+        
+        calibration_frame = tk.Frame(control_frame, bg="white")
+        calibration_frame.pack(fill=tk.X, pady=2)
+        tk.Label(calibration_frame, text="Calibration:", bg="white",
+                 font=("Arial", 9)).pack(side=tk.LEFT)
+        self.calibration_choice = tk.StringVar(value=DEFAULT_CALIBRATION)
+        self.calibration_box = ttk.Combobox(calibration_frame, textvariable=self.calibration_choice,
+                                            state="readonly", width=18,
+                                            postcommand=self.list_calibrations)
+        self.calibration_box.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(5, 0))
+        
+        self.reject_poor = tk.BooleanVar(value=False)
+        tk.Checkbutton(control_frame, text="Reject poor captures", variable=self.reject_poor,
+                       bg="white", font=("Arial", 9)).pack(pady=2)
+        
+        self.profile_next = tk.BooleanVar(value=False)
+        tk.Checkbutton(control_frame, text="Profile next analysis", variable=self.profile_next,
+                       bg="white", font=("Arial", 9)).pack(pady=2)
+        
+        self.progress = ttk.Progressbar(control_frame, orient=tk.HORIZONTAL, mode="determinate")
+        self.progress.pack(fill=tk.X, pady=5)
+        
         # Status frame
         status_frame = tk.LabelFrame(left_panel, text="Status", font=("Arial", 12, "bold"),
                                     bg="white", fg="#2c3e50", padx=10, pady=10)
@@ -132,6 +191,12 @@ class UrineAnalysisApp:
         
         self.image_canvas = tk.Canvas(image_frame, height=120, bg="#ecf0f1")
         self.image_canvas.pack(fill=tk.X)
+        image_scroll = tk.Scrollbar(image_frame, orient=tk.HORIZONTAL,
+                                    command=self.scroll_thumbnails)
+        image_scroll.pack(fill=tk.X)
+        self.image_canvas.configure(xscrollcommand=image_scroll.set)
+        self.image_canvas.bind("<Configure>", lambda e: self.render_visible_thumbnails())
+        self.image_canvas.bind("<Button-1>", self.on_thumbnail_click)
         
         # Results table
         results_frame = tk.LabelFrame(right_panel, text="Analysis Results", font=("Arial", 12, "bold"),
@@ -142,17 +207,32 @@ class UrineAnalysisApp:
         tree_scroll = tk.Scrollbar(results_frame)
         tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         
-        self.results_tree = ttk.Treeview(results_frame, columns=("Pad", "Analyte", "Value", "Unit"),
+        # Paging controls; the table only ever holds one page of strips
+        page_frame = tk.Frame(results_frame, bg="white")
+        page_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(5, 0))
+        self.btn_prev_page = tk.Button(page_frame, text="◀ Prev", width=8, state=tk.DISABLED,
+                                       command=lambda: self.show_page(self.page - 1))
+        self.btn_prev_page.pack(side=tk.LEFT)
+        self.btn_next_page = tk.Button(page_frame, text="Next ▶", width=8, state=tk.DISABLED,
+                                       command=lambda: self.show_page(self.page + 1))
+        self.btn_next_page.pack(side=tk.RIGHT)
+        self.page_label = tk.Label(page_frame, text="", bg="white", font=("Arial", 9))
+        self.page_label.pack(side=tk.LEFT, expand=True)
+        
+        self.results_tree = ttk.Treeview(results_frame,
+                                        columns=("Strip", "Pad", "Analyte", "Value", "Unit"),
                                         show="headings", yscrollcommand=tree_scroll.set, height=15)
         tree_scroll.config(command=self.results_tree.yview)
         
         # Configure columns
+        self.results_tree.heading("Strip", text="Strip")
         self.results_tree.heading("Pad", text="Pad #")
         self.results_tree.heading("Analyte", text="Analyte")
         self.results_tree.heading("Value", text="Value")
         self.results_tree.heading("Unit", text="Unit")
         
-        self.results_tree.column("Pad", width=80, anchor=tk.CENTER)
+        self.results_tree.column("Strip", width=120, anchor=tk.W)
+        self.results_tree.column("Pad", width=60, anchor=tk.CENTER)
         self.results_tree.column("Analyte", width=150, anchor=tk.W)
         self.results_tree.column("Value", width=150, anchor=tk.CENTER)
         self.results_tree.column("Unit", width=200, anchor=tk.W)
@@ -166,139 +246,277 @@ class UrineAnalysisApp:
         self.log_status("System initialized. Ready to start.")
         
     def log_status(self, message):
-        """Add message to status log"""
+        """Add message to status log (safe to call from the worker thread)"""
+        if threading.current_thread() is not threading.main_thread():
+            self.ui_queue.put(("log", message))
+            return
+        
         self.status_text.configure(state=tk.NORMAL)
         timestamp = datetime.now().strftime("%H:%M:%S")
         self.status_text.insert(tk.END, f"[{timestamp}] {message}\n")
         self.status_text.see(tk.END)
         self.status_text.configure(state=tk.DISABLED)
-        self.root.update()
+    
+    def report_progress(self, value, maximum):
+        """Update the progress bar from the worker thread"""
+        self.ui_queue.put(("progress", value, maximum))
+    
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise TaskCancelled()
+    
+    def process_queue(self):
+        """Apply log lines, progress and task results posted by the worker"""
+        try:
+            while True:
+                try:
+                    kind, *payload = self.ui_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.handle_message(kind, payload)
+                except Exception as e:
+                    # A failing handler must not stop the pump for every later task
+                    traceback.print_exc()
+                    try:
+                        self.log_status(f"✗ Internal error handling '{kind}': {e}")
+                    except Exception:
+                        pass
+        finally:
+            self.root.after(QUEUE_POLL_MS, self.process_queue)
+    
+    def handle_message(self, kind, payload):
+        if kind == "log":
+            self.log_status(payload[0])
+        elif kind == "progress":
+            value, maximum = payload
+            self.progress.configure(maximum=max(maximum, 1), value=value)
+        elif kind == "thumbnail":
+            self.draw_thumbnail(*payload)
+        elif kind == "done":
+            callback, result = payload
+            self.finish_task()
+            callback(result)
+        elif kind == "error":
+            callback, error = payload
+            self.finish_task()
+            if isinstance(error, TaskCancelled):
+                self.log_status("⏹ Cancelled")
+            else:
+                callback(error)
+    
+    def run_in_background(self, task, on_done, on_error):
+        """Run task on the worker thread, then call on_done/on_error on the Tk thread"""
+        if self.busy:
+            messagebox.showinfo("Busy", "Please wait for the current task to finish.")
+            return
+        
+        self.busy = True
+        self.cancel_event.clear()
+        self.progress.configure(value=0)
+        for button in (self.btn_select_images, self.btn_init_db, self.btn_analyze,
+                       self.btn_batch, self.btn_clear, self.btn_calibrate):
+            button.configure(state=tk.DISABLED)
+        self.btn_cancel.configure(state=tk.NORMAL)
+        
+        def run():
+            try:
+                self.ui_queue.put(("done", on_done, task()))
+            except Exception as e:
+                self.ui_queue.put(("error", on_error, e))
+        
+        self.executor.submit(run)
+    
+    def finish_task(self):
+        self.busy = False
+        for button in (self.btn_select_images, self.btn_init_db, self.btn_batch,
+                       self.btn_clear, self.btn_calibrate):
+            button.configure(state=tk.NORMAL)
+        self.btn_analyze.configure(state=tk.NORMAL if self.patch_images else tk.DISABLED)
+        self.btn_cancel.configure(state=tk.DISABLED)
+    
+    def cancel_task(self):
+        """Ask the running background task to stop"""
+        self.cancel_event.set()
+        self.log_status("Cancelling...")
+    
+    def on_close(self):
+        self.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.thumbnail_executor.shutdown(wait=False, cancel_futures=True)
+        if self.results_store is not None:
+            self.results_store.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        self.root.destroy()
         
     def select_images(self):
         """Select folder containing patch images"""
         folder = filedialog.askdirectory(title="Select Patch Images Folder")
         if folder:
             self.patch_dir = folder
-            # Load and display images
-            self.load_patch_images()
             self.log_status(f"Selected folder: {folder}")
-            if len(self.patch_images) == 10:
-                self.btn_analyze.configure(state=tk.NORMAL)
-                self.log_status(f"✓ Found {len(self.patch_images)} patch images")
-            else:
-                self.log_status(f"⚠ Warning: Found {len(self.patch_images)} images (expected 10)")
-                messagebox.showwarning("Image Count", 
-                                     f"Expected 10 patch images but found {len(self.patch_images)}")
+            # Thumbnails are decoded in the background
+            self.load_patch_images()
+    
+    def check_image_count(self):
+        """Report whether the selected folder holds a full strip"""
+        if len(self.patch_images) == 10:
+            self.btn_analyze.configure(state=tk.NORMAL)
+            self.log_status(f"✓ Found {len(self.patch_images)} patch images")
+        else:
+            self.log_status(f"⚠ Warning: Found {len(self.patch_images)} images (expected 10)")
+            messagebox.showwarning("Image Count", 
+                                 f"Expected 10 patch images but found {len(self.patch_images)}")
     
     def load_patch_images(self):
         """Load patch images from selected folder"""
         if not self.patch_dir:
             return
             
-        self.patch_images = []
         patch_files = sorted([
             f for f in os.listdir(self.patch_dir)
-            if f.lower().endswith((".jpg", ".jpeg", ".png"))
+            if f.lower().endswith(IMAGE_EXTENSIONS)
         ])
+        self.patch_images = [os.path.join(self.patch_dir, file) for file in patch_files[:10]]
+        
+        # Thumbnails are decoded (or read from the thumbnail cache) as they come into view
+        self.show_patch_images([(f"Pad {idx}", [path])
+                                for idx, path in enumerate(self.patch_images, start=1)])
+        self.check_image_count()
+    
+    def show_patch_images(self, items):
+        """Replace the thumbnail strip with (label, image paths) items (Tk thread only)"""
+        # Drop the previous selection's images; only visible thumbnails keep one
+        self.image_refs = {}
+        self.thumbnail_pending = set()
+        self.thumbnail_generation += 1
+        self.thumbnail_items = items
         
-        # Clear canvas
         self.image_canvas.delete("all")
+        self.image_canvas.configure(scrollregion=(0, 0, len(items) * THUMBNAIL_SLOT, 120))
+        self.image_canvas.xview_moveto(0)
+        self.render_visible_thumbnails()
+    
+    def scroll_thumbnails(self, *args):
+        self.image_canvas.xview(*args)
+        self.render_visible_thumbnails()
+    
+    def render_visible_thumbnails(self):
+        """Draw the thumbnails in view, request missing ones and free the rest"""
+        left = int(self.image_canvas.canvasx(0))
+        width = max(self.image_canvas.winfo_width(), THUMBNAIL_SLOT)
+        first = max(left // THUMBNAIL_SLOT, 0)
+        last = min((left + width) // THUMBNAIL_SLOT + 1, len(self.thumbnail_items))
+        self.visible_thumbnails = range(first, last)
+        
+        for index in list(self.image_refs):
+            if index not in self.visible_thumbnails:
+                del self.image_refs[index]
+                self.image_canvas.delete(f"thumb{index}")
+        
+        for index in self.visible_thumbnails:
+            if index in self.image_refs or index in self.thumbnail_pending:
+                continue
+            self.thumbnail_pending.add(index)
+            self.thumbnail_executor.submit(self.load_thumbnail, self.thumbnail_generation,
+                                           index, self.thumbnail_items[index][1])
+    
+    def load_thumbnail(self, generation, index, paths):
+        """Decode one thumbnail on a thumbnail thread, unless it scrolled out of view meanwhile"""
+        if generation != self.thumbnail_generation or index not in self.visible_thumbnails:
+            self.ui_queue.put(("thumbnail", generation, index, None, False))
+            return
+        try:
+            img = self.open_thumbnail_cache().get(paths)
+        except Exception as e:
+            self.log_status(f"⚠ Could not load thumbnail of {paths[0]}: {e}")
+            img = None
+        self.ui_queue.put(("thumbnail", generation, index, img))
+    
+    def open_thumbnail_cache(self):
+        """Thumbnail cache next to the lookup DB, created on first use (thumbnail threads)"""
+        with self.thumbnail_lock:
+            if self.thumbnail_cache is None:
+                self.thumbnail_cache = ThumbnailCache(thumbnail_dir(self.db_path))
+            return self.thumbnail_cache
+    
+    def trim_thumbnails(self):
+        try:
+            self.open_thumbnail_cache().trim()
+        except OSError as e:
+            self.log_status(f"⚠ Could not trim thumbnail cache: {e}")
+    
+    def draw_thumbnail(self, generation, index, img, loaded=True):
+        """Put a decoded thumbnail on the canvas if it is still wanted (Tk thread only)"""
+        from PIL import ImageTk
         
-        x_offset = 10
-        for idx, file in enumerate(patch_files[:10]):
-            path = os.path.join(self.patch_dir, file)
-            self.patch_images.append(path)
-            
-            # Load and resize for display
-            img = Image.open(path)
-            img.thumbnail((80, 80))
+        if generation != self.thumbnail_generation:
+            return
+        self.thumbnail_pending.discard(index)
+        if index not in self.visible_thumbnails:
+            return
+        if not loaded:
+            # Skipped while out of view, but scrolled back in since
+            self.render_visible_thumbnails()
+            return
+        
+        x_offset = 10 + index * THUMBNAIL_SLOT
+        tag = f"thumb{index}"
+        self.image_canvas.delete(tag)
+        if img is not None:
             photo = ImageTk.PhotoImage(img)
-            
             # Keep reference to prevent garbage collection
-            if not hasattr(self, 'image_refs'):
-                self.image_refs = []
-            self.image_refs.append(photo)
-            
-            self.image_canvas.create_image(x_offset, 10, anchor=tk.NW, image=photo)
-            self.image_canvas.create_text(x_offset + 40, 100, text=f"Pad {idx+1}",
-                                         font=("Arial", 8))
-            x_offset += 100
+            self.image_refs[index] = photo
+            self.image_canvas.create_image(x_offset + (THUMBNAIL_SIZE - img.width) // 2, 10,
+                                           anchor=tk.NW, image=photo, tags=(tag,))
+        else:
+            self.image_refs[index] = None
+        self.image_canvas.create_text(x_offset + THUMBNAIL_SIZE // 2, 100,
+                                      text=self.thumbnail_items[index][0],
+                                      font=("Arial", 8), tags=(tag,))
+    
+    def on_thumbnail_click(self, event):
+        """In batch review, clicking a strip's thumbnail shows its results"""
+        if not self.strip_paths:
+            return
+        index = int(self.image_canvas.canvasx(event.x)) // THUMBNAIL_SLOT
+        if 0 <= index < len(self.strip_paths):
+            self.show_page(index // PAGE_SIZE, select=index)
     
     def initialize_database(self):
         """Initialize database with color lookup data"""
-        try:
-            self.log_status("Initializing database...")
+        self.log_status("Initializing database...")
+        
+        def initialize():
             conn = self.create_database()
-            self.build_lookup_table(conn)
-            conn.close()
+            try:
+                self.build_lookup_table(conn)
+            finally:
+                conn.close()
+        
+        def on_done(_):
             self.log_status("✓ Database initialized successfully")
             messagebox.showinfo("Success", "Database initialized successfully!")
-        except Exception as e:
+        
+        def on_error(e):
             self.log_status(f"✗ Error initializing database: {str(e)}")
             messagebox.showerror("Error", f"Failed to initialize database:\n{str(e)}")
+        
+        self.run_in_background(initialize, on_done, on_error)
     
     def create_database(self):
-        """Create database connection and table"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("DROP TABLE IF EXISTS color_lookup")
-        cursor.execute("""
-            CREATE TABLE color_lookup (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pad_index INTEGER,
-                analyte_code TEXT,
-                analyte_name TEXT,
-                level_index INTEGER,
-                value_label TEXT,
-                r_mean REAL,
-                g_mean REAL,
-                b_mean REAL
-            )
-        """)
-        conn.commit()
-        return conn
+        """Create database connection and tables"""
+        return pipeline.create_database(self.db_path)
     
     def build_lookup_table(self, conn):
-        """Build color lookup table from CSV files"""
-        cursor = conn.cursor()
-        files = os.listdir(self.csv_folder)
-        csv_map = {}
-        
-        for f in files:
-            if f.lower().endswith(".csv"):
-                for analyte in self.PAD_SEQUENCE:
-                    if analyte in f.upper():
-                        csv_map[analyte] = f
-        
-        for pad_index, analyte_code in enumerate(self.PAD_SEQUENCE, start=1):
-            if analyte_code not in csv_map:
-                self.log_status(f"⚠ Warning: No CSV found for {analyte_code}")
-                continue
-                
-            df = pd.read_csv(os.path.join(self.csv_folder, csv_map[analyte_code]))
-            labels = self.VALUE_LABELS[analyte_code]
-            _, analyte_name, _ = self.PAD_ANALYTE_MAP[pad_index]
-            
-            for i, row in df.iterrows():
-                cursor.execute("""
-                    INSERT INTO color_lookup
-                    (pad_index, analyte_code, analyte_name,
-                     level_index, value_label, r_mean, g_mean, b_mean)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    pad_index,
-                    analyte_code,
-                    analyte_name,
-                    i,
-                    labels[min(i, len(labels)-1)],
-                    row["R_mean"],
-                    row["G_mean"],
-                    row["B_mean"]
-                ))
-        
-        conn.commit()
-        self.log_status(f"Loaded data for {len(csv_map)} analytes")
+        """Import changed analyte CSVs into the color lookup table"""
+        imported, unchanged, missing = pipeline.build_lookup_table(conn, self.csv_folder)
+        
+        for analyte_code in missing:
+            self.log_status(f"⚠ Warning: No CSV found for {analyte_code}")
+        
+        self.log_status(f"Imported {len(imported)} analytes, {len(unchanged)} unchanged")
     
     def analyze_samples(self):
         """Analyze patch images and predict values"""
@@ -311,100 +529,304 @@ class UrineAnalysisApp:
                 f"Found {len(self.patch_images)} images instead of 10. Continue anyway?"):
                 return
         
-        try:
-            self.log_status("Starting analysis...")
-            
-            # Extract RGB values
-            pad_rgb_map = self.extract_pad_rgbs()
+        self.log_status("Starting analysis...")
+        
+        profile_path = None
+        if self.profile_next.get():
+            self.profile_next.set(False)
+            profile_path = os.path.join(
+                os.path.dirname(self.db_path),
+                f"urine_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        
+        calibration = self.calibration_choice.get()
+        reject_poor = self.reject_poor.get()
+        
+        def run_analysis():
+            # Recently used calibrations stay loaded; a changed one is reloaded here
+            lookup = self.calibrations.lookup(calibration)
+            if calibration != DEFAULT_CALIBRATION:
+                self.log_status(f"Using calibration '{calibration}'")
             
-            # Connect to database
-            conn = sqlite3.connect(self.db_path)
+            gate = QualityGate() if reject_poor else None
+            results, cached = self.analyze_strip(self.patch_dir, self.patch_images, lookup, gate,
+                                                 lambda: self.extract_pad_rgbs(gate))
+            if cached:
+                self.log_status("✓ Loaded results from cache (no images decoded)")
+            self.load_result_cache().evict()
             
-            # Predict
-            self.results_df = self.predict_all_pads(conn, pad_rgb_map)
-            conn.close()
+            self.store_results(results)
+            return results
+        
+        def analyze():
+            try:
+                if profile_path:
+                    with profiled(profile_path):
+                        results = run_analysis()
+                    self.log_status(f"Profile saved to {profile_path}")
+                else:
+                    results = run_analysis()
+            except TaskCancelled:
+                raise
+            except Exception as e:
+                count("strips_failed")
+                if isinstance(e, ImageRejected):
+                    count("strips_rejected")
+                raise
+            count("strips_processed")
+            return results
+        
+        def on_done(results):
+            self.results = results
+            self.strip_paths = []
             
             # Display results
-            self.display_results()
+            self.show_page(0)
             
             self.log_status("✓ Analysis complete!")
             self.btn_export.configure(state=tk.NORMAL)
-            
-        except Exception as e:
+        
+        def on_error(e):
+            if isinstance(e, ImageRejected):
+                self.log_status(f"✗ Rejected: {str(e)}")
+                messagebox.showwarning("Poor Capture",
+                                       f"{str(e)}\n\nRetake the image and analyze again.")
+                return
             self.log_status(f"✗ Error during analysis: {str(e)}")
             messagebox.showerror("Error", f"Analysis failed:\n{str(e)}")
+        
+        self.run_in_background(analyze, on_done, on_error)
     
-    def extract_pad_rgbs(self):
+    def analyze_strip(self, source, paths, lookup, gate, extract):
+        """(StripResults of one strip, whether it came from the result cache).
+        
+        Unchanged images under an unchanged calibration are not decoded
+        again; otherwise extract() gives the pad colors to match.
+        """
+        index, fingerprint = lookup
+        cache = self.load_result_cache()
+        settings = strip_settings(correction=self.load_color_correction(), gate=gate)
+        key = strip_key(paths, fingerprint, {**settings, "strip_image": False})
+        results = cache.get(key, source)
+        if results is not None:
+            return results, True
+        
+        # Extract RGB values
+        pad_rgb_map = extract()
+        
+        # Predict
+        results = self.predict_all_pads(None, pad_rgb_map, index, gate, source)
+        cache.put(key, fingerprint, results)
+        return results, False
+    
+    def review_batch(self):
+        """Analyze every strip folder under a root and page through the results"""
+        root = filedialog.askdirectory(title="Select Folder of Strip Folders")
+        if not root:
+            return
+        
+        self.log_status(f"Reviewing batch: {root}")
+        calibration = self.calibration_choice.get()
+        reject_poor = self.reject_poor.get()
+        
+        def analyze():
+            from urine_core.strip_folders import find_strip_folders
+            from urine_core.pad_extraction import list_patch_files
+            from urine_core.results import StripResults
+            
+            folders = list(find_strip_folders(root))
+            lookup = self.calibrations.lookup(calibration)
+            gate = QualityGate() if reject_poor else None
+            
+            results = StripResults(capacity=len(folders))
+            strip_paths = []
+            cached = failed = 0
+            for n, folder in enumerate(folders, start=1):
+                self.check_cancelled()
+                self.report_progress(n, len(folders))
+                paths = [os.path.join(folder, f) for f in list_patch_files(folder)]
+                try:
+                    strip, from_cache = self.analyze_strip(
+                        folder, paths, lookup, gate,
+                        lambda: self.correct_colors(pipeline.extract_pad_rgbs(folder, gate=gate)))
+                except ValueError as e:
+                    failed += 1
+                    count("strips_failed")
+                    if isinstance(e, ImageRejected):
+                        count("strips_rejected")
+                    self.log_status(f"✗ {os.path.basename(folder)}: {str(e)}")
+                    continue
+                count("strips_processed")
+                results.extend(strip)
+                strip_paths.append(paths)
+                cached += from_cache
+            
+            self.load_result_cache().evict()
+            if len(results):
+                self.store_results(results)
+            return results, strip_paths, cached, failed
+        
+        def on_done(outcome):
+            results, strip_paths, cached, failed = outcome
+            self.results = results
+            self.strip_paths = strip_paths
+            self.show_patch_images([(os.path.basename(str(source)), paths)
+                                    for source, paths in zip(results.sources, strip_paths)])
+            self.show_page(0)
+            self.thumbnail_executor.submit(self.trim_thumbnails)
+            
+            self.log_status(f"✓ Analyzed {len(results)} strips ({cached} from cache, "
+                            f"{failed} failed)")
+            if len(results):
+                self.btn_export.configure(state=tk.NORMAL)
+        
+        def on_error(e):
+            self.log_status(f"✗ Error during batch review: {str(e)}")
+            messagebox.showerror("Error", f"Batch review failed:\n{str(e)}")
+        
+        self.run_in_background(analyze, on_done, on_error)
+    
+    def extract_pad_rgbs(self, gate=None):
         """Extract RGB values from patch images"""
+        from urine_core.pad_extraction import read_pad_rgb
+        
         pad_rgb_map = {}
         
         for idx, path in enumerate(self.patch_images, start=1):
-            img = cv2.imread(path)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            self.check_cancelled()
+            mean_rgb = read_pad_rgb(path, gate=gate)
             
-            pixels = img.reshape(-1, 3)
-            mean_rgb = np.mean(pixels, axis=0).astype(int)
-            
-            pad_rgb_map[idx] = mean_rgb.tolist()
-            self.log_status(f"Pad {idx}: RGB = {mean_rgb.tolist()}")
+            pad_rgb_map[idx] = mean_rgb
+            self.log_status(f"Pad {idx}: RGB = {mean_rgb}")
+            self.report_progress(idx, len(self.patch_images))
+        
+        correction = self.load_color_correction()
+        if correction is not None:
+            pad_rgb_map = self.correct_colors(pad_rgb_map)
+            self.log_status(f"Applied color correction for '{correction.device}'")
         
         return pad_rgb_map
     
-    def predict_all_pads(self, conn, pad_rgb_map):
-        """Predict values for all pads"""
-        results = []
+    def correct_colors(self, pad_rgb_map):
+        """Pad colors through this machine's color correction, if one is stored"""
+        correction = self.load_color_correction()
+        if correction is None:
+            return pad_rgb_map
+        with timed("color_correction"):
+            return correction.apply_map(pad_rgb_map)
+    
+    def load_color_correction(self):
+        """This machine's stored color correction, read once per session"""
+        if not self.color_correction_loaded:
+            from urine_core.color_correction import load_correction
+            self.color_correction = load_correction(self.db_path)
+            self.color_correction_loaded = True
+        return self.color_correction
+    
+    def calibrate_reader(self):
+        """Fit this machine's color correction from a photo of the white reference patch"""
+        path = filedialog.askopenfilename(
+            title="Select White Reference Patch",
+            filetypes=[("Image files", " ".join(f"*{ext}" for ext in IMAGE_EXTENSIONS)),
+                       ("All files", "*.*")]
+        )
+        if not path:
+            return
         
-        for pad_index, rgb in pad_rgb_map.items():
-            rgb = np.array(rgb, dtype=float)
-            
-            df = pd.read_sql("""
-                SELECT level_index, value_label, r_mean, g_mean, b_mean
-                FROM color_lookup
-                WHERE pad_index = ?
-            """, conn, params=(pad_index,))
-            
-            if df.empty:
+        self.log_status("Calibrating reader...")
+        
+        def calibrate():
+            from urine_core.color_correction import calibrate_white, measure_patch
+            white = measure_patch(path)
+            self.log_status(f"White reference: RGB = {white}")
+            return calibrate_white(white, db_path=self.db_path)
+        
+        def on_done(correction):
+            self.color_correction = correction
+            self.color_correction_loaded = True
+            self.log_status(f"✓ Color correction stored for '{correction.device}'")
+        
+        def on_error(e):
+            self.log_status(f"✗ Error calibrating reader: {str(e)}")
+            messagebox.showerror("Error", f"Calibration failed:\n{str(e)}")
+        
+        self.run_in_background(calibrate, on_done, on_error)
+    
+    def list_calibrations(self):
+        """Fill the calibration dropdown with the registered calibrations"""
+        try:
+            self.calibration_box["values"] = self.calibrations.names()
+        except (OSError, ValueError) as e:
+            self.log_status(f"⚠ Could not read calibrations: {e}")
+    
+    def predict_all_pads(self, conn, pad_rgb_map, index, gate=None, source=None):
+        """Predict values for all pads"""
+        for pad_index in pad_rgb_map:
+            if not index.has_pad(pad_index):
                 self.log_status(f"⚠ No reference data for pad {pad_index}")
-                continue
-            
-            ref_rgb = df[["r_mean", "g_mean", "b_mean"]].values
-            distances = np.linalg.norm(ref_rgb - rgb, axis=1)
-            
-            best_idx = distances.argmin()
-            best = df.iloc[best_idx]
-            
-            _, analyte, unit = self.PAD_ANALYTE_MAP[pad_index]
-            
-            results.append({
-                "Pad": pad_index,
-                "Analyte": analyte,
-                "Level": int(best["level_index"]),
-                "Value": best["value_label"],
-                "Unit": unit
-            })
-        
-        return pd.DataFrame(results)
-    
-    def display_results(self):
-        """Display results in treeview"""
-        # Clear existing results
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
         
-        if self.results_df is None or self.results_df.empty:
+        return pipeline.predict_all_pads(conn, pad_rgb_map, index=index,
+                                         source=source or self.patch_dir, gate=gate)
+    
+    def load_result_cache(self):
+        """Result cache next to the lookup DB, opened on first use"""
+        if self.result_cache is None:
+            self.result_cache = ResultCache(cache_path(self.db_path))
+            self.result_cache.invalidate(current_fingerprints(self.db_path))
+        return self.result_cache
+    
+    def store_results(self, results):
+        """Append results to the results database next to the lookup DB"""
+        if self.results_store is None:
+            store_path = os.path.join(os.path.dirname(self.db_path), RESULTS_DB_PATH)
+            self.results_store = ResultStore(store_path)
+        
+        self.results_store.append(results.rows())
+        self.results_store.flush()
+        self.log_status(f"Results stored in {self.results_store.db_path}")
+    
+    def display_results(self, select=None):
+        """Display the current page of results in treeview"""
+        # Clear existing results
+        self.results_tree.delete(*self.results_tree.get_children())
+        
+        strips = len(self.results) if self.results is not None else 0
+        pages = max(-(-strips // PAGE_SIZE), 1)
+        self.btn_prev_page.configure(state=tk.NORMAL if self.page > 0 else tk.DISABLED)
+        self.btn_next_page.configure(state=tk.NORMAL if self.page < pages - 1 else tk.DISABLED)
+        if not strips:
+            self.page_label.configure(text="")
             return
         
-        # Insert new results
-        for idx, row in self.results_df.iterrows():
-            tag = 'evenrow' if idx % 2 == 0 else 'oddrow'
-            self.results_tree.insert("", tk.END, 
-                                   values=(row["Pad"], row["Analyte"], 
-                                          row["Value"], row["Unit"]),
-                                   tags=(tag,))
+        # Insert only this page's rows; hundreds of strips stay out of the widget
+        start = self.page * PAGE_SIZE
+        stop = min(start + PAGE_SIZE, strips)
+        self.page_label.configure(
+            text=f"Strips {start + 1}–{stop} of {strips} (page {self.page + 1}/{pages})")
+        
+        idx = 0
+        for strip in range(start, stop):
+            first = None
+            for source, pad, analyte, _, value, unit, *_ in self.results.rows(strip, strip + 1):
+                tag = 'evenrow' if idx % 2 == 0 else 'oddrow'
+                item = self.results_tree.insert("", tk.END, 
+                                                values=(os.path.basename(str(source)), pad,
+                                                        analyte, value, unit),
+                                                tags=(tag,))
+                first = first or item
+                idx += 1
+            if strip == select and first is not None:
+                self.results_tree.selection_set(first)
+                self.results_tree.see(first)
+    
+    def show_page(self, page, select=None):
+        """Show one page of PAGE_SIZE strips; select highlights a strip by its index"""
+        strips = len(self.results) if self.results is not None else 0
+        self.page = min(max(page, 0), max(-(-strips // PAGE_SIZE) - 1, 0))
+        self.display_results(select)
     
     def export_results(self):
         """Export results to CSV file"""
-        if self.results_df is None or self.results_df.empty:
+        if self.results is None or self.results.result_count() == 0:
             messagebox.showwarning("No Results", "No results to export!")
             return
         
@@ -416,24 +838,42 @@ class UrineAnalysisApp:
         
         if filename:
             try:
-                self.results_df.to_csv(filename, index=False)
+                with timed("export"):
+                    self.results.to_dataframe(with_source=len(self.results) > 1).to_csv(
+                        filename, index=False)
                 self.log_status(f"✓ Results exported to: {filename}")
                 messagebox.showinfo("Success", f"Results exported successfully to:\n{filename}")
             except Exception as e:
                 self.log_status(f"✗ Error exporting results: {str(e)}")
                 messagebox.showerror("Error", f"Failed to export results:\n{str(e)}")
     
+    def export_metrics(self):
+        """Save stage timings and counters (Prometheus text or JSON)"""
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON snapshot", "*.json"), ("Prometheus text", "*.prom"),
+                       ("All files", "*.*")],
+            initialfile=f"urine_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        
+        if filename:
+            try:
+                metrics.write(filename)
+                self.log_status(f"✓ Metrics exported to: {filename}")
+            except Exception as e:
+                self.log_status(f"✗ Error exporting metrics: {str(e)}")
+                messagebox.showerror("Error", f"Failed to export metrics:\n{str(e)}")
+    
     def clear_all(self):
         """Clear all data and reset"""
         if messagebox.askyesno("Confirm", "Clear all data and reset?"):
             self.patch_images = []
-            self.results_df = None
-            self.image_refs = []
+            self.results = None
+            self.strip_paths = []
             
             # Clear displays
-            self.image_canvas.delete("all")
-            for item in self.results_tree.get_children():
-                self.results_tree.delete(item)
+            self.show_patch_images([])
+            self.show_page(0)
             
             # Disable buttons
             self.btn_analyze.configure(state=tk.DISABLED)
@@ -0,0 +1,43 @@
+"""Shared urine strip analysis core used by the GUI, the CLIs and the server.
+
+Only the constants are loaded up front. Everything else is imported on
+first use, so scripts that only touch the databases never pay for
+cv2, numpy or pandas.
+"""
+import importlib
+
+from .constants import (
+    DB_PATH, IMAGE_EXTENSIONS, STATISTICS, METRICS,
+    PAD_SEQUENCE, PAD_ANALYTE_MAP, VALUE_LABELS
+)
+
+_LAZY_ATTRIBUTES = {
+    "create_database": "pipeline",
+    "build_lookup_table": "pipeline",
+    "extract_pad_rgbs": "pipeline",
+    "load_reference_index": "pipeline",
+    "predict_all_pads": "pipeline",
+    "ReferenceIndex": "reference_index",
+    "SampleIndex": "sample_index",
+    "LutClassifier": "color_lut",
+    "ColorCorrection": "color_correction",
+    "load_correction": "color_correction",
+    "CalibrationRegistry": "calibration_registry",
+    "QualityGate": "quality_gate",
+    "ResultCache": "result_cache",
+    "ResultStore": "results_store",
+    "StripResults": "results",
+    "ThumbnailCache": "thumbnail_cache",
+    "find_strip_folders": "strip_folders",
+    "find_strip_images": "strip_folders",
+    "metrics": "pipeline_metrics",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from .constants import DB_PATH, PAD_SEQUENCE
+from .pipeline_metrics import count, timed
+
+# ==============================
+# CONFIG
+# ==============================
+DEFAULT_CALIBRATION = "default"  # the lookup database itself
+AUTO_CALIBRATION = "auto"        # pick per strip from the folder path
+REGISTRY_FILE = "registry.json"
+MAX_LOADED = 4                   # reference indexes kept in memory at once
+CHECK_INTERVAL = 1.0             # seconds between checks for new or changed calibrations
+
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9][\w.-]*$")
+
+# ==============================
+# CALIBRATION REGISTRY
+# ==============================
+# Every named calibration (a strip lot, a reader model, a date) is its own
+# lookup database in <db stem>_calibrations/, built and versioned exactly
+# like the main one; registry.json next to them records lot, device and
+# date. The main database stays available as "default", so nothing
+# changes until a calibration is asked for by name.
+
+def registry_dir(db_path=DB_PATH):
+    return os.path.splitext(db_path)[0] + "_calibrations"
+
+
+def load_registry(db_path=DB_PATH):
+    """{name: entry} of every registered calibration (empty if none)"""
+    path = os.path.join(registry_dir(db_path), REGISTRY_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_registry(entries, db_path=DB_PATH):
+    folder = registry_dir(db_path)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, REGISTRY_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def calibration_db(name=None, db_path=DB_PATH, entries=None):
+    """Lookup database of a calibration; None or "default" is db_path itself"""
+    if name in (None, "", DEFAULT_CALIBRATION):
+        return db_path
+    entries = load_registry(db_path) if entries is None else entries
+    if name not in entries:
+        raise ValueError(f"Unknown calibration '{name}'; registered: "
+                         f"{', '.join(sorted(entries)) or 'none'}")
+    return os.path.join(registry_dir(db_path), entries[name]["file"])
+
+
+def add_calibration(name, db_path=DB_PATH, csv_folder=None, from_db=None, samples=(),
+                    lot=None, device=None, date=None):
+    """Create or update a named calibration from analyte CSVs or a copy of a lookup database.
+
+    Updating a calibration from CSVs only re-imports the analytes whose
+    CSV changed, so services using it pick up just that change.
+    Returns (entry, imported analyte codes).
+    """
+    from .pipeline import build_lookup_table, create_database
+
+    if not NAME_PATTERN.match(name) or name in (DEFAULT_CALIBRATION, AUTO_CALIBRATION):
+        raise ValueError(f"Invalid calibration name '{name}'")
+    if (csv_folder is None) == (from_db is None):
+        raise ValueError("Give either a CSV folder or a database to copy")
+
+    entries = load_registry(db_path)
+    entry = entries.get(name, {"file": f"{name}.db",
+                               "created": datetime.now().isoformat(timespec="seconds")})
+    for key, value in (("lot", lot), ("device", device), ("date", date)):
+        if value is not None:
+            entry[key] = value
+
+    folder = registry_dir(db_path)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, entry["file"])
+
+    imported = []
+    if from_db:
+        # Copy to a side file first, so readers never see a half-written database
+        shutil.copyfile(from_db, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        imported = list(PAD_SEQUENCE)
+    else:
+        conn = create_database(path)
+        try:
+            imported, _, missing = build_lookup_table(conn, csv_folder)
+            if samples:
+                from .lookup_db import import_reference_samples
+                import_reference_samples(conn, list(samples), PAD_SEQUENCE)
+        finally:
+            conn.close()
+        if len(missing) == len(PAD_SEQUENCE):
+            raise ValueError(f"No analyte CSVs found in {csv_folder}")
+
+    entry["updated"] = datetime.now().isoformat(timespec="seconds")
+    entries[name] = entry
+    save_registry(entries, db_path)
+    return entry, imported
+
+
+def remove_calibration(name, db_path=DB_PATH):
+    entries = load_registry(db_path)
+    entry = entries.pop(name, None)
+    if entry is None:
+        raise ValueError(f"Unknown calibration '{name}'")
+    save_registry(entries, db_path)
+    path = os.path.join(registry_dir(db_path), entry["file"])
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def select_calibration(entries, lot=None, device=None):
+    """Name of the newest calibration matching a lot and/or device, or None"""
+    matches = [
+        (entry.get("date") or entry.get("created", ""), name)
+        for name, entry in entries.items()
+        if (lot is None or entry.get("lot") == lot)
+        and (device is None or entry.get("device") == device)
+    ]
+    return max(matches)[1] if matches else None
+
+
+def calibration_for_path(entries, path):
+    """Calibration named by the deepest folder of a strip's path, e.g. inbox/LOT-42/strip_1"""
+    parts = os.path.normpath(os.path.abspath(path)).split(os.sep)
+    for part in reversed(parts):
+        if part in entries:
+            return part
+    return None
+
+# ==============================
+# LRU CACHE OF LOADED INDEXES
+# ==============================
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CalibrationRegistry:
+    """Reference indexes of named calibrations, loaded on demand and kept in an LRU cache.
+
+    At most max_loaded indexes stay in memory; the least recently used
+    one is dropped first. The registry file is re-read at most every
+    check_interval seconds, so new calibrations become available, and a
+    cached calibration's database is stat()ed on every use: a changed
+    one is reloaded (only if its calibration_fingerprint really
+    changed), so a running batch or service never needs a restart.
+    """
+
+    def __init__(self, db_path=DB_PATH, statistic="mean", metric="rgb", use_lut=False,
+                 max_loaded=MAX_LOADED, check_interval=CHECK_INTERVAL):
+        self.db_path = db_path
+        self.statistic = statistic
+        self.metric = metric
+        self.use_lut = use_lut
+        self.max_loaded = max(1, max_loaded)
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()   # name -> (index, file stamp, fingerprint)
+        self.entries = {}
+        self.registry_stamp = None
+        self.checked_at = None
+
+    def refresh(self, force=False):
+        """Re-read registry.json if it changed since the last check"""
+        with self.lock:
+            self._refresh(force)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        stamp = _file_stamp(os.path.join(registry_dir(self.db_path), REGISTRY_FILE))
+        if force or stamp != self.registry_stamp:
+            self.entries = load_registry(self.db_path)
+            self.registry_stamp = stamp
+        for name in list(self.loaded):
+            if name != DEFAULT_CALIBRATION and name not in self.entries:
+                del self.loaded[name]
+
+    def names(self):
+        with self.lock:
+            self._refresh()
+            return [DEFAULT_CALIBRATION, *sorted(self.entries)]
+
+    def resolve(self, source):
+        """Calibration for a strip under AUTO_CALIBRATION (default if its path names none)"""
+        with self.lock:
+            self._refresh()
+            return calibration_for_path(self.entries, source) or DEFAULT_CALIBRATION
+
+    def _load(self, path):
+        with timed("calibration_load"):
+            if self.use_lut:
+                from .color_lut import LutClassifier
+                return LutClassifier.load_or_build(path, statistic=self.statistic,
+                                                   metric=self.metric)
+            from .pipeline import load_reference_index
+            conn = sqlite3.connect(path)
+            try:
+                return load_reference_index(conn, self.statistic, self.metric)
+            finally:
+                conn.close()
+
+    def _fingerprint(self, path):
+        from .lookup_db import calibration_fingerprint
+        conn = sqlite3.connect(path)
+        try:
+            return calibration_fingerprint(conn)
+        finally:
+            conn.close()
+
+    def index(self, name=None):
+        """Reference index of a calibration (None: the default one)"""
+        return self.lookup(name)[0]
+
+    def lookup(self, name=None):
+        """(reference index, calibration fingerprint) of a calibration"""
+        name = name or DEFAULT_CALIBRATION
+        with self.lock:
+            self._refresh()
+            path = calibration_db(name, self.db_path, self.entries)
+            stamp = _file_stamp(path)
+            if stamp is None:
+                raise ValueError(f"Calibration database not found: {path}")
+
+            cached = self.loaded.get(name)
+            if cached is not None:
+                index, cached_stamp, fingerprint = cached
+                if cached_stamp == stamp or self._fingerprint(path) == fingerprint:
+                    self.loaded[name] = (index, stamp, fingerprint)
+                    self.loaded.move_to_end(name)
+                    count("calibration_cache_hits")
+                    return index, fingerprint
+
+            fingerprint = self._fingerprint(path)
+            index = self._load(path)
+            count("calibration_loads")
+            self.loaded[name] = (index, stamp, fingerprint)
+            self.loaded.move_to_end(name)
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+            return index, fingerprint
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage named calibrations (strip lots, readers)")
+    parser.add_argument("--db", default=DB_PATH, help="main color lookup database")
+    commands = parser.add_subparsers(dest="command")
+
+    add = commands.add_parser("add", help="create or update a calibration")
+    add.add_argument("name")
+    source = add.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="folder of analyte CSVs")
+    source.add_argument("--from-db", help="copy an existing lookup database")
+    add.add_argument("--samples", nargs="*", default=(), help="multi-sample reference CSVs")
+    add.add_argument("--lot", help="strip lot")
+    add.add_argument("--device", help="reader model or name")
+    add.add_argument("--date", help="calibration date (YYYY-MM-DD)")
+
+    remove = commands.add_parser("remove", help="delete a calibration")
+    remove.add_argument("name")
+
+    select = commands.add_parser("select", help="newest calibration for a lot and/or device")
+    select.add_argument("--lot")
+    select.add_argument("--device")
+
+    commands.add_parser("list", help="show the registered calibrations")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "add":
+            entry, imported = add_calibration(args.name, args.db, args.csv, args.from_db,
+                                              args.samples, args.lot, args.device, args.date)
+            print(f"✓ Calibration '{args.name}' saved ({len(imported)} analytes imported)")
+        elif args.command == "remove":
+            remove_calibration(args.name, args.db)
+            print(f"✓ Removed calibration '{args.name}'")
+        elif args.command == "select":
+            name = select_calibration(load_registry(args.db), args.lot, args.device)
+            if name is None:
+                raise ValueError("No calibration matches")
+            print(name)
+        else:
+            entries = load_registry(args.db)
+            print(f"{DEFAULT_CALIBRATION}: {args.db}")
+            for name, entry in sorted(entries.items()):
+                print(f"{name}: lot {entry.get('lot', '-')}, device {entry.get('device', '-')}, "
+                      f"date {entry.get('date', '-')}, updated {entry['updated']}")
+    except ValueError as e:
+        raise SystemExit(f"✗ {e}")
@@ -0,0 +1,230 @@
+import os
+import csv
+import json
+import socket
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from .color_metrics import linear_to_srgb, srgb_to_linear
+from .constants import DB_PATH
+
+# ==============================
+# CONFIG
+# ==============================
+REFERENCE_DEVICE = "reference"   # the reader the calibration CSVs were measured with
+DEFAULT_WHITE = (255, 255, 255)  # target white when no reference reader is stored
+MIN_AFFINE_SAMPLES = 4           # fewer reference colors -> per-channel gains only
+PATCH_ROI = 0.5                  # central share of a reference patch photo that is sampled
+
+# ==============================
+# COLOR CORRECTION
+# ==============================
+# Readers differ in white balance and exposure, so the same pad reads as a
+# different RGB on each of them. A photo of a white (or gray) reference
+# patch, the bare strip margin, or a card of known colors gives pairs of
+# (measured, target) colors; a 3x4 matrix fitted in linear RGB maps one
+# reader's colors onto the reader the calibration CSVs were made with.
+
+def default_device():
+    """Name the correction of this machine's reader is stored under"""
+    return socket.gethostname()
+
+
+class ColorCorrection:
+    """Affine color correction in linear RGB, applied to whole batches of pad means"""
+
+    def __init__(self, matrix, device=None, residual=0.0, samples=0, created=None):
+        self.matrix = np.asarray(matrix, dtype=np.float64).reshape(3, 4)
+        self.device = device
+        self.residual = residual
+        self.samples = samples
+        self.created = created or datetime.now().isoformat(timespec="seconds")
+
+    @classmethod
+    def identity(cls, device=None):
+        return cls(np.hstack([np.eye(3), np.zeros((3, 1))]), device)
+
+    @classmethod
+    def fit(cls, measured, target, device=None):
+        """Least-squares fit mapping measured [R, G, B] colors onto target colors.
+
+        One or a few reference colors (a white patch, the strip margin) only
+        fix per-channel gains; MIN_AFFINE_SAMPLES or more fit a full
+        affine matrix, which also corrects cross-channel tints.
+        """
+        measured = np.asarray(measured, dtype=np.float64).reshape(-1, 3)
+        target = np.asarray(target, dtype=np.float64).reshape(-1, 3)
+        if len(measured) != len(target) or len(measured) == 0:
+            raise ValueError("Need the same, non-zero number of measured and target colors")
+
+        m, t = srgb_to_linear(measured), srgb_to_linear(target)
+        if len(m) < MIN_AFFINE_SAMPLES:
+            gains = (m * t).sum(axis=0) / np.maximum((m * m).sum(axis=0), 1e-12)
+            matrix = np.hstack([np.diag(gains), np.zeros((3, 1))])
+        else:
+            design = np.hstack([m, np.ones((len(m), 1))])
+            solution, *_ = np.linalg.lstsq(design, t, rcond=None)
+            matrix = solution.T
+
+        correction = cls(matrix, device, samples=len(m))
+        correction.residual = float(np.abs(correction.apply(measured) - target).mean())
+        return correction
+
+    def apply(self, rgbs):
+        """Corrected 8-bit colors for an (..., 3) array of [R, G, B]"""
+        linear = srgb_to_linear(rgbs)
+        corrected = linear @ self.matrix[:, :3].T + self.matrix[:, 3]
+        return np.round(linear_to_srgb(corrected)).astype(int)
+
+    def apply_map(self, pad_rgb_map):
+        """{pad_index: [R, G, B]} with every pad corrected in one transform"""
+        pads = list(pad_rgb_map)
+        if not pads:
+            return {}
+        corrected = self.apply([pad_rgb_map[p] for p in pads])
+        return {p: rgb.tolist() for p, rgb in zip(pads, corrected)}
+
+    def to_dict(self):
+        return {
+            "matrix": np.round(self.matrix, 6).tolist(),
+            "residual": round(self.residual, 3),
+            "samples": self.samples,
+            "created": self.created,
+        }
+
+    @classmethod
+    def from_dict(cls, data, device=None):
+        return cls(data["matrix"], device, data.get("residual", 0.0),
+                   data.get("samples", 0), data.get("created"))
+
+# ==============================
+# PER-DEVICE CACHE
+# ==============================
+def correction_path(db_path):
+    """JSON file of per-device corrections stored next to the lookup database"""
+    return os.path.splitext(db_path)[0] + ".color_correction.json"
+
+
+def load_corrections(db_path=DB_PATH):
+    """{device: entry} of every stored correction (empty if none were saved)"""
+    path = correction_path(db_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_correction(db_path=DB_PATH, device=None):
+    """Stored ColorCorrection of a device (default: this machine), or None"""
+    device = device or default_device()
+    entry = load_corrections(db_path).get(device)
+    return ColorCorrection.from_dict(entry, device) if entry else None
+
+
+def save_correction(correction, db_path=DB_PATH, white=None):
+    """Store a correction under its device, replacing the file atomically"""
+    entries = load_corrections(db_path)
+    entry = correction.to_dict()
+    if white is not None:
+        entry["white"] = [int(v) for v in white]
+    entries[correction.device] = entry
+
+    path = correction_path(db_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def reference_white(db_path=DB_PATH):
+    """White as seen by the reference reader, if one was stored"""
+    entry = load_corrections(db_path).get(REFERENCE_DEVICE)
+    if entry and "white" in entry:
+        return entry["white"], True
+    return list(DEFAULT_WHITE), False
+
+# ==============================
+# MEASURING REFERENCES
+# ==============================
+def measure_patch(path, roi_fraction=PATCH_ROI):
+    """[R, G, B] of a reference patch photo (median, so specks don't pull it)"""
+    from .pad_extraction import read_pad_rgb
+    return read_pad_rgb(path, roi_fraction=roi_fraction, statistic="median")
+
+
+def measure_strip_margin(path):
+    """[R, G, B] of the bare strip between the pads of a whole-strip photo"""
+    import cv2
+    from .strip_localization import locate_pads, strip_margin_rgb
+
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not read image: {path}")
+    return strip_margin_rgb(img, locate_pads(img)).tolist()
+
+
+def read_card(card_csv):
+    """(measured, target) colors of a reference card CSV with columns image,R,G,B"""
+    folder = os.path.dirname(os.path.abspath(card_csv))
+    measured, target = [], []
+    with open(card_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            measured.append(measure_patch(os.path.join(folder, row["image"])))
+            target.append([int(row["R"]), int(row["G"]), int(row["B"])])
+    return measured, target
+
+
+def calibrate_white(white_rgb, device=None, db_path=DB_PATH, target=None):
+    """Fit and store the correction of a device from one white measurement"""
+    device = device or default_device()
+    if device == REFERENCE_DEVICE:
+        target = white_rgb
+    elif target is None:
+        target, _ = reference_white(db_path)
+    correction = ColorCorrection.fit([white_rgb], [target], device)
+    save_correction(correction, db_path, white=white_rgb)
+    return correction
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit and store a per-reader color correction")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--device", default=None,
+                        help=f"reader name (default: this machine; '{REFERENCE_DEVICE}' "
+                             "for the reader the calibration CSVs were made with)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--white", help="photo of a white or gray reference patch")
+    source.add_argument("--strip", help="whole-strip photo; its bare margin is the white reference")
+    source.add_argument("--card", help="CSV of reference patches with columns image,R,G,B")
+    parser.add_argument("--target", type=int, nargs=3, metavar=("R", "G", "B"),
+                        help="true color of the white reference (default: the reference reader's white)")
+    parser.add_argument("--list", action="store_true", help="show the stored corrections")
+    args = parser.parse_args()
+
+    if args.list or not (args.white or args.strip or args.card):
+        entries = load_corrections(args.db)
+        if not entries:
+            print(f"No color corrections stored in {correction_path(args.db)}")
+        for device, entry in entries.items():
+            print(f"{device}: {entry['samples']} sample(s), residual {entry['residual']}, "
+                  f"created {entry['created']}, white {entry.get('white', '-')}")
+        raise SystemExit(0)
+
+    device = args.device or default_device()
+    if args.card:
+        measured, target = read_card(args.card)
+        correction = ColorCorrection.fit(measured, target, device)
+        save_correction(correction, args.db)
+    else:
+        white = measure_patch(args.white) if args.white else measure_strip_margin(args.strip)
+        if device != REFERENCE_DEVICE and args.target is None and not reference_white(args.db)[1]:
+            print(f"⚠ No '{REFERENCE_DEVICE}' reader stored; correcting white to {list(DEFAULT_WHITE)}")
+        correction = calibrate_white(white, device, args.db, args.target)
+        print(f"Measured white: {white}")
+
+    print(f"✓ Stored color correction for '{device}' "
+          f"(residual {correction.residual:.2f}) in {correction_path(args.db)}")
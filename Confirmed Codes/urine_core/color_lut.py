@@ -0,0 +1,263 @@
+import os
+import glob
+import json
+import uuid
+import sqlite3
+import argparse
+
+import numpy as np
+
+from .constants import DB_PATH, METRICS
+from .lookup_db import calibration_fingerprint
+from .pipeline import load_reference_index
+from .reference_index import REFERENCE_STATISTIC
+
+# ==============================
+# CONFIG
+# ==============================
+LUT_BITS = 6             # 64 levels per channel -> 64^3 cells per pad
+BUILD_CHUNK = 16384      # cube cells matched per batch while building
+NO_LEVEL = 255           # cell value for pads without references
+LOAD_ATTEMPTS = 3        # re-reads of the metadata when a rebuild removed its table
+
+# ==============================
+# LUT FILES
+# ==============================
+# Each statistic, metric and resolution gets its own files, so switching
+# settings never throws away another setting's table. Every build writes
+# a new table file named by a random table id, then publishes it by
+# replacing the .json metadata that names it; a reader always maps the
+# table its metadata names, so it never pairs old labels with a new table.
+
+def lut_stem(db_path, bits=LUT_BITS, statistic="mean", metric="rgb"):
+    """Common prefix of one setting's LUT files next to the lookup database"""
+    return f"{os.path.splitext(db_path)[0]}.lut_{statistic}_{metric}_{bits}"
+
+
+def _remove_old_tables(stem, keep):
+    for path in glob.glob(glob.escape(stem) + ".*.npy"):
+        if os.path.basename(path) != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped by a reader on Windows; the next build retries
+                pass
+
+
+def build_lut(db_path, bits=LUT_BITS, statistic="mean", metric="rgb"):
+    """Precompute the nearest level of every quantized RGB cell for every pad.
+
+    The table is a (pads, 2^bits, 2^bits, 2^bits) uint8 array of level
+    slots, written as a memory-mappable .npy file next to db_path.
+    Several processes may build the same table at once; each writes its
+    own files and the last one to publish its metadata wins. Returns the
+    table path.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        index = load_reference_index(conn, statistic, metric)
+        fingerprint = calibration_fingerprint(conn)
+    finally:
+        conn.close()
+
+    if index.level_indices.shape[1] >= NO_LEVEL:
+        raise ValueError("Too many levels per pad for a uint8 LUT")
+
+    size = 1 << bits
+    step = 256 // size
+    centers = np.arange(size) * step + (step - 1) / 2
+    cube = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 3)
+
+    # Written under temporary names and swapped in, so workers that
+    # already mapped the old table never see a half-written one
+    stem = lut_stem(db_path, bits, statistic, metric)
+    table_id = uuid.uuid4().hex
+    lut_path = f"{stem}.{table_id}.npy"
+    meta_path = stem + ".json"
+    meta_tmp = f"{meta_path}.{table_id}.tmp"
+    published = False
+    try:
+        lut = np.lib.format.open_memmap(lut_path, mode="w+", dtype=np.uint8,
+                                        shape=(len(index), size, size, size))
+        flat = lut.reshape(len(index), -1)
+
+        for start in range(0, len(cube), BUILD_CHUNK):
+            chunk = cube[start:start + BUILD_CHUNK]
+            samples = np.broadcast_to(chunk[:, None, :], (len(chunk), len(index), 3))
+            best, distance = index.match(samples)
+            best = np.where(np.isfinite(distance), best, NO_LEVEL)
+            flat[:, start:start + len(chunk)] = best.T
+
+        lut.flush()
+        del lut, flat
+
+        meta = {
+            "table": os.path.basename(lut_path),
+            "bits": bits,
+            "statistic": statistic,
+            "metric": metric,
+            "fingerprint": fingerprint,
+            "pad_indices": index.pad_indices.tolist(),
+            "level_indices": index.level_indices.tolist(),
+            "value_labels": index.value_labels.tolist(),
+        }
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+
+        os.replace(meta_tmp, meta_path)
+        published = True
+    finally:
+        if not published:
+            for path in (lut_path, meta_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    _remove_old_tables(stem, os.path.basename(lut_path))
+    return lut_path
+
+# ==============================
+# LUT CLASSIFIER
+# ==============================
+class LutClassifier:
+    """Nearest-level classification by a single memory-mapped table lookup.
+
+    Offers the same predict() as ReferenceIndex/SampleIndex, so it can be handed to
+    predict_all_pads; distances are not stored and come back as NaN. A
+    QualityGate therefore cannot reject a LUT match for being too far
+    from every reference; its image checks still apply.
+    """
+
+    def __init__(self, lut, meta):
+        self.lut = lut
+        self.bits = meta["bits"]
+        self.shift = 8 - self.bits
+        self.statistic = meta["statistic"]
+        self.metric = meta["metric"]
+        self.fingerprint = meta["fingerprint"]
+        self.pad_indices = np.array(meta["pad_indices"], dtype=np.int64)
+        self.level_indices = np.array(meta["level_indices"], dtype=np.int64)
+        self.value_labels = np.array(meta["value_labels"], dtype=object)
+        self.pad_position = {int(p): i for i, p in enumerate(self.pad_indices)}
+
+    @classmethod
+    def load(cls, db_path, bits=LUT_BITS, statistic="mean", metric="rgb"):
+        """Map the LUT stored next to db_path (read-only, shared between processes)"""
+        meta_path = lut_stem(db_path, bits, statistic, metric) + ".json"
+        for attempt in range(LOAD_ATTEMPTS):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            lut_path = os.path.join(os.path.dirname(meta_path), meta["table"])
+            try:
+                return cls(np.load(lut_path, mmap_mode="r"), meta)
+            except FileNotFoundError:
+                # A rebuild replaced the table between reading the metadata and mapping it
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+
+    @classmethod
+    def load_or_build(cls, db_path, bits=LUT_BITS, statistic="mean", metric="rgb"):
+        """Map the LUT, rebuilding it first if it is missing or stale"""
+        conn = sqlite3.connect(db_path)
+        try:
+            fingerprint = calibration_fingerprint(conn)
+        finally:
+            conn.close()
+
+        try:
+            classifier = cls.load(db_path, bits, statistic, metric)
+            if (classifier.fingerprint, classifier.bits, classifier.statistic,
+                    classifier.metric) == (fingerprint, bits, statistic, metric):
+                return classifier
+        except (OSError, ValueError, KeyError):
+            pass
+
+        build_lut(db_path, bits, statistic, metric)
+        return cls.load(db_path, bits, statistic, metric)
+
+    def __len__(self):
+        return len(self.pad_indices)
+
+    def has_pad(self, pad_index):
+        return int(pad_index) in self.pad_position
+
+    def _cells(self, rgbs):
+        q = np.asarray(rgbs).astype(np.intp) >> self.shift
+        return q[..., 0], q[..., 1], q[..., 2]
+
+    def classify(self, rgbs):
+        """Level slots for an (N strips, pads, 3) batch ordered like pad_indices"""
+        r, g, b = self._cells(rgbs)
+        pads = np.arange(len(self.pad_indices))
+        return self.lut[pads, r, g, b]
+
+    def predict(self, pad_rgb_map):
+        pads = [p for p in pad_rgb_map if self.has_pad(p)]
+        if not pads:
+            return []
+
+        positions = np.array([self.pad_position[int(p)] for p in pads])
+        r, g, b = self._cells([pad_rgb_map[p] for p in pads])
+        slots = self.lut[positions, r, g, b]
+
+        return [
+            (pad_index,
+             int(self.level_indices[pos, slot]),
+             self.value_labels[pos, slot],
+             float("nan"))
+            for pad_index, pos, slot in zip(pads, positions, slots)
+            if slot != NO_LEVEL
+        ]
+
+    def pixel_votes(self, img_bgr, pad_index):
+        """Classify every pixel of a patch; returns votes per level slot"""
+        pos = self.pad_position[int(pad_index)]
+        pixels = np.ascontiguousarray(img_bgr).reshape(-1, 3) >> self.shift
+        slots = self.lut[pos][pixels[:, 2], pixels[:, 1], pixels[:, 0]]
+        votes = np.bincount(slots, minlength=NO_LEVEL + 1)
+        return votes[:self.level_indices.shape[1]]
+
+# ==============================
+# PIXEL VOTE REPORT
+# ==============================
+def vote_report(classifier, patch_dir):
+    """[(pad_index, level of the mean color, [(value label, share of pixels)])] of a strip folder.
+
+    A pad whose pixels split between levels sits near a level boundary
+    or is unevenly colored, even when its mean picks a single level.
+    """
+    from .pad_extraction import list_patch_files, pad_mean_rgb, read_pad_bgr
+
+    report = []
+    for pad_index, name in enumerate(list_patch_files(patch_dir), start=1):
+        if not classifier.has_pad(pad_index):
+            continue
+        img = read_pad_bgr(os.path.join(patch_dir, name))
+        votes = classifier.pixel_votes(img, pad_index)
+        pos = classifier.pad_position[pad_index]
+        shares = [(classifier.value_labels[pos, slot], votes[slot] / votes.sum())
+                  for slot in np.argsort(votes)[::-1] if votes[slot]]
+        (_, _, label, _), = classifier.predict({pad_index: pad_mean_rgb(img)})
+        report.append((pad_index, label, shares))
+    return report
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the color -> level LUT next to the lookup DB")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--bits", type=int, default=LUT_BITS, help="bits per channel (6 -> 64^3)")
+    parser.add_argument("--statistic", default="mean", choices=sorted(REFERENCE_STATISTIC))
+    parser.add_argument("--metric", default="rgb", choices=METRICS)
+    parser.add_argument("--votes", metavar="FOLDER",
+                        help="instead, show how the pixels of each pad in a strip folder vote")
+    args = parser.parse_args()
+
+    if args.votes:
+        classifier = LutClassifier.load_or_build(args.db, args.bits, args.statistic, args.metric)
+        for pad_index, label, shares in vote_report(classifier, args.votes):
+            votes = ", ".join(f"{value} {share:.0%}" for value, share in shares)
+            print(f"Pad {pad_index}: {label}  (pixels: {votes})")
+    else:
+        path = build_lut(args.db, args.bits, args.statistic, args.metric)
+        print(f"✓ LUT written to {path}")
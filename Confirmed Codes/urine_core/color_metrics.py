@@ -0,0 +1,107 @@
+import numpy as np
+
+from .constants import METRICS
+
+# ==============================
+# CONFIG
+# ==============================
+# sRGB (D65) -> CIE XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_D65_WHITE = np.array([0.95047, 1.00000, 1.08883])
+
+# ==============================
+# COLOR CONVERSION
+# ==============================
+def srgb_to_linear(rgb):
+    """Linear-light values in [0, 1] for 8-bit sRGB colors"""
+    v = np.asarray(rgb, dtype=np.float64) / 255.0
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(linear):
+    """8-bit sRGB (unrounded floats) for linear-light values in [0, 1]"""
+    v = np.clip(np.asarray(linear, dtype=np.float64), 0.0, 1.0)
+    return 255.0 * np.where(v <= 0.0031308, v * 12.92, 1.055 * v ** (1 / 2.4) - 0.055)
+
+
+def rgb_to_lab(rgb):
+    """CIELAB (D65) for 8-bit sRGB colors shaped (..., 3)"""
+    xyz = srgb_to_linear(rgb) @ _RGB_TO_XYZ.T / _D65_WHITE
+    delta = 6 / 29
+    f = np.where(xyz > delta ** 3, np.cbrt(xyz), xyz / (3 * delta ** 2) + 4 / 29)
+    fx, fy, fz = f[..., 0], f[..., 1], f[..., 2]
+
+    return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], axis=-1)
+
+# ==============================
+# COLOR DIFFERENCES
+# ==============================
+def delta_e76(lab1, lab2):
+    """CIE76 color difference, broadcast over leading axes"""
+    diff = np.asarray(lab1, dtype=np.float64) - np.asarray(lab2, dtype=np.float64)
+    return np.sqrt(np.einsum("...i,...i->...", diff, diff))
+
+
+def delta_e2000(lab1, lab2):
+    """CIEDE2000 color difference (kL = kC = kH = 1), broadcast over leading axes"""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    c_bar = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    c_bar7 = c_bar ** 7
+    g = 0.5 * (1 - np.sqrt(c_bar7 / (c_bar7 + 25.0 ** 7)))
+
+    a1p, a2p = (1 + g) * a1, (1 + g) * a2
+    c1p, c2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+    chroma_zero = c1p * c2p == 0
+
+    dl = L2 - L1
+    dc = c2p - c1p
+    dh = h2p - h1p
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(chroma_zero, 0, dh)
+    dh_big = 2 * np.sqrt(c1p * c2p) * np.sin(np.radians(dh / 2))
+
+    l_bar = (L1 + L2) / 2
+    cp_bar = (c1p + c2p) / 2
+    h_sum = h1p + h2p
+    h_bar = np.where(
+        chroma_zero, h_sum,
+        np.where(np.abs(h1p - h2p) <= 180, h_sum / 2,
+                 np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2)))
+
+    t = (1 - 0.17 * np.cos(np.radians(h_bar - 30))
+         + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6))
+         - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    d_theta = 30 * np.exp(-((h_bar - 275) / 25) ** 2)
+    cp_bar7 = cp_bar ** 7
+    r_c = 2 * np.sqrt(cp_bar7 / (cp_bar7 + 25.0 ** 7))
+    s_l = 1 + 0.015 * (l_bar - 50) ** 2 / np.sqrt(20 + (l_bar - 50) ** 2)
+    s_c = 1 + 0.045 * cp_bar
+    s_h = 1 + 0.015 * cp_bar * t
+    r_t = -np.sin(np.radians(2 * d_theta)) * r_c
+
+    return np.sqrt((dl / s_l) ** 2 + (dc / s_c) ** 2 + (dh_big / s_h) ** 2
+                   + r_t * (dc / s_c) * (dh_big / s_h))
+
+
+def color_distance(samples, references, metric="rgb"):
+    """Distance between colors under METRICS, broadcast over leading axes.
+
+    For "rgb" both arguments are RGB; for the Delta E metrics both are
+    already CIELAB, so references can be converted once up front.
+    """
+    if metric in ("rgb", "de76"):
+        return delta_e76(samples, references)
+    if metric == "de2000":
+        return delta_e2000(samples, references)
+    raise ValueError(f"metric must be one of {METRICS}")
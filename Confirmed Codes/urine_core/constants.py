@@ -0,0 +1,45 @@
+# ==============================
+# CONFIG
+# ==============================
+DB_PATH = "urine_color_lookup.db"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+STATISTICS = ("mean", "median", "trimmed", "masked")
+METRICS = ("rgb", "de76", "de2000")
+
+PAD_SEQUENCE = [
+    "GLU", "BIL", "KET", "SG", "BLO",
+    "PH", "PRO", "URO", "NIT", "LEU"
+]
+
+# ==============================
+# PAD → ANALYTE MAP
+# ==============================
+PAD_ANALYTE_MAP = {
+    1: ("GLU", "Glucose", "mg/dL (mmol/L)"),
+    2: ("BIL", "Bilirubin", "mg/dL (µmol/L)"),
+    3: ("KET", "Ketone", "mg/dL (mmol/L)"),
+    4: ("SG",  "Specific Gravity", ""),
+    5: ("BLO", "Blood", "Ery/µL"),
+    6: ("PH",  "pH", ""),
+    7: ("PRO", "Protein", "mg/dL (g/L)"),
+    8: ("URO", "Urobilinogen", "mg/dL (µmol/L)"),
+    9: ("NIT", "Nitrite", ""),
+    10: ("LEU", "Leukocyte", "Leu/µL")
+}
+
+# ==============================
+# VALUE LABELS
+# ==============================
+VALUE_LABELS = {
+    "LEU": ["-", "15 ±", "70 +", "125 ++", "500 +++"],
+    "NIT": ["-", "+"],
+    "URO": ["0.2(3.5)", "1(17)", "2(35)", "4(70)", "8(140)", "12(200)"],
+    "PRO": ["-", "15(0.15)", "30(0.3)", "100(1.0)", "300(3.0)", "2000(20)"],
+    "PH":  ["5.0", "6.0", "6.5", "7.0", "7.5", "8.0", "9.0"],
+    "BLO": ["-", "±", "+", "++", "+++", "5–10", "50 Ery/µL"],
+    "SG":  ["1.000", "1.005", "1.010", "1.015", "1.020", "1.025", "1.030"],
+    "KET": ["-", "5(0.5)", "15(1.5)", "40(4.0)", "80(8.0)", "160(16)"],
+    "BIL": ["-", "1(17)", "2(35)", "4(70)"],
+    "GLU": ["-", "100(5)", "250(15)", "500(30)", "1000(60)", "≥2000(110)"]
+}
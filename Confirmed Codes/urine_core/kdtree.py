@@ -0,0 +1,143 @@
+import numpy as np
+
+# ==============================
+# CONFIG
+# ==============================
+LEAF_SIZE = 16           # points per leaf
+QUERY_CHUNK = 4096       # queries walked together (bounds the candidate arrays)
+
+_CHILD_OFFSETS = np.array([0, 1])
+
+# ==============================
+# KD-TREE
+# ==============================
+# A balanced tree over 3-D colors, stored as flat arrays in heap order
+# (node i has children 2i+1 and 2i+2; every node owns one contiguous
+# range of the reordered points) so a whole batch of queries walks it
+# together: every level of the tree is one vectorized step over the
+# (query, node) pairs that can still hold a nearer neighbour. A query
+# touches O(log n) nodes plus the few leaves around it, not every point.
+
+class KDTree:
+    """Exact k-nearest-neighbour search (Euclidean) over an (n, 3) point set"""
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        points = np.ascontiguousarray(points, dtype=np.float64)
+        n = len(points)
+        if n == 0:
+            raise ValueError("KDTree needs at least one point")
+
+        self.depth = int(np.floor(np.log2(n / leaf_size))) if n >= 2 * leaf_size else 0
+        node_count = 2 ** (self.depth + 1) - 1
+        first_leaf = 2 ** self.depth - 1
+
+        order = np.arange(n)
+        self.split_dims = np.zeros(first_leaf, dtype=np.int64)
+        self.split_values = np.zeros(first_leaf)
+        self.starts = np.zeros(node_count, dtype=np.int64)
+        self.ends = np.zeros(node_count, dtype=np.int64)
+        self.ends[0] = n
+        for node in range(first_leaf):
+            start, end = self.starts[node], self.ends[node]
+            chunk = order[start:end]
+            dim = int(np.ptp(points[chunk], axis=0).argmax())
+            mid = (end - start) // 2
+            order[start:end] = chunk[np.argpartition(points[chunk, dim], mid)]
+            self.split_dims[node] = dim
+            self.split_values[node] = points[order[start + mid], dim]
+            left, right = 2 * node + 1, 2 * node + 2
+            self.starts[left], self.ends[left] = start, start + mid
+            self.starts[right], self.ends[right] = start + mid, end
+
+        self.points = points[order]
+        self.order = order
+
+        # Tight bounding boxes, leaves first, then every parent from its children
+        self.lo = np.empty((node_count, 3))
+        self.hi = np.empty((node_count, 3))
+        for node in range(first_leaf, node_count):
+            self.lo[node] = self.points[self.starts[node]:self.ends[node]].min(axis=0)
+            self.hi[node] = self.points[self.starts[node]:self.ends[node]].max(axis=0)
+        for node in range(first_leaf - 1, -1, -1):
+            self.lo[node] = np.minimum(self.lo[2 * node + 1], self.lo[2 * node + 2])
+            self.hi[node] = np.maximum(self.hi[2 * node + 1], self.hi[2 * node + 2])
+
+    def __len__(self):
+        return len(self.points)
+
+    def _box_distance2(self, queries, nodes):
+        gap = np.maximum(self.lo[nodes] - queries, 0) + np.maximum(queries - self.hi[nodes], 0)
+        return (gap * gap).sum(axis=1)
+
+    def _far_distance2(self, queries, nodes):
+        far = np.maximum(np.abs(queries - self.lo[nodes]), np.abs(queries - self.hi[nodes]))
+        return (far * far).sum(axis=1)
+
+    def _candidates(self, queries, query_ids, nodes):
+        """(query id, point position, squared distance) for every point of every pair"""
+        sizes = self.ends[nodes] - self.starts[nodes]
+        owners = np.repeat(query_ids, sizes)
+        offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        positions = np.repeat(self.starts[nodes], sizes) + offsets
+        diff = self.points[positions] - queries[owners]
+        return owners, positions, (diff * diff).sum(axis=1)
+
+    @staticmethod
+    def _rank(owners, d2, m):
+        """Order candidates by (query, distance); returns the order and each one's rank"""
+        ranked = np.argsort(owners * (4 * d2.max() + 1) + d2, kind="stable")
+        group_start = np.searchsorted(owners[ranked], np.arange(m))
+        return ranked, np.arange(len(ranked)) - group_start[owners[ranked]], group_start
+
+    def query(self, queries, k=1):
+        """(distances, indices) of the k nearest points, both shaped (m, k)"""
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+        if len(queries) > QUERY_CHUNK:
+            parts = [self._query(queries[i:i + QUERY_CHUNK], k)
+                     for i in range(0, len(queries), QUERY_CHUNK)]
+            return np.concatenate([d for d, _ in parts]), np.concatenate([i for _, i in parts])
+        return self._query(queries, k)
+
+    def _query(self, queries, k):
+        m, n = len(queries), len(self.points)
+        k = min(k, n)
+        if m == 0:
+            return np.empty((0, k)), np.empty((0, k), dtype=np.int64)
+        ids = np.arange(m)
+
+        # 1. Home node: the deepest node on the query's side holding at least k points
+        home_depth = min(self.depth, int(np.floor(np.log2(n / k))))
+        nodes = np.zeros(m, dtype=np.int64)
+        for _ in range(home_depth):
+            go_right = queries[ids, self.split_dims[nodes]] >= self.split_values[nodes]
+            nodes = 2 * nodes + 1 + go_right
+
+        # 2. Its k-th nearest point bounds the search radius
+        owners, _, d2 = self._candidates(queries, ids, nodes)
+        ranked, _, group_start = self._rank(owners, d2, m)
+        radius2 = d2[ranked][group_start + k - 1]
+
+        # 3. Descend again, keeping only nodes whose box reaches into the radius.
+        #    A node with k points wholly inside a smaller ball shrinks the radius.
+        pair_queries, pair_nodes = ids, np.zeros(m, dtype=np.int64)
+        for _ in range(self.depth):
+            pair_queries = np.repeat(pair_queries, 2)
+            pair_nodes = ((2 * pair_nodes + 1)[:, None] + _CHILD_OFFSETS).ravel()
+            pair_samples = queries[pair_queries]
+            full = self.ends[pair_nodes] - self.starts[pair_nodes] >= k
+            np.minimum.at(radius2, pair_queries[full],
+                          self._far_distance2(pair_samples[full], pair_nodes[full]))
+            keep = (self._box_distance2(pair_samples, pair_nodes)
+                    <= radius2[pair_queries])
+            pair_queries, pair_nodes = pair_queries[keep], pair_nodes[keep]
+
+        # 4. Exact k nearest among the points of the surviving leaves
+        owners, positions, d2 = self._candidates(queries, pair_queries, pair_nodes)
+        inside = d2 <= radius2[owners]
+        owners, positions, d2 = owners[inside], positions[inside], d2[inside]
+        ranked, rank, _ = self._rank(owners, d2, m)
+        top = ranked[rank < k]
+
+        distances = np.sqrt(d2[top]).reshape(m, k)
+        indices = self.order[positions[top]].reshape(m, k)
+        return distances, indices
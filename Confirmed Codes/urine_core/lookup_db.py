@@ -0,0 +1,448 @@
+import os
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+
+from .constants import DB_PATH
+from .pipeline_metrics import count, timed
+
+# ==============================
+# CONFIG
+# ==============================
+# Bump whenever the columns imported from the CSVs change, so every
+# analyte is re-imported once on the next rebuild.
+LOOKUP_SCHEMA_VERSION = 3
+
+LOOKUP_COLUMNS = [
+    "pad_index", "analyte_code", "analyte_name",
+    "level_index", "value_label", "r_mean", "g_mean", "b_mean",
+    "r_median", "g_median", "b_median",
+    "lab_l", "lab_a", "lab_b",
+    "lab_l_median", "lab_a_median", "lab_b_median"
+]
+
+# Multi-sample references: many measurements per level, e.g. across strip
+# lots and cameras, imported from CSVs with columns analyte,level,R,G,B
+# and an optional source column.
+SAMPLE_COLUMNS = [
+    "pad_index", "analyte_code", "level_index", "r", "g", "b",
+    "lab_l", "lab_a", "lab_b", "source", "csv_file"
+]
+
+# Columns added after the original table layout: (name, SQL type)
+ADDED_COLUMNS = [
+    ("r_median", "REAL"), ("g_median", "REAL"), ("b_median", "REAL"),
+    ("lab_l", "REAL"), ("lab_a", "REAL"), ("lab_b", "REAL"),
+    ("lab_l_median", "REAL"), ("lab_a_median", "REAL"), ("lab_b_median", "REAL"),
+]
+
+# ==============================
+# DATABASE SETUP
+# ==============================
+def create_database(db_path):
+    """Open the lookup database, creating tables and indexes if missing"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS color_lookup (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pad_index INTEGER,
+            analyte_code TEXT,
+            analyte_name TEXT,
+            level_index INTEGER,
+            value_label TEXT,
+            r_mean REAL,
+            g_mean REAL,
+            b_mean REAL,
+            r_median REAL,
+            g_median REAL,
+            b_median REAL,
+            lab_l REAL,
+            lab_a REAL,
+            lab_b REAL,
+            lab_l_median REAL,
+            lab_a_median REAL,
+            lab_b_median REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_color_lookup_pad_level
+            ON color_lookup (pad_index, level_index);
+
+        CREATE TABLE IF NOT EXISTS color_lookup_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version INTEGER,
+            pad_index INTEGER,
+            analyte_code TEXT,
+            analyte_name TEXT,
+            level_index INTEGER,
+            value_label TEXT,
+            r_mean REAL,
+            g_mean REAL,
+            b_mean REAL,
+            r_median REAL,
+            g_median REAL,
+            b_median REAL,
+            lab_l REAL,
+            lab_a REAL,
+            lab_b REAL,
+            lab_l_median REAL,
+            lab_a_median REAL,
+            lab_b_median REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_color_lookup_versions_analyte
+            ON color_lookup_versions (analyte_code, version);
+
+        CREATE TABLE IF NOT EXISTS calibration_sources (
+            analyte_code TEXT PRIMARY KEY,
+            csv_file TEXT,
+            content_hash TEXT,
+            version INTEGER,
+            imported_at TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS reference_samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pad_index INTEGER,
+            analyte_code TEXT,
+            level_index INTEGER,
+            r REAL,
+            g REAL,
+            b REAL,
+            lab_l REAL,
+            lab_a REAL,
+            lab_b REAL,
+            source TEXT,
+            csv_file TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_reference_samples_pad
+            ON reference_samples (pad_index);
+
+        CREATE TABLE IF NOT EXISTS reference_sample_sources (
+            csv_file TEXT PRIMARY KEY,
+            content_hash TEXT,
+            samples INTEGER,
+            imported_at TEXT
+        );
+    """)
+    _add_missing_columns(conn, "color_lookup")
+    _add_missing_columns(conn, "color_lookup_versions")
+    conn.commit()
+    return conn
+
+
+def _add_missing_columns(conn, table):
+    """Bring tables created by older builds up to the current layout"""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, sql_type in ADDED_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+
+# ==============================
+# BUILD LOOKUP TABLE
+# ==============================
+def find_analyte_csvs(csv_folder, pad_sequence):
+    """Map analyte code -> CSV file name in csv_folder"""
+    csv_map = {}
+    for f in sorted(os.listdir(csv_folder)):
+        if f.lower().endswith(".csv"):
+            for analyte in pad_sequence:
+                if analyte in f.upper():
+                    csv_map[analyte] = f
+    return csv_map
+
+
+def csv_content_hash(path, analyte_name, labels):
+    """Hash a CSV together with everything else that shapes its imported rows"""
+    digest = hashlib.sha256()
+    digest.update(f"schema={LOOKUP_SCHEMA_VERSION}\n".encode("utf-8"))
+    digest.update(f"{analyte_name}\n{'|'.join(labels)}\n".encode("utf-8"))
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _lookup_rows(path, pad_index, analyte_code, analyte_name, labels):
+    # Only a rebuild needs these; queries on the database do not
+    import numpy as np
+    import pandas as pd
+    from .color_metrics import rgb_to_lab
+
+    mean_columns = ["R_mean", "G_mean", "B_mean"]
+    median_columns = ["R_median", "G_median", "B_median"]
+
+    # Blank trailing lines in the CSVs would otherwise become NULL colors
+    df = pd.read_csv(path).dropna(subset=mean_columns)
+    for column in median_columns:
+        if column not in df:
+            df[column] = None
+
+    means = df[mean_columns].astype(float).values
+    medians = df[median_columns].astype(float).values
+
+    # CIELAB is computed once here so Delta E queries only convert samples
+    mean_labs = rgb_to_lab(means)
+    median_labs = rgb_to_lab(np.where(np.isnan(medians), means, medians))
+
+    def nullable(values):
+        return [None if np.isnan(v) else float(v) for v in values]
+
+    return [
+        (pad_index, analyte_code, analyte_name,
+         i, labels[min(i, len(labels)-1)],
+         *mean.tolist(), *nullable(median), *mean_lab.tolist(), *median_lab.tolist())
+        for i, (mean, median, mean_lab, median_lab)
+        in enumerate(zip(means, medians, mean_labs, median_labs))
+    ]
+
+
+def build_lookup_table(conn, csv_folder, pad_sequence, pad_analyte_map, value_labels):
+    """Re-import only analytes whose CSV changed since the last build.
+
+    Every import is also appended to color_lookup_versions under a new
+    version number, so earlier calibrations stay available. All changes
+    are committed in one transaction. Returns (imported, unchanged,
+    missing) lists of analyte codes.
+    """
+    with timed("build_lookup_table"):
+        imported, unchanged, missing = _build_lookup_table(
+            conn, csv_folder, pad_sequence, pad_analyte_map, value_labels)
+    count("analytes_imported", len(imported))
+    return imported, unchanged, missing
+
+
+def _build_lookup_table(conn, csv_folder, pad_sequence, pad_analyte_map, value_labels):
+    csv_map = find_analyte_csvs(csv_folder, pad_sequence)
+    known = dict(conn.execute("SELECT analyte_code, content_hash FROM calibration_sources"))
+    imported_at = datetime.now().isoformat(timespec="seconds")
+
+    imported, unchanged, missing = [], [], []
+
+    with conn:
+        for pad_index, analyte_code in enumerate(pad_sequence, start=1):
+            if analyte_code not in csv_map:
+                missing.append(analyte_code)
+                continue
+
+            path = os.path.join(csv_folder, csv_map[analyte_code])
+            labels = value_labels[analyte_code]
+            _, analyte_name, _ = pad_analyte_map[pad_index]
+
+            content_hash = csv_content_hash(path, analyte_name, labels)
+            if known.get(analyte_code) == content_hash:
+                unchanged.append(analyte_code)
+                continue
+
+            with timed("csv_import"):
+                rows = _lookup_rows(path, pad_index, analyte_code, analyte_name, labels)
+            version = conn.execute("""
+                SELECT COALESCE(MAX(version), 0) + 1
+                FROM color_lookup_versions
+                WHERE analyte_code = ?
+            """, (analyte_code,)).fetchone()[0]
+
+            conn.execute("DELETE FROM color_lookup WHERE analyte_code = ?", (analyte_code,))
+            conn.executemany(f"""
+                INSERT INTO color_lookup ({", ".join(LOOKUP_COLUMNS)})
+                VALUES ({", ".join("?" * len(LOOKUP_COLUMNS))})
+            """, rows)
+            conn.executemany(f"""
+                INSERT INTO color_lookup_versions (version, {", ".join(LOOKUP_COLUMNS)})
+                VALUES (?, {", ".join("?" * len(LOOKUP_COLUMNS))})
+            """, [(version, *row) for row in rows])
+            conn.execute("""
+                INSERT OR REPLACE INTO calibration_sources
+                (analyte_code, csv_file, content_hash, version, imported_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (analyte_code, csv_map[analyte_code], content_hash, version, imported_at))
+
+            imported.append(analyte_code)
+
+    return imported, unchanged, missing
+
+# ==============================
+# REFERENCE SAMPLES
+# ==============================
+def _sample_rows(path, csv_file, pad_sequence):
+    import pandas as pd
+    from .color_metrics import rgb_to_lab
+
+    df = pd.read_csv(path).dropna(subset=["R", "G", "B"])
+    missing = {"analyte", "level"} - set(df.columns)
+    if missing:
+        raise ValueError(f"{csv_file} has no {', '.join(sorted(missing))} column")
+
+    pads = {code.upper(): i for i, code in enumerate(pad_sequence, start=1)}
+    codes = df["analyte"].astype(str).str.strip().str.upper()
+    unknown = sorted(set(codes) - set(pads))
+    if unknown:
+        raise ValueError(f"{csv_file}: unknown analytes {unknown}")
+
+    rgbs = df[["R", "G", "B"]].astype(float).values
+    labs = rgb_to_lab(rgbs)
+    sources = df["source"].astype(str) if "source" in df else [None] * len(df)
+    return [
+        (pads[code], code, int(level), *rgb.tolist(), *lab.tolist(), source, csv_file)
+        for code, level, rgb, lab, source
+        in zip(codes, df["level"], rgbs, labs, sources)
+    ]
+
+
+def import_reference_samples(conn, paths, pad_sequence):
+    """(Re)import changed sample CSVs; returns (imported {csv_file: rows}, unchanged)"""
+    known = dict(conn.execute("SELECT csv_file, content_hash FROM reference_sample_sources"))
+    imported_at = datetime.now().isoformat(timespec="seconds")
+    imported, unchanged = {}, []
+
+    with conn:
+        for path in paths:
+            csv_file = os.path.basename(path)
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            content_hash = digest.hexdigest()
+            if known.get(csv_file) == content_hash:
+                unchanged.append(csv_file)
+                continue
+
+            with timed("csv_import"):
+                rows = _sample_rows(path, csv_file, pad_sequence)
+            conn.execute("DELETE FROM reference_samples WHERE csv_file = ?", (csv_file,))
+            conn.executemany(f"""
+                INSERT INTO reference_samples ({", ".join(SAMPLE_COLUMNS)})
+                VALUES ({", ".join("?" * len(SAMPLE_COLUMNS))})
+            """, rows)
+            conn.execute("""
+                INSERT OR REPLACE INTO reference_sample_sources
+                (csv_file, content_hash, samples, imported_at)
+                VALUES (?, ?, ?, ?)
+            """, (csv_file, content_hash, len(rows), imported_at))
+            imported[csv_file] = len(rows)
+
+    return imported, unchanged
+
+
+def remove_reference_samples(conn, csv_file=None):
+    """Drop the samples of one CSV (or all of them); returns the rows removed"""
+    where, params = ("WHERE csv_file = ?", (csv_file,)) if csv_file else ("", ())
+    with conn:
+        removed = conn.execute(f"DELETE FROM reference_samples {where}", params).rowcount
+        conn.execute(f"DELETE FROM reference_sample_sources {where}", params)
+    return removed
+
+
+def has_reference_samples(conn):
+    """True when any multi-sample references are stored (older databases have none)"""
+    try:
+        return conn.execute("SELECT 1 FROM reference_samples LIMIT 1").fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+# ==============================
+# CALIBRATION VERSIONS
+# ==============================
+def list_calibration_versions(conn, analyte_code=None):
+    """(analyte_code, version, rows) for every stored calibration version"""
+    query = """
+        SELECT analyte_code, version, COUNT(*)
+        FROM color_lookup_versions
+        {}
+        GROUP BY analyte_code, version
+        ORDER BY analyte_code, version
+    """
+    if analyte_code is None:
+        return conn.execute(query.format("")).fetchall()
+    return conn.execute(query.format("WHERE analyte_code = ?"), (analyte_code,)).fetchall()
+
+
+def current_calibration_versions(conn):
+    """{analyte_code: (version, csv_file, imported_at)} of the calibration in color_lookup"""
+    return {
+        code: (version, csv_file, imported_at)
+        for code, version, csv_file, imported_at in conn.execute("""
+            SELECT analyte_code, version, csv_file, imported_at FROM calibration_sources
+        """)
+    }
+
+
+def restore_calibration_version(conn, analyte_code, version):
+    """Make an earlier stored version the current one for an analyte"""
+    columns = ", ".join(LOOKUP_COLUMNS)
+    with conn:
+        rows = conn.execute(f"""
+            SELECT {columns} FROM color_lookup_versions
+            WHERE analyte_code = ? AND version = ?
+            ORDER BY id
+        """, (analyte_code, version)).fetchall()
+        if not rows:
+            raise ValueError(f"No version {version} stored for {analyte_code}")
+
+        conn.execute("DELETE FROM color_lookup WHERE analyte_code = ?", (analyte_code,))
+        conn.executemany(f"""
+            INSERT INTO color_lookup ({columns})
+            VALUES ({", ".join("?" * len(LOOKUP_COLUMNS))})
+        """, rows)
+        # The CSV hash is kept, so the restored version stays current
+        # until the analyte CSV itself changes again.
+        conn.execute("""
+            UPDATE calibration_sources SET version = ?
+            WHERE analyte_code = ?
+        """, (version, analyte_code))
+
+
+def calibration_fingerprint(conn):
+    """Short hash identifying the calibration currently in color_lookup"""
+    digest = hashlib.sha256()
+    try:
+        rows = conn.execute("""
+            SELECT analyte_code, content_hash, version
+            FROM calibration_sources
+            ORDER BY analyte_code
+        """).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    for row in rows:
+        digest.update(repr(row).encode("utf-8"))
+
+    # Multi-sample references change the answers too; databases without
+    # any keep their earlier fingerprint.
+    try:
+        rows = conn.execute("""
+            SELECT csv_file, content_hash
+            FROM reference_sample_sources
+            ORDER BY csv_file
+        """).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    for row in rows:
+        digest.update(repr(("samples", *row)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or roll back calibration versions")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--restore", nargs=2, metavar=("ANALYTE", "VERSION"),
+                        help="make a stored version of an analyte current again")
+    parser.add_argument("analyte", nargs="?", help="only list this analyte's versions")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"✗ No lookup database at {args.db}")
+    conn = create_database(args.db)
+    try:
+        if args.restore:
+            analyte_code, version = args.restore[0], int(args.restore[1])
+            try:
+                restore_calibration_version(conn, analyte_code, version)
+            except ValueError as e:
+                raise SystemExit(f"✗ {e}")
+            print(f"✓ {analyte_code} restored to version {version}")
+
+        current = current_calibration_versions(conn)
+        for analyte_code, version, rows in list_calibration_versions(conn, args.analyte):
+            marker = " (current)" if current.get(analyte_code, (None,))[0] == version else ""
+            print(f"{analyte_code} v{version}: {rows} levels{marker}")
+        print(f"Calibration fingerprint {calibration_fingerprint(conn)}")
+    finally:
+        conn.close()
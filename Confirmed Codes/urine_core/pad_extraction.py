@@ -0,0 +1,270 @@
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from .constants import IMAGE_EXTENSIONS, STATISTICS
+from .pipeline_metrics import count, timed
+
+# ==============================
+# CONFIG
+# ==============================
+# JPEG is decoded directly at 1/2, 1/4 or 1/8 scale; other formats are
+# decoded in full and then downscaled by OpenCV.
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+TRIM_FRACTION = 0.1      # share of pixels dropped from each end for the trimmed mean
+GLARE_THRESHOLD = 250    # pixels with any channel at or above this count as glare
+
+# ==============================
+# PAD COLOR EXTRACTION
+# ==============================
+def list_patch_files(patch_dir):
+    return sorted([
+        f for f in os.listdir(patch_dir)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    ])
+
+
+def center_roi(img, roi_fraction):
+    """Central region covering roi_fraction of each side (a view, not a copy)"""
+    if roi_fraction >= 1.0:
+        return img
+    h, w = img.shape[:2]
+    dy = int(h * (1.0 - roi_fraction) / 2)
+    dx = int(w * (1.0 - roi_fraction) / 2)
+    return img[dy:max(h - dy, dy + 1), dx:max(w - dx, dx + 1)]
+
+
+def read_pad_bgr(path, reduction=1, roi_fraction=1.0):
+    if reduction not in REDUCED_READ_FLAGS:
+        raise ValueError(f"reduction must be one of {sorted(REDUCED_READ_FLAGS)}")
+
+    with timed("decode"):
+        img = cv2.imread(path, REDUCED_READ_FLAGS[reduction])
+    if img is None:
+        count("images_rejected")
+        raise ValueError(f"Could not read image: {path}")
+    count("images_decoded")
+    return center_roi(img, roi_fraction)
+
+
+def decode_pad_bgr(data, reduction=1, roi_fraction=1.0):
+    """Like read_pad_bgr, for encoded image bytes already in memory"""
+    if reduction not in REDUCED_READ_FLAGS:
+        raise ValueError(f"reduction must be one of {sorted(REDUCED_READ_FLAGS)}")
+
+    with timed("decode"):
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_READ_FLAGS[reduction])
+    if img is None:
+        count("images_rejected")
+        raise ValueError("Could not decode image")
+    count("images_decoded")
+    return center_roi(img, roi_fraction)
+
+
+def pad_mean_rgb(img_bgr):
+    """Channel means taken straight from the BGR buffer, returned as [R, G, B]"""
+    b, g, r, _ = cv2.mean(img_bgr)
+    return [int(r), int(g), int(b)]
+
+
+def _histogram_median(hist, counts):
+    """Per-channel median of (3, 256) histograms, equal to np.median"""
+    cumulative = hist.cumsum(axis=1)
+    lower = np.array([np.searchsorted(c, (n - 1) // 2, side="right")
+                      for c, n in zip(cumulative, counts)])
+    upper = np.array([np.searchsorted(c, n // 2, side="right")
+                      for c, n in zip(cumulative, counts)])
+    return (lower + upper) / 2
+
+
+def _histogram_trimmed_mean(hist, counts, trim_fraction):
+    """Per-channel mean after dropping trim_fraction of pixels from each end"""
+    values = np.arange(256)
+    means = []
+    for h, n in zip(hist, counts):
+        cut = int(n * trim_fraction)
+        upper = np.cumsum(h)
+        lower = upper - h
+        kept = np.clip(upper, cut, n - cut) - np.clip(lower, cut, n - cut)
+        means.append((kept * values).sum() / max(n - 2 * cut, 1))
+    return np.array(means)
+
+
+def channel_histograms(img_bgr, mask=None):
+    """(3, 256) per-channel pixel counts in BGR order"""
+    return np.stack([
+        cv2.calcHist([img_bgr], [c], mask, [256], [0, 256]).ravel()
+        for c in range(3)
+    ]).round().astype(np.int64)
+
+
+def pad_statistics(img_bgr, trim_fraction=TRIM_FRACTION, glare_threshold=GLARE_THRESHOLD):
+    """Mean, median, trimmed mean and glare-masked mean as {name: [R, G, B]}, truncated to ints"""
+    return {
+        name: [int(v) for v in stat]
+        for name, stat in exact_pad_statistics(img_bgr, trim_fraction, glare_threshold).items()
+    }
+
+
+def exact_pad_statistics(img_bgr, trim_fraction=TRIM_FRACTION, glare_threshold=GLARE_THRESHOLD):
+    """pad_statistics as unrounded (R, G, B) float arrays.
+
+    Everything is derived from per-channel 256-bin histograms, so no pixel
+    data is sorted or copied; the median is O(n) instead of a sort.
+    Histograms come from cv2.calcHist, which bins uint8 views directly
+    (np.bincount would first widen every pixel to intp).
+    """
+    t = glare_threshold - 1
+    clean_mask = cv2.inRange(img_bgr, (0, 0, 0), (t, t, t))
+
+    full = channel_histograms(img_bgr)
+    clean = channel_histograms(img_bgr, clean_mask)
+    n = int(full[0].sum())
+    values = np.arange(256)
+
+    mean = (full * values).sum(axis=1) / n
+    median = _histogram_median(full, [n] * 3)
+    trimmed = _histogram_trimmed_mean(full, [n] * 3, trim_fraction)
+
+    clean_count = clean[0].sum()
+    masked = (clean * values).sum(axis=1) / clean_count if clean_count else mean
+
+    # BGR -> RGB
+    return {
+        name: stat[::-1]
+        for name, stat in (("mean", mean), ("median", median),
+                           ("trimmed", trimmed), ("masked", masked))
+    }
+
+
+def exact_pad_statistic(img_bgr, statistic="mean", trim_fraction=TRIM_FRACTION,
+                        glare_threshold=GLARE_THRESHOLD):
+    """One of exact_pad_statistics, computing only what that statistic needs.
+
+    The mean and the glare-masked mean are one cv2.mean pass (the latter
+    plus the glare mask); only the median and trimmed mean need the
+    per-channel histograms.
+    """
+    if statistic == "mean":
+        return np.array(cv2.mean(img_bgr)[:3])[::-1]
+    if statistic == "masked":
+        t = glare_threshold - 1
+        clean_mask = cv2.inRange(img_bgr, (0, 0, 0), (t, t, t))
+        mask = clean_mask if cv2.countNonZero(clean_mask) else None
+        return np.array(cv2.mean(img_bgr, mask)[:3])[::-1]
+
+    full = channel_histograms(img_bgr)
+    n = int(full[0].sum())
+    if statistic == "median":
+        return _histogram_median(full, [n] * 3)[::-1]
+    if statistic == "trimmed":
+        return _histogram_trimmed_mean(full, [n] * 3, trim_fraction)[::-1]
+    raise ValueError(f"statistic must be one of {STATISTICS}")
+
+
+def pad_color(img_bgr, statistic="mean"):
+    """[R, G, B] of a decoded patch under one of STATISTICS"""
+    if statistic not in STATISTICS:
+        raise ValueError(f"statistic must be one of {STATISTICS}")
+    with timed("color_statistic"):
+        if statistic == "mean":
+            return pad_mean_rgb(img_bgr)
+        return [int(v) for v in exact_pad_statistic(img_bgr, statistic)]
+
+
+def read_pad_rgb(path, reduction=1, roi_fraction=1.0, statistic="mean", gate=None):
+    """[R, G, B] of one patch image; with a QualityGate, a poor capture raises ImageRejected"""
+    if statistic not in STATISTICS:
+        raise ValueError(f"statistic must be one of {STATISTICS}")
+    img = read_pad_bgr(path, reduction, roi_fraction)
+    if gate is not None:
+        gate.check(img, os.path.basename(path))
+    return pad_color(img, statistic)
+
+
+def extract_pad_rgbs(patch_dir, reduction=1, roi_fraction=1.0, statistic="mean", gate=None):
+    """{pad_index: [R, G, B]} for a folder of exactly 10 patch images.
+
+    reduction=1 and roi_fraction=1.0 give the full-frame mean; statistic
+    selects one of STATISTICS. With a QualityGate the first poor image
+    raises ImageRejected before the rest are decoded.
+    """
+    with timed("extract_pad_rgbs"):
+        patch_files = list_patch_files(patch_dir)
+
+        if len(patch_files) != 10:
+            raise ValueError("Exactly 10 patch images are required")
+
+        return {
+            idx: read_pad_rgb(os.path.join(patch_dir, file), reduction, roi_fraction,
+                              statistic, gate)
+            for idx, file in enumerate(patch_files, start=1)
+        }
+
+# ==============================
+# ACCURACY REPORT
+# ==============================
+def compare_extraction(paths, reduction, roi_fraction):
+    """Per-image difference of a fast mode against the full-frame mean.
+
+    Returns (abs_diff array shaped (images, 3), full seconds, fast seconds).
+    """
+    full, fast = [], []
+    full_time = fast_time = 0.0
+
+    for path in paths:
+        start = time.perf_counter()
+        full.append(read_pad_rgb(path))
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast.append(read_pad_rgb(path, reduction, roi_fraction))
+        fast_time += time.perf_counter() - start
+
+    abs_diff = np.abs(np.array(fast, dtype=int) - np.array(full, dtype=int))
+    return abs_diff, full_time, fast_time
+
+
+def print_accuracy_report(folders, reduction, roi_fraction):
+    paths = [
+        os.path.join(folder, f)
+        for folder in folders
+        for f in list_patch_files(folder)
+    ]
+    if not paths:
+        print("No patch images found")
+        return
+
+    abs_diff, full_time, fast_time = compare_extraction(paths, reduction, roi_fraction)
+
+    print(f"Images: {len(paths)}  reduction: 1/{reduction}  roi: {roi_fraction:.0%}")
+    for channel, name in enumerate("RGB"):
+        print(f"  {name}: mean |diff| {abs_diff[:, channel].mean():.2f}  "
+              f"max |diff| {abs_diff[:, channel].max()}")
+    print(f"  images with any channel off by > 2: {(abs_diff.max(axis=1) > 2).sum()}")
+    print(f"  full-frame: {full_time * 1000 / len(paths):.3f} ms/image  "
+          f"fast: {fast_time * 1000 / len(paths):.3f} ms/image")
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report fast extraction accuracy against the full-frame mean")
+    parser.add_argument("folders", nargs="+", help="folders of patch images")
+    parser.add_argument("--reduction", type=int, default=2, choices=sorted(REDUCED_READ_FLAGS),
+                        help="decode at 1/N resolution")
+    parser.add_argument("--roi", type=float, default=1.0,
+                        help="fraction of each side kept around the patch center")
+    args = parser.parse_args()
+
+    print_accuracy_report(args.folders, args.reduction, args.roi)
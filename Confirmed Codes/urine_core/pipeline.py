@@ -0,0 +1,63 @@
+from . import lookup_db
+from .constants import PAD_SEQUENCE, PAD_ANALYTE_MAP, VALUE_LABELS, DB_PATH
+from .pipeline_metrics import timed
+
+# cv2, numpy and pandas are imported inside the functions that need them,
+# so importing this module (or querying the database) stays cheap.
+
+# ==============================
+# DATABASE SETUP
+# ==============================
+def create_database(db_path=DB_PATH):
+    return lookup_db.create_database(db_path)
+
+# ==============================
+# BUILD LOOKUP TABLE
+# ==============================
+def build_lookup_table(conn, csv_folder):
+    """Import changed analyte CSVs; returns (imported, unchanged, missing) codes"""
+    return lookup_db.build_lookup_table(
+        conn, csv_folder, PAD_SEQUENCE, PAD_ANALYTE_MAP, VALUE_LABELS)
+
+# ==============================
+# EXTRACT RGB FROM PATCH IMAGES
+# ==============================
+def extract_pad_rgbs(patch_dir, reduction=1, roi_fraction=1.0, statistic="mean", gate=None):
+    from . import pad_extraction
+    return pad_extraction.extract_pad_rgbs(patch_dir, reduction, roi_fraction, statistic, gate)
+
+# ==============================
+# PREDICT ALL PADS
+# ==============================
+def load_reference_index(conn, statistic="mean", metric="rgb"):
+    """SampleIndex once multi-sample references are imported, else ReferenceIndex"""
+    with timed("reference_load"):
+        if lookup_db.has_reference_samples(conn):
+            from .sample_index import SampleIndex
+            return SampleIndex.from_connection(conn, statistic, metric)
+        from .reference_index import ReferenceIndex
+        return ReferenceIndex.from_connection(conn, statistic, metric)
+
+
+def predict_all_pads(conn, pad_rgb_map, index=None, statistic="mean", metric="rgb",
+                     source=None, results=None, gate=None):
+    """Match one strip and append it to a StripResults (a new one unless given).
+
+    Call to_dataframe() on the returned StripResults for a DataFrame.
+    With a QualityGate, a pad too far from every reference raises
+    ImageRejected instead.
+    """
+    from .results import StripResults
+
+    if index is None:
+        index = load_reference_index(conn, statistic, metric)
+
+    with timed("match"):
+        matches = index.predict(pad_rgb_map)
+    if gate is not None:
+        gate.check_matches(matches)
+
+    if results is None:
+        results = StripResults(capacity=1)
+    results.append(matches, pad_rgb_map, source)
+    return results
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+# ==============================
+# CONFIG
+# ==============================
+METRIC_PREFIX = "urine"
+
+# Upper bounds in seconds; observations above the last go to +Inf
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = ("strips_processed", "strips_failed", "strips_rejected", "images_decoded",
+            "images_rejected", "matches_rejected", "analytes_imported")
+
+# ==============================
+# METRICS REGISTRY
+# ==============================
+class PipelineMetrics:
+    """Per-stage latency histograms and event counters, shared by all threads.
+
+    Worker processes keep their own instance; drain() hands their numbers
+    to the parent, which merge()s them into its own.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.stages = {}
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {"count": 0, "sum": 0.0,
+                                  "buckets": [0] * (len(self.buckets) + 1)}
+        return self.stages[stage]
+
+    def observe(self, stage, seconds):
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                slot = i
+                break
+        with self.lock:
+            entry = self._stage(stage)
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["buckets"][slot] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """Plain-dict copy of every counter and histogram (picklable, JSON-ready)"""
+        with self.lock:
+            return {
+                "buckets": list(self.buckets),
+                "counters": dict(self.counters),
+                "stages": {
+                    stage: {"count": e["count"], "sum": e["sum"], "buckets": list(e["buckets"])}
+                    for stage, e in self.stages.items()
+                },
+            }
+
+    def drain(self):
+        """Snapshot and reset in one step, so nothing is reported twice"""
+        with self.lock:
+            snapshot = {
+                "buckets": list(self.buckets),
+                "counters": self.counters,
+                "stages": self.stages,
+            }
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.stages = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        with self.lock:
+            for name, n in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for stage, other in snapshot["stages"].items():
+                entry = self._stage(stage)
+                entry["count"] += other["count"]
+                entry["sum"] += other["sum"]
+                entry["buckets"] = [a + b for a, b in zip(entry["buckets"], other["buckets"])]
+
+    def to_json(self):
+        snapshot = self.snapshot()
+        for entry in snapshot["stages"].values():
+            entry["mean_ms"] = round(entry["sum"] * 1000 / entry["count"], 3) if entry["count"] else None
+        return json.dumps(snapshot, indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} Latency of each analysis pipeline stage",
+                 f"# TYPE {name} histogram"]
+
+        for stage, entry in sorted(snapshot["stages"].items()):
+            cumulative = 0
+            for bound, n in zip([*map(str, self.buckets), "+Inf"], entry["buckets"]):
+                cumulative += n
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {entry["count"]}')
+
+        for counter, n in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{counter}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{counter}_total {n}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write Prometheus text for .prom/.txt paths, a JSON snapshot otherwise.
+
+        The file is replaced atomically, so a scraper never reads half of it.
+        """
+        text = self.to_prometheus() if path.lower().endswith((".prom", ".txt")) else self.to_json()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+
+# Process-wide registry used by the pipeline hooks
+metrics = PipelineMetrics()
+
+
+def timed(stage):
+    return metrics.timer(stage)
+
+
+def count(name, n=1):
+    metrics.increment(name, n)
+
+# ==============================
+# PROFILING
+# ==============================
+@contextmanager
+def profiled(path, top=25):
+    """cProfile everything inside the block; stats go to path, a summary to stdout"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path} (view with: python -m pstats {path})")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
@@ -0,0 +1,127 @@
+import math
+
+from .pipeline_metrics import count, timed
+
+# cv2 and numpy are imported by image_quality, so the GUI and the server
+# can import the gate without loading them.
+
+# ==============================
+# CONFIG
+# ==============================
+MIN_SHARPNESS = 10.0         # variance of the Laplacian; below this a strip photo is out of focus
+SATURATION_LEVEL = 250       # pixels at or above this luminance are clipped
+MAX_SATURATED = 0.05         # largest share of clipped pixels (glare, overexposure)
+MIN_LUMINANCE = 15           # 99th percentile luminance below this is underexposed
+MAX_LUMINANCE = 245          # 1st percentile luminance above this is washed out
+MAX_LUMINANCE_RANGE = 160    # wider 1st-99th percentile spread: not one uniform pad
+
+# Distance to the nearest reference beyond which a pad matches no level
+# at all, in the units of each color metric
+MAX_DISTANCE = {"rgb": 60.0, "de76": 25.0, "de2000": 15.0}
+
+# ==============================
+# QUALITY METRICS
+# ==============================
+# The metrics are taken from the pad image that was already decoded for
+# its color statistic, so gating never decodes an image a second time.
+# Glare and exposure both come from one luminance histogram of the pad.
+# A strip is rejected at its first failing pad; its remaining images are
+# not decoded at all. Focus is only judged on a whole-strip photo or
+# video frame, whose pad edges show blur; a cropped pad is flat, and
+# sharp patches score well below MIN_SHARPNESS (1-10 on images/).
+
+class ImageRejected(ValueError):
+    """A capture failed the quality gate and should be retaken"""
+
+
+def _sharpness(gray):
+    import cv2
+    _, stddev = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    return float(stddev[0, 0] ** 2)
+
+
+def image_quality(img_bgr):
+    """Saturated share and 1st/99th percentile luminance of a decoded pad"""
+    import cv2
+    import numpy as np
+
+    with timed("quality"):
+        gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+        cumulative = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel().cumsum()
+        n = cumulative[-1]
+        low, high = np.searchsorted(cumulative, (0.01 * n, 0.99 * n))
+        # Luminance this high needs every channel near white
+        unsaturated = cumulative[SATURATION_LEVEL - 1]
+
+    return {
+        "saturated": float(n - unsaturated) / n,
+        "luminance": (int(low), int(high)),
+    }
+
+
+class QualityGate:
+    """Configurable thresholds a pad image and its match must meet.
+
+    max_distance=None takes the metric's default from MAX_DISTANCE;
+    math.inf switches the distance check off. Matches without a
+    distance (the LUT) are never rejected on it.
+    """
+
+    def __init__(self, min_sharpness=MIN_SHARPNESS, max_saturated=MAX_SATURATED,
+                 min_luminance=MIN_LUMINANCE, max_luminance=MAX_LUMINANCE,
+                 max_luminance_range=MAX_LUMINANCE_RANGE, max_distance=None, metric="rgb"):
+        self.min_sharpness = min_sharpness
+        self.max_saturated = max_saturated
+        self.min_luminance = min_luminance
+        self.max_luminance = max_luminance
+        self.max_luminance_range = max_luminance_range
+        self.max_distance = MAX_DISTANCE[metric] if max_distance is None else max_distance
+
+    def thresholds(self):
+        return dict(vars(self))
+
+    def problems(self, quality):
+        """Why a pad with these image_quality() metrics fails (empty if it passes)"""
+        low, high = quality["luminance"]
+        problems = []
+        if quality["saturated"] > self.max_saturated:
+            problems.append(f"glare ({quality['saturated']:.1%} saturated "
+                            f"> {self.max_saturated:.1%})")
+        if high < self.min_luminance:
+            problems.append(f"underexposed (luminance up to {high} < {self.min_luminance})")
+        if low > self.max_luminance:
+            problems.append(f"overexposed (luminance from {low} > {self.max_luminance})")
+        if high - low > self.max_luminance_range:
+            problems.append(f"uneven (luminance {low}-{high} spans more than "
+                            f"{self.max_luminance_range})")
+        return problems
+
+    def check(self, img_bgr, name):
+        """Raise ImageRejected if a decoded pad image fails; returns its quality metrics"""
+        quality = image_quality(img_bgr)
+        problems = self.problems(quality)
+        if problems:
+            count("images_rejected")
+            raise ImageRejected(f"{name}: {', '.join(problems)}")
+        return quality
+
+    def check_focus(self, img_bgr, name):
+        """Raise ImageRejected if a whole-strip photo or frame is out of focus"""
+        import cv2
+
+        with timed("quality"):
+            sharpness = _sharpness(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY))
+        if sharpness < self.min_sharpness:
+            count("images_rejected")
+            raise ImageRejected(f"{name}: blurry (sharpness {sharpness:.1f} "
+                                f"< {self.min_sharpness:g})")
+
+    def check_matches(self, matches):
+        """Raise ImageRejected if a pad's color is too far from every reference"""
+        for pad_index, _, _, distance in matches:
+            if distance is None or math.isnan(distance):
+                continue
+            if distance > self.max_distance:
+                count("matches_rejected")
+                raise ImageRejected(f"pad {pad_index}: matches no reference "
+                                    f"(distance {distance:.1f} > {self.max_distance:g})")
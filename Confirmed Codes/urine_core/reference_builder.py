@@ -0,0 +1,257 @@
+import os
+import csv
+import json
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .constants import DB_PATH, IMAGE_EXTENSIONS, PAD_SEQUENCE
+from .pipeline_metrics import timed
+
+# ==============================
+# CONFIG
+# ==============================
+# Patches per analyte on the flat reference chart the shipped CSVs were
+# measured from (patch_000 ... patch_056), in PAD_SEQUENCE order.
+CHART_LEVELS = {
+    "GLU": 6, "BIL": 4, "KET": 6, "SG": 7, "BLO": 7,
+    "PH": 7, "PRO": 6, "URO": 6, "NIT": 3, "LEU": 5,
+}
+
+CSV_STATISTICS = ("mean", "median", "trimmed", "masked")
+CACHE_VERSION = 1        # bump when the statistics themselves change
+CHUNK_SIZE = 8
+
+# ==============================
+# CALIBRATION IMAGE TREE
+# ==============================
+def _images_under(folder):
+    """Every image below folder, in sorted path order"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, f) for f in sorted(filenames)
+                     if f.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+def find_calibration_images(root, chart_levels=CHART_LEVELS):
+    """{analyte code: [patch image per level]} for a calibration image tree.
+
+    Either one folder per analyte (named by its code, e.g. GLU/ or pH/),
+    whose images sorted by name are the levels, or a flat chart whose
+    images sorted by name run through PAD_SEQUENCE with chart_levels
+    patches per analyte.
+    """
+    folders = {name.upper(): os.path.join(root, name) for name in sorted(os.listdir(root))
+               if os.path.isdir(os.path.join(root, name))}
+    if any(code.upper() in folders for code in PAD_SEQUENCE):
+        return {code: _images_under(folders[code.upper()]) for code in PAD_SEQUENCE
+                if code.upper() in folders}
+
+    images = _images_under(root)
+    expected = sum(chart_levels[code] for code in PAD_SEQUENCE)
+    if len(images) != expected:
+        raise ValueError(f"Found {len(images)} images in {root}, the chart has {expected}; "
+                         "use one folder per analyte for other layouts")
+
+    patches, start = {}, 0
+    for code in PAD_SEQUENCE:
+        patches[code] = images[start:start + chart_levels[code]]
+        start += chart_levels[code]
+    return patches
+
+# ==============================
+# PATCH STATISTICS
+# ==============================
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def measure_patch(job):
+    """(cache key, {statistic: [R, G, B]}) of one patch; runs in a worker process"""
+    from .pad_extraction import exact_pad_statistics, read_pad_bgr
+
+    path, key, roi_fraction = job
+    stats = exact_pad_statistics(read_pad_bgr(path, roi_fraction=roi_fraction))
+    return key, {name: [round(float(v), 2) for v in stats[name]] for name in CSV_STATISTICS}
+
+
+class StatisticsCache:
+    """Patch statistics keyed by image content hash, kept in one JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data["entries"]
+
+    @staticmethod
+    def key(digest, roi_fraction):
+        return f"{digest}:{roi_fraction:g}"
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def compute_statistics(paths, cache, roi_fraction=1.0, workers=None):
+    """{path: {statistic: [R, G, B]}}, measuring only images not already cached"""
+    keys = {path: cache.key(file_digest(path), roi_fraction) for path in paths}
+    jobs = sorted({(path, key, roi_fraction) for path, key in keys.items()
+                   if key not in cache.entries}, key=lambda job: job[0])
+
+    if jobs:
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        with timed("reference_measure"):
+            if workers == 1:
+                measured = map(measure_patch, jobs)
+            else:
+                pool = ProcessPoolExecutor(max_workers=workers)
+                measured = pool.map(measure_patch, jobs, chunksize=CHUNK_SIZE)
+            try:
+                cache.entries.update(measured)
+            finally:
+                if workers > 1:
+                    pool.shutdown()
+        cache.save()
+
+    return {path: cache.entries[key] for path, key in keys.items()}, len(jobs)
+
+# ==============================
+# OUTPUT
+# ==============================
+def _write_atomic(path, header, rows):
+    with open(path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(path + ".tmp", path)
+
+
+def _rounded(values):
+    return [int(round(v)) for v in values]
+
+
+def write_analyte_csvs(output_dir, patches, stats):
+    """One <analyte>.csv per analyte in the layout the lookup table imports.
+
+    An existing CSV for the analyte (e.g. pH.csv) is replaced in place,
+    so the folder never ends up with two files for one analyte.
+    """
+    from .lookup_db import find_analyte_csvs
+
+    os.makedirs(output_dir, exist_ok=True)
+    existing = find_analyte_csvs(output_dir, PAD_SEQUENCE)
+    header = ["patch_name"] + [f"{c}_{name}" for name in CSV_STATISTICS for c in "RGB"]
+
+    written = []
+    for code, paths in patches.items():
+        rows = [[os.path.basename(path)] + [v for name in CSV_STATISTICS
+                                            for v in _rounded(stats[path][name])]
+                for path in paths]
+        path = os.path.join(output_dir, existing.get(code, f"{code}.csv"))
+        _write_atomic(path, header, rows)
+        written.append(path)
+    return written
+
+
+def write_sample_csv(path, patches, stats, source, statistic="mean"):
+    """Every patch as a multi-sample reference row (analyte,level,R,G,B,source)"""
+    rows = [[code, level, *_rounded(stats[patch][statistic]), source]
+            for code, paths in patches.items()
+            for level, patch in enumerate(paths)]
+    _write_atomic(path, ["analyte", "level", "R", "G", "B", "source"], rows)
+    return len(rows)
+
+# ==============================
+# BUILD
+# ==============================
+def build_references(root, output_dir=None, db_path=None, samples_path=None, source=None,
+                     roi_fraction=1.0, workers=None, cache_path=None,
+                     chart_levels=CHART_LEVELS):
+    """Measure a calibration image tree and emit analyte CSVs, a sample CSV and/or the DB.
+
+    With db_path the analyte CSVs are imported into the lookup table
+    (only analytes whose CSV changed get a new calibration version), and
+    the sample CSV, if any, into reference_samples. Without output_dir
+    the analyte CSVs go to a temporary folder.
+    """
+    if not (output_dir or db_path or samples_path):
+        raise ValueError("Give an output folder, a database or a sample CSV")
+
+    patches = find_calibration_images(root, chart_levels)
+    paths = [path for level_paths in patches.values() for path in level_paths]
+    if cache_path is None:
+        anchor = output_dir or os.path.dirname(os.path.abspath(db_path or samples_path))
+        cache_path = os.path.join(anchor, ".reference_cache.json")
+    cache = StatisticsCache(cache_path)
+    stats, measured = compute_statistics(paths, cache, roi_fraction, workers)
+    print(f"Measured {measured} of {len(paths)} patches ({len(paths) - measured} cached)")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        csv_dir = output_dir or scratch
+        written = write_analyte_csvs(csv_dir, patches, stats)
+        if output_dir:
+            print(f"✓ Wrote {len(written)} analyte CSVs to {output_dir}")
+
+        if samples_path:
+            rows = write_sample_csv(samples_path, patches, stats,
+                                    source or os.path.basename(os.path.abspath(root)))
+            print(f"✓ Wrote {rows} reference samples to {samples_path}")
+
+        if db_path:
+            from .pipeline import build_lookup_table, create_database
+
+            conn = create_database(db_path)
+            try:
+                imported, unchanged, missing = build_lookup_table(conn, csv_dir)
+                if samples_path:
+                    from .lookup_db import import_reference_samples
+                    import_reference_samples(conn, [samples_path], PAD_SEQUENCE)
+            finally:
+                conn.close()
+            for code in missing:
+                print(f"⚠ Warning: No patches found for {code}")
+            print(f"✓ Imported {len(imported)} analytes into {db_path}, "
+                  f"{len(unchanged)} unchanged")
+
+    return patches, stats
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the reference CSVs (or the lookup table) from calibration images")
+    parser.add_argument("root", help="calibration images: one folder per analyte, or the flat chart")
+    parser.add_argument("-o", "--output", help="folder for the per-analyte CSVs")
+    parser.add_argument("--db", nargs="?", const=DB_PATH, default=None,
+                        help=f"also import into this lookup database (default {DB_PATH})")
+    parser.add_argument("--samples", help="also write every patch as a multi-sample reference CSV")
+    parser.add_argument("--source", help="lot/camera name for the sample rows (default: root folder)")
+    parser.add_argument("--roi", type=float, default=1.0,
+                        help="fraction of each side sampled around the patch center")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--cache", help="statistics cache file "
+                                        "(default: .reference_cache.json next to the output)")
+    args = parser.parse_args()
+
+    try:
+        build_references(args.root, args.output, args.db, args.samples, args.source,
+                         args.roi, args.workers, args.cache)
+    except ValueError as e:
+        raise SystemExit(f"✗ {e}")
@@ -0,0 +1,151 @@
+import numpy as np
+
+from .color_metrics import color_distance, rgb_to_lab
+from .constants import METRICS
+
+# ==============================
+# CONFIG
+# ==============================
+# The reference CSVs carry means and medians only, so sample statistics
+# without a reference counterpart are matched against the reference means.
+REFERENCE_COLUMNS = {
+    ("mean", "rgb"): ("r_mean", "g_mean", "b_mean"),
+    ("median", "rgb"): ("COALESCE(r_median, r_mean)",
+                        "COALESCE(g_median, g_mean)",
+                        "COALESCE(b_median, b_mean)"),
+    ("mean", "lab"): ("lab_l", "lab_a", "lab_b"),
+    ("median", "lab"): ("lab_l_median", "lab_a_median", "lab_b_median"),
+}
+REFERENCE_STATISTIC = {
+    "mean": "mean",
+    "median": "median",
+    "trimmed": "mean",
+    "masked": "mean",
+}
+
+# ==============================
+# IN-MEMORY REFERENCE INDEX
+# ==============================
+class ReferenceIndex:
+    """color_lookup loaded once into contiguous per-pad NumPy arrays.
+
+    References are stored as a (pads, levels, 3) array padded to the
+    largest level count; padded slots are masked out of every match.
+    For the Delta E metrics the stored references are the CIELAB values
+    precomputed at build time, and only samples are converted.
+    """
+
+    def __init__(self, pad_indices, level_indices, value_labels, ref_colors, valid,
+                 statistic="mean", metric="rgb"):
+        self.pad_indices = np.asarray(pad_indices, dtype=np.int64)
+        self.level_indices = level_indices
+        self.value_labels = value_labels
+        self.ref_colors = np.ascontiguousarray(ref_colors, dtype=np.float64)
+        self.valid = valid & np.isfinite(self.ref_colors).all(axis=2)
+        self.statistic = statistic
+        self.metric = metric
+        self.pad_position = {int(p): i for i, p in enumerate(self.pad_indices)}
+
+    @classmethod
+    def from_connection(cls, conn, statistic="mean", metric="rgb"):
+        """Load the whole color_lookup table with a single query.
+
+        statistic names the sample statistic that will be matched
+        (see REFERENCE_STATISTIC); together with metric it selects the
+        reference columns.
+        """
+        if statistic not in REFERENCE_STATISTIC:
+            raise ValueError(f"statistic must be one of {sorted(REFERENCE_STATISTIC)}")
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        space = "rgb" if metric == "rgb" else "lab"
+        columns = ", ".join(REFERENCE_COLUMNS[REFERENCE_STATISTIC[statistic], space])
+
+        rows = conn.execute(f"""
+            SELECT pad_index, level_index, value_label, {columns}
+            FROM color_lookup
+            ORDER BY pad_index, id
+        """).fetchall()
+
+        if space == "lab" and any(row[3] is None for row in rows):
+            raise ValueError("color_lookup has no CIELAB references yet; "
+                             "initialize the database again to compute them")
+
+        grouped = {}
+        for pad_index, level_index, value_label, c1, c2, c3 in rows:
+            grouped.setdefault(pad_index, []).append((level_index, value_label, (c1, c2, c3)))
+
+        pad_indices = sorted(grouped)
+        max_levels = max((len(v) for v in grouped.values()), default=0)
+
+        level_indices = np.full((len(pad_indices), max_levels), -1, dtype=np.int64)
+        value_labels = np.full((len(pad_indices), max_levels), "", dtype=object)
+        ref_colors = np.zeros((len(pad_indices), max_levels, 3), dtype=np.float64)
+        valid = np.zeros((len(pad_indices), max_levels), dtype=bool)
+
+        for p, pad_index in enumerate(pad_indices):
+            for level, (level_index, value_label, color) in enumerate(grouped[pad_index]):
+                level_indices[p, level] = level_index
+                value_labels[p, level] = value_label
+                ref_colors[p, level] = [np.nan if v is None else v for v in color]
+                valid[p, level] = True
+
+        return cls(pad_indices, level_indices, value_labels, ref_colors, valid,
+                   statistic, metric)
+
+    def __len__(self):
+        return len(self.pad_indices)
+
+    def has_pad(self, pad_index):
+        return int(pad_index) in self.pad_position
+
+    def _samples(self, rgbs):
+        rgbs = np.asarray(rgbs, dtype=np.float64)
+        return rgbs if self.metric == "rgb" else rgb_to_lab(rgbs)
+
+    def match(self, rgbs):
+        """Nearest reference level for an (N strips, pads, 3) batch.
+
+        rgbs is ordered like self.pad_indices. Returns the winning level
+        slot and its distance under self.metric, both shaped (N, pads).
+        """
+        samples = self._samples(rgbs)
+        distances = color_distance(samples[:, :, None, :], self.ref_colors[None], self.metric)
+        distances[:, ~self.valid] = np.inf
+
+        best = distances.argmin(axis=2)
+        best_distance = np.take_along_axis(distances, best[:, :, None], axis=2)[:, :, 0]
+        return best, best_distance
+
+    def match_pads(self, pad_indices, rgbs):
+        """Nearest reference level for arbitrary (pad_index, rgb) pairs"""
+        positions = np.array([self.pad_position[int(p)] for p in pad_indices], dtype=np.int64)
+        samples = self._samples(rgbs).reshape(len(positions), 3)
+
+        distances = color_distance(samples[:, None, :], self.ref_colors[positions], self.metric)
+        distances[~self.valid[positions]] = np.inf
+
+        best = distances.argmin(axis=1)
+        best_distance = distances[np.arange(len(positions)), best]
+        return positions, best, best_distance
+
+    def predict(self, pad_rgb_map):
+        """Match one strip's {pad_index: rgb} map.
+
+        Returns (pad_index, level_index, value_label, distance) tuples for
+        every pad that has reference data.
+        """
+        pads = [p for p in pad_rgb_map if self.has_pad(p)]
+        if not pads:
+            return []
+
+        positions, best, best_distance = self.match_pads(
+            pads, [pad_rgb_map[p] for p in pads])
+
+        return [
+            (pad_index,
+             int(self.level_indices[pos, level]),
+             self.value_labels[pos, level],
+             float(distance))
+            for pad_index, pos, level, distance in zip(pads, positions, best, best_distance)
+        ]
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+
+from .constants import DB_PATH
+from .pipeline_metrics import count, timed
+
+# ==============================
+# CONFIG
+# ==============================
+MAX_BYTES = 64 * 1024 * 1024   # cached strips kept before the least recently used go
+BUSY_TIMEOUT = 30.0            # seconds a worker waits for another one's write
+
+# ==============================
+# RESULT CACHE
+# ==============================
+# A strip's key hashes the content of its images, the calibration
+# fingerprint of the reference table it is matched against, and every
+# setting that changes the answer (reduction, ROI, statistic, metric,
+# LUT, color correction, quality gate). Rebuilding the reference table changes the
+# fingerprint, so older entries can never be hit again; invalidate()
+# deletes them. A hit restores the pad colors and matches without
+# decoding an image.
+
+def cache_path(db_path=DB_PATH):
+    """Result cache stored next to the lookup database"""
+    return os.path.splitext(db_path)[0] + ".result_cache.db"
+
+
+def strip_settings(reduction=1, roi_fraction=1.0, statistic="mean", metric="rgb",
+                   use_lut=False, correction=None, gate=None):
+    """Everything besides the images and the calibration that changes a strip's result"""
+    return {
+        "reduction": int(reduction),
+        "roi_fraction": float(roi_fraction),
+        "statistic": statistic,
+        "metric": metric,
+        "lut": bool(use_lut),
+        "correction": correction.to_dict()["matrix"] if correction is not None else None,
+        "quality": gate.thresholds() if gate is not None else None,
+    }
+
+
+def strip_key(paths, fingerprint, settings):
+    """Content-addressed key of one strip's images under one calibration and settings"""
+    from .reference_builder import file_digest
+
+    digest = hashlib.sha256()
+    digest.update(f"{fingerprint}\n{json.dumps(settings, sort_keys=True)}\n".encode("utf-8"))
+    with timed("content_hash"):
+        for path in paths:
+            digest.update(file_digest(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+def current_fingerprints(db_path=DB_PATH):
+    """Fingerprints of the default and every registered calibration"""
+    from .calibration_registry import calibration_db, load_registry
+    from .lookup_db import calibration_fingerprint
+
+    entries = load_registry(db_path)
+    fingerprints = set()
+    for name in [None, *entries]:
+        path = calibration_db(name, db_path, entries)
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path)
+        try:
+            fingerprints.add(calibration_fingerprint(conn))
+        finally:
+            conn.close()
+    return fingerprints
+
+
+class ResultCache:
+    """Persistent strip results keyed by content (SQLite, WAL mode, shared by workers)"""
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS strip_results (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                payload TEXT,
+                size INTEGER,
+                last_used REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_strip_results_last_used
+                ON strip_results (last_used);
+        """)
+
+    def get(self, key, source=None):
+        """StripResults of a cached strip (recorded under source), or None"""
+        from .results import StripResults
+
+        with timed("result_cache"):
+            row = self.conn.execute(
+                "SELECT payload FROM strip_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                count("result_cache_misses")
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE strip_results SET last_used = ? WHERE key = ?",
+                                  (time.time(), key))
+
+        entry = json.loads(row[0])
+        pad_rgb_map = {int(pad): rgb for pad, rgb in entry["rgb"].items()}
+        matches = [(pad, level, None, distance) for pad, level, distance in entry["matches"]]
+        results = StripResults(capacity=1)
+        results.append(matches, pad_rgb_map, source)
+        count("result_cache_hits")
+        return results
+
+    def put(self, key, fingerprint, results):
+        """Store the last strip of a StripResults under key"""
+        from .results import NO_RESULT
+
+        record = results.data[-1]
+        matches = [[int(column) + 1, int(record["level"][column]),
+                    float(record["distance"][column])]
+                   for column in range(len(record["level"]))
+                   if record["level"][column] != NO_RESULT]
+        payload = json.dumps({
+            "rgb": {pad: record["rgb"][pad - 1].tolist() for pad, _, _ in matches},
+            "matches": matches,
+        })
+        with timed("result_cache"), self.conn:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO strip_results (key, fingerprint, payload, size, last_used)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, fingerprint, payload, len(payload), time.time()))
+
+    def invalidate(self, fingerprints):
+        """Delete entries of calibrations that no longer exist; returns the number removed"""
+        fingerprints = list(fingerprints)
+        with self.conn:
+            removed = self.conn.execute(
+                f"DELETE FROM strip_results WHERE fingerprint NOT IN "
+                f"({', '.join('?' * len(fingerprints))})", fingerprints).rowcount
+        return removed
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_bytes; returns the number removed"""
+        with self.conn:
+            removed = self.conn.execute("""
+                DELETE FROM strip_results WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS kept
+                        FROM strip_results
+                    ) WHERE kept > ?
+                )
+            """, (self.max_bytes,)).rowcount
+        return removed
+
+    def stats(self):
+        entries, size = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM strip_results").fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM strip_results")
+
+    def close(self):
+        self.conn.close()
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or trim the strip result cache")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--max-mb", type=float, default=MAX_BYTES / 2 ** 20,
+                        help="size the cache is trimmed to")
+    parser.add_argument("--clear", action="store_true", help="delete every cached result")
+    args = parser.parse_args()
+
+    path = cache_path(args.db)
+    if not os.path.exists(path):
+        raise SystemExit(f"No result cache at {path}")
+    cache = ResultCache(path, int(args.max_mb * 2 ** 20))
+    try:
+        if args.clear:
+            cache.clear()
+        else:
+            stale = cache.invalidate(current_fingerprints(args.db))
+            evicted = cache.evict()
+            print(f"Removed {stale} stale and {evicted} least recently used results")
+        stats = cache.stats()
+        print(f"✓ {stats['entries']} strips cached, {stats['bytes'] / 2 ** 20:.1f} MB in {path}")
+    finally:
+        cache.close()
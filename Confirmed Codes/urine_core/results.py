@@ -0,0 +1,112 @@
+import numpy as np
+
+from .constants import PAD_ANALYTE_MAP, PAD_SEQUENCE, VALUE_LABELS
+
+# ==============================
+# CONFIG
+# ==============================
+PAD_COUNT = len(PAD_SEQUENCE)
+NO_RESULT = -1           # level of a pad without reference data
+INITIAL_CAPACITY = 16
+
+# One record per strip; a pad's column is pad_index - 1. float16 keeps
+# about three significant digits of the match distance, which is all a
+# confidence needs, and holds the record to 60 bytes.
+STRIP_DTYPE = np.dtype([
+    ("level", np.int8, (PAD_COUNT,)),
+    ("distance", np.float16, (PAD_COUNT,)),
+    ("rgb", np.uint8, (PAD_COUNT, 3)),
+])
+
+EXPORT_COLUMNS = ["Pad", "Analyte", "Level", "Value", "Unit"]
+
+
+def value_label(pad_index, level_index):
+    """Value label of a level, assigned the same way the lookup table is built"""
+    labels = VALUE_LABELS[PAD_ANALYTE_MAP[pad_index][0]]
+    return labels[min(level_index, len(labels) - 1)]
+
+# ==============================
+# STRIP RESULTS
+# ==============================
+class StripResults:
+    """Levels, match distances and pad colors for many strips in one structured array.
+
+    A million strips take about 60 MB (plus their source names, if kept).
+    Rows and DataFrames are only produced when results are shown or exported.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._data = np.zeros(max(capacity, 1), dtype=STRIP_DTYPE)
+        self._size = 0
+        self.sources = []
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def data(self):
+        """Structured array of the stored strips (a view, not a copy)"""
+        return self._data[:self._size]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def _reserve(self, n):
+        if self._size + n <= len(self._data):
+            return
+        grown = np.zeros(max(2 * len(self._data), self._size + n), dtype=STRIP_DTYPE)
+        grown[:self._size] = self._data[:self._size]
+        self._data = grown
+
+    def append(self, matches, pad_rgb_map, source=None):
+        """Add one strip from (pad_index, level_index, value_label, distance) matches"""
+        levels = [NO_RESULT] * PAD_COUNT
+        distances = [np.nan] * PAD_COUNT
+        rgbs = [(0, 0, 0)] * PAD_COUNT
+        for pad_index, level_index, _, distance in matches:
+            levels[pad_index - 1] = level_index
+            distances[pad_index - 1] = distance
+            rgbs[pad_index - 1] = pad_rgb_map[pad_index]
+
+        self._reserve(1)
+        self._data[self._size] = (levels, distances, rgbs)
+        self._size += 1
+        self.sources.append(source)
+
+    def extend(self, other):
+        """Append every strip of another StripResults"""
+        self._reserve(len(other))
+        self._data[self._size:self._size + len(other)] = other.data
+        self._size += len(other)
+        self.sources.extend(other.sources)
+
+    def result_count(self):
+        """Number of pads with a result across all strips"""
+        return int((self.data["level"] != NO_RESULT).sum())
+
+    def rows(self, start=0, stop=None):
+        """Yield (source, pad, analyte, level, value, unit, r, g, b) for strips[start:stop]"""
+        data = self.data[start:stop]
+        for offset, record in enumerate(data):
+            source = self.sources[start + offset]
+            for column in np.flatnonzero(record["level"] != NO_RESULT):
+                pad_index = int(column) + 1
+                level_index = int(record["level"][column])
+                _, analyte, unit = PAD_ANALYTE_MAP[pad_index]
+                r, g, b = record["rgb"][column].tolist()
+                yield (source, pad_index, analyte, level_index,
+                       value_label(pad_index, level_index), unit, r, g, b)
+
+    def to_dataframe(self, with_source=False, with_colors=False):
+        """Export-time DataFrame; by default the columns of the single-strip export"""
+        import pandas as pd
+
+        columns = ["Source", *EXPORT_COLUMNS, "R", "G", "B"]
+        df = pd.DataFrame(list(self.rows()), columns=columns)
+        if not with_source:
+            df = df.drop(columns="Source")
+        if not with_colors:
+            df = df.drop(columns=["R", "G", "B"])
+        return df
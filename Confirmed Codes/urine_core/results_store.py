@@ -0,0 +1,189 @@
+import os
+import csv
+import sys
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from .constants import PAD_ANALYTE_MAP
+
+# ==============================
+# CONFIG
+# ==============================
+RESULTS_DB_PATH = "urine_results.db"
+BATCH_SIZE = 500         # rows buffered before a commit
+FETCH_SIZE = 1000        # rows pulled from SQLite at a time by query()
+
+STORE_COLUMNS = [
+    "analyzed_at", "sample", "pad_index", "analyte_code", "analyte",
+    "level_index", "value_label", "unit", "r", "g", "b"
+]
+
+ANALYTE_CODES = {
+    key.upper(): code
+    for code, name, _ in PAD_ANALYTE_MAP.values()
+    for key in (code, name)
+}
+
+# ==============================
+# RESULTS STORE
+# ==============================
+class ResultStore:
+    """Append-only SQLite store (WAL mode) for every analyzed pad.
+
+    Rows are buffered and committed in batches; query() streams matches
+    in chunks instead of loading the table into memory.
+    """
+
+    def __init__(self, db_path=RESULTS_DB_PATH, batch_size=BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                analyzed_at TEXT,
+                sample TEXT,
+                pad_index INTEGER,
+                analyte_code TEXT,
+                analyte TEXT,
+                level_index INTEGER,
+                value_label TEXT,
+                unit TEXT,
+                r INTEGER,
+                g INTEGER,
+                b INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_time
+                ON results (analyzed_at);
+            CREATE INDEX IF NOT EXISTS idx_results_analyte_time
+                ON results (analyte_code, analyzed_at);
+            CREATE INDEX IF NOT EXISTS idx_results_analyte_level
+                ON results (analyte_code, level_index);
+        """)
+        self.conn.commit()
+
+    def append(self, rows, analyzed_at=None):
+        """Buffer (sample, pad, analyte, level, value, unit, r, g, b) rows"""
+        analyzed_at = analyzed_at or datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            for sample, pad, analyte, level, value, unit, r, g, b in rows:
+                self.pending.append((
+                    analyzed_at, sample, int(pad), PAD_ANALYTE_MAP[int(pad)][0], analyte,
+                    int(level), value, unit, int(r), int(g), int(b)
+                ))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO results ({", ".join(STORE_COLUMNS)})
+                VALUES ({", ".join("?" * len(STORE_COLUMNS))})
+            """, self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def query(self, start=None, end=None, analyte=None, level=None, min_level=None,
+              value=None, sample=None):
+        """Yield stored rows (as dicts) matching every given filter.
+
+        start/end are ISO dates or datetimes (end is exclusive); analyte
+        accepts a code ("GLU") or a name ("Glucose").
+        """
+        self.flush()
+
+        where, params = [], []
+        if start is not None:
+            where.append("analyzed_at >= ?")
+            params.append(str(start))
+        if end is not None:
+            where.append("analyzed_at < ?")
+            params.append(str(end))
+        if analyte is not None:
+            if analyte.upper() not in ANALYTE_CODES:
+                raise ValueError(f"Unknown analyte: {analyte}")
+            where.append("analyte_code = ?")
+            params.append(ANALYTE_CODES[analyte.upper()])
+        if level is not None:
+            where.append("level_index = ?")
+            params.append(level)
+        if min_level is not None:
+            where.append("level_index >= ?")
+            params.append(min_level)
+        if value is not None:
+            where.append("value_label = ?")
+            params.append(value)
+        if sample is not None:
+            where.append("sample = ?")
+            params.append(sample)
+
+        sql = f"SELECT {', '.join(STORE_COLUMNS)} FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY analyzed_at, id"
+
+        cursor = self.conn.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(FETCH_SIZE)
+            if not chunk:
+                break
+            for row in chunk:
+                yield dict(zip(STORE_COLUMNS, row))
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query stored urine analysis results")
+    parser.add_argument("--db", default=RESULTS_DB_PATH, help="results database")
+    parser.add_argument("--from", dest="start", help="first date/time (ISO), inclusive")
+    parser.add_argument("--to", dest="end", help="last date/time (ISO), exclusive")
+    parser.add_argument("--analyte", help="analyte code or name, e.g. GLU or Glucose")
+    parser.add_argument("--level", type=int, help="exact level index")
+    parser.add_argument("--min-level", type=int, help="level index at least (1 = positive)")
+    parser.add_argument("--value", help="exact value label")
+    parser.add_argument("-o", "--output", help="write matches to this CSV instead of stdout")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"Results database not found: {args.db}")
+
+    with ResultStore(args.db) as store:
+        rows = store.query(args.start, args.end, args.analyte, args.level,
+                           args.min_level, args.value)
+        out = open(args.output, "w", newline="", encoding="utf-8") if args.output else None
+        try:
+            writer = csv.DictWriter(out or sys.stdout, fieldnames=STORE_COLUMNS)
+            writer.writeheader()
+            count = 0
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        finally:
+            if out:
+                out.close()
+
+    if args.output:
+        print(f"✓ {count} rows written to {args.output}")
@@ -0,0 +1,322 @@
+import os
+import sqlite3
+import argparse
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:      # scipy is optional; the NumPy tree gives the same answers
+    cKDTree = None
+
+from .color_metrics import color_distance, rgb_to_lab
+from .constants import DB_PATH, METRICS, PAD_SEQUENCE
+from .kdtree import KDTree
+from .lookup_db import create_database, import_reference_samples, remove_reference_samples
+from .reference_index import REFERENCE_STATISTIC, ReferenceIndex
+from .results import value_label
+
+# ==============================
+# CONFIG
+# ==============================
+K_NEIGHBOURS = 7         # samples voting on a pad's level
+VOTE_SOFTENING = 1.0     # added to distances so an exact hit doesn't get infinite weight
+BRUTE_FORCE_MAX = 8192   # samples below which a full scan beats the tree
+PAD_SPACING = 10_000.0   # offset between pads in the shared search space (colors span < 500)
+BRUTE_FORCE_CHUNK = 4_000_000   # query x sample distances computed at a time
+DE2000_OVERSAMPLE = 3    # Lab neighbours re-ranked under CIEDE2000 per vote
+
+# ==============================
+# NEIGHBOUR SEARCH
+# ==============================
+class BruteForce:
+    """Exact k-nearest search by scanning every point; fastest for small sets"""
+
+    def __init__(self, points):
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        self.axes = np.ascontiguousarray(self.points.T)
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+        k = min(k, len(self.points))
+        distances = np.empty((len(queries), k))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        step = max(1, BRUTE_FORCE_CHUNK // len(self.points))
+        for start in range(0, len(queries), step):
+            chunk = queries[start:start + step]
+            d2 = np.zeros((len(chunk), len(self.points)))
+            for axis in range(3):
+                diff = chunk[:, axis, None] - self.axes[axis]
+                d2 += diff * diff
+            nearest = np.argpartition(d2, k - 1, axis=1)[:, :k] if k < len(self.points) \
+                else np.broadcast_to(np.arange(k), d2.shape).copy()
+            nearest_d2 = np.take_along_axis(d2, nearest, axis=1)
+            order = np.argsort(nearest_d2, axis=1)
+            indices[start:start + step] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:start + step] = np.sqrt(np.take_along_axis(nearest_d2, order, axis=1))
+        return distances, indices
+
+
+class SciPyTree:
+    """scipy's cKDTree behind the same query() as KDTree"""
+
+    def __init__(self, points):
+        self.tree = cKDTree(points)
+
+    def __len__(self):
+        return self.tree.n
+
+    def query(self, queries, k=1):
+        k = min(k, self.tree.n)
+        distances, indices = self.tree.query(np.asarray(queries, dtype=np.float64).reshape(-1, 3),
+                                             k=list(range(1, k + 1)))
+        return distances, indices.astype(np.int64)
+
+
+def neighbour_search(points):
+    """Full scan for small sample sets, otherwise a KD-tree (scipy's if installed)"""
+    if len(points) <= BRUTE_FORCE_MAX:
+        return BruteForce(points)
+    if cKDTree is not None:
+        return SciPyTree(points)
+    return KDTree(points)
+
+# ==============================
+# MULTI-SAMPLE REFERENCE INDEX
+# ==============================
+class SampleIndex:
+    """Many reference samples per level, decided by a k-nearest-neighbour vote.
+
+    Offers the same pad_indices / level_indices / value_labels slots and
+    match(), match_pads() and predict() as ReferenceIndex, so it can be
+    handed to anything that takes one. Every pad's samples are moved to
+    their own region of one search space (PAD_SPACING apart on the first
+    axis), so the tree's top splits separate the pads and a whole batch
+    of strips is one query costing O(log n) per pad color. Neighbours are
+    weighted by 1 / (distance + VOTE_SOFTENING); the returned distance is
+    that of the nearest sample of the winning level, and the confidence
+    is the winning level's share of the vote weight.
+    """
+
+    def __init__(self, pad_samples, statistic="mean", metric="rgb", k=K_NEIGHBOURS):
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        self.statistic = statistic
+        self.metric = metric
+        self.k = k
+        self.pad_indices = np.array(sorted(pad_samples), dtype=np.int64)
+        self.pad_position = {int(p): i for i, p in enumerate(self.pad_indices)}
+
+        levels = [np.unique(pad_samples[p][1]) for p in self.pad_indices]
+        max_levels = max((len(v) for v in levels), default=0)
+        self.level_indices = np.full((len(self.pad_indices), max_levels), -1, dtype=np.int64)
+        self.value_labels = np.full((len(self.pad_indices), max_levels), "", dtype=object)
+
+        colors, positions, slots = [], [], []
+        for pos, pad_index in enumerate(self.pad_indices):
+            pad_colors, sample_levels = pad_samples[pad_index]
+            self.level_indices[pos, :len(levels[pos])] = levels[pos]
+            for slot, level_index in enumerate(levels[pos]):
+                self.value_labels[pos, slot] = value_label(int(pad_index), int(level_index))
+            colors.append(np.asarray(pad_colors, dtype=np.float64).reshape(-1, 3))
+            positions.append(np.full(len(colors[-1]), pos, dtype=np.int64))
+            slots.append(np.searchsorted(levels[pos], sample_levels))
+
+        self.colors = np.concatenate(colors) if colors else np.zeros((0, 3))
+        self.sample_positions = np.concatenate(positions) if positions else np.zeros(0, np.int64)
+        self.sample_slots = np.concatenate(slots) if slots else np.zeros(0, np.int64)
+        self.search = (neighbour_search(self._place(self.colors, self.sample_positions))
+                       if len(self.colors) else None)
+
+    @classmethod
+    def from_connection(cls, conn, statistic="mean", metric="rgb", k=K_NEIGHBOURS):
+        """Load reference_samples; pads without samples fall back to their color_lookup rows.
+
+        Samples are single measurements, so every sample statistic is
+        matched against them as they are.
+        """
+        if statistic not in REFERENCE_STATISTIC:
+            raise ValueError(f"statistic must be one of {sorted(REFERENCE_STATISTIC)}")
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        columns = "r, g, b" if metric == "rgb" else "lab_l, lab_a, lab_b"
+
+        rows = conn.execute(f"""
+            SELECT pad_index, level_index, {columns}
+            FROM reference_samples
+            ORDER BY pad_index, id
+        """).fetchall()
+        data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+        pad_samples = {}
+        for pad_index in np.unique(data[:, 0]).astype(int):
+            pad_rows = data[data[:, 0] == pad_index]
+            pad_samples[int(pad_index)] = (pad_rows[:, 2:], pad_rows[:, 1].astype(np.int64))
+
+        lookup = ReferenceIndex.from_connection(conn, statistic, metric)
+        for pos, pad_index in enumerate(lookup.pad_indices):
+            if int(pad_index) not in pad_samples and lookup.valid[pos].any():
+                valid = lookup.valid[pos]
+                pad_samples[int(pad_index)] = (lookup.ref_colors[pos, valid],
+                                               lookup.level_indices[pos, valid])
+
+        return cls(pad_samples, statistic, metric, k)
+
+    def __len__(self):
+        return len(self.pad_indices)
+
+    def has_pad(self, pad_index):
+        return int(pad_index) in self.pad_position
+
+    def sample_count(self, pad_index):
+        return int((self.sample_positions == self.pad_position[int(pad_index)]).sum())
+
+    @staticmethod
+    def _place(colors, positions):
+        placed = np.array(colors, dtype=np.float64)
+        placed[:, 0] += positions * PAD_SPACING
+        return placed
+
+    def _samples(self, rgbs):
+        rgbs = np.asarray(rgbs, dtype=np.float64).reshape(-1, 3)
+        return rgbs if self.metric == "rgb" else rgb_to_lab(rgbs)
+
+    def neighbours(self, positions, samples, k=None):
+        """(distances, sample ids) of the k nearest samples of each sample's pad, (m, k).
+
+        A pad with fewer than k samples pads its row with other pads'
+        samples at infinite distance.
+        """
+        k = k or self.k
+        wanted = k * DE2000_OVERSAMPLE if self.metric == "de2000" else k
+        distances, ids = self.search.query(self._place(samples, positions), wanted)
+
+        if self.metric == "de2000":
+            # The search is Euclidean in Lab (CIE76); CIEDE2000 re-ranks a wider set
+            distances = color_distance(samples[:, None, :], self.colors[ids], "de2000")
+        distances = np.where(self.sample_positions[ids] == positions[:, None], distances, np.inf)
+
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def vote(self, positions, samples):
+        """Winning level slot, its nearest distance and the vote confidence for m samples"""
+        m, levels = len(samples), self.level_indices.shape[1]
+        if m == 0:
+            return np.zeros(0, np.int64), np.zeros(0), np.zeros(0)
+        distances, ids = self.neighbours(positions, samples)
+        slots = self.sample_slots[ids]
+        weights = 1.0 / (distances + VOTE_SOFTENING)
+
+        cells = (np.arange(m)[:, None] * levels + slots).ravel()
+        scores = np.bincount(cells, weights.ravel(), minlength=m * levels).reshape(m, levels)
+        best = scores.argmax(axis=1)
+        confidence = scores[np.arange(m), best] / scores.sum(axis=1)
+        best_distance = np.where(slots == best[:, None], distances, np.inf).min(axis=1)
+        return best, best_distance, confidence
+
+    def match(self, rgbs):
+        """Voted level slot and distance for an (N strips, pads, 3) batch ordered like pad_indices"""
+        rgbs = np.asarray(rgbs, dtype=np.float64)
+        n, pads = rgbs.shape[:2]
+        positions = np.tile(np.arange(pads), n)
+        best, best_distance, _ = self.vote(positions, self._samples(rgbs))
+        return best.reshape(n, pads), best_distance.reshape(n, pads)
+
+    def vote_pads(self, pad_indices, rgbs):
+        """positions, level slots, distances and confidences for (pad_index, rgb) pairs"""
+        positions = np.array([self.pad_position[int(p)] for p in pad_indices], dtype=np.int64)
+        return (positions, *self.vote(positions, self._samples(rgbs)))
+
+    def match_pads(self, pad_indices, rgbs):
+        positions, best, best_distance, _ = self.vote_pads(pad_indices, rgbs)
+        return positions, best, best_distance
+
+    def predict(self, pad_rgb_map, with_confidence=False):
+        """Match one strip's {pad_index: rgb} map.
+
+        Returns (pad_index, level_index, value_label, distance) tuples, with
+        the vote confidence appended when with_confidence is set.
+        """
+        pads = [p for p in pad_rgb_map if self.has_pad(p)]
+        if not pads:
+            return []
+
+        positions, best, best_distance, confidence = self.vote_pads(
+            pads, [pad_rgb_map[p] for p in pads])
+
+        matches = []
+        for pad_index, pos, level, distance, share in zip(
+                pads, positions, best, best_distance, confidence):
+            match = (pad_index, int(self.level_indices[pos, level]),
+                     self.value_labels[pos, level], float(distance))
+            matches.append(match + (float(share),) if with_confidence else match)
+        return matches
+
+# ==============================
+# MAIN
+# ==============================
+def sample_csvs(path):
+    """A CSV file, or every CSV in a folder"""
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))
+                if f.lower().endswith(".csv")]
+    return [path]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import and inspect multi-sample references")
+    parser.add_argument("--db", default=DB_PATH, help="color lookup database")
+    parser.add_argument("--import", dest="import_path",
+                        help="sample CSV (analyte,level,R,G,B[,source]) or a folder of them")
+    parser.add_argument("--remove", metavar="CSV_FILE",
+                        help="drop the samples imported from this file ('all' for every file)")
+    parser.add_argument("--metric", default="rgb", choices=METRICS)
+    parser.add_argument("-k", type=int, default=K_NEIGHBOURS, help="neighbours per vote")
+    parser.add_argument("--query", type=int, nargs=4, metavar=("PAD", "R", "G", "B"),
+                        help="show the neighbours and vote for one pad color")
+    args = parser.parse_args()
+
+    conn = create_database(args.db)
+    if args.import_path:
+        imported, unchanged = import_reference_samples(
+            conn, sample_csvs(args.import_path), PAD_SEQUENCE)
+        for csv_file, rows in imported.items():
+            print(f"✓ Imported {rows} samples from {csv_file}")
+        if unchanged:
+            print(f"{len(unchanged)} sample files unchanged")
+    if args.remove:
+        removed = remove_reference_samples(conn, None if args.remove == "all" else args.remove)
+        print(f"✓ Removed {removed} samples")
+
+    try:
+        index = SampleIndex.from_connection(conn, metric=args.metric, k=args.k)
+    except sqlite3.OperationalError as e:
+        raise SystemExit(f"✗ {args.db} has no reference data ({e})")
+    finally:
+        conn.close()
+
+    for pos, pad_index in enumerate(index.pad_indices):
+        levels = int((index.level_indices[pos] >= 0).sum())
+        print(f"Pad {pad_index}: {index.sample_count(pad_index)} samples, {levels} levels")
+    if index.search is not None:
+        print(f"{len(index.colors)} samples searched by {type(index.search).__name__}")
+
+    if args.query:
+        pad_index, *rgb = args.query
+        if not index.has_pad(pad_index):
+            raise SystemExit(f"✗ No reference data for pad {pad_index}")
+        pos = index.pad_position[pad_index]
+        distances, ids = index.neighbours(np.array([pos]), index._samples([rgb]))
+        for distance, sample in zip(distances[0], ids[0]):
+            if not np.isfinite(distance):
+                continue
+            slot = index.sample_slots[sample]
+            print(f"  level {index.level_indices[pos, slot]} "
+                  f"({index.value_labels[pos, slot]}): {distance:.2f}")
+        (_, level, label, distance, confidence), = index.predict({pad_index: rgb}, True)
+        print(f"Pad {pad_index} -> level {level} ({label}), distance {distance:.2f}, "
+              f"confidence {confidence:.2f}")
@@ -0,0 +1,28 @@
+import os
+
+from .constants import IMAGE_EXTENSIONS
+
+# ==============================
+# CONFIG
+# ==============================
+PADS_PER_STRIP = 10
+
+# ==============================
+# FOLDER DISCOVERY
+# ==============================
+def find_strip_folders(root):
+    """Yield every folder under root holding exactly one strip of patch images"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        image_count = sum(1 for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS))
+        if image_count == PADS_PER_STRIP:
+            yield dirpath
+
+
+def find_strip_images(root):
+    """Yield every image under root, each a photo of one whole strip"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for f in sorted(filenames):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, f)
@@ -0,0 +1,222 @@
+import argparse
+
+import cv2
+import numpy as np
+
+from .pipeline_metrics import count, timed
+
+# ==============================
+# CONFIG
+# ==============================
+PAD_COUNT = 10
+PROFILE_SAMPLES = 800           # long-axis resolution used for the grid search
+PAD_FRACTIONS = (0.5, 0.6, 0.7, 0.8)   # candidate pad width / pad pitch ratios
+MIN_PADS_SPAN = 1 / 3           # the pads cover at least this share of the strip length
+SEARCH_BAND = 0.5               # central share of the short axis used to find the pads
+INSET = 0.2                     # share of each pad side skipped when sampling colors
+
+# ==============================
+# PAD LOCALIZATION
+# ==============================
+# The photo is expected to be cropped to the strip: pads sit in one row
+# along the long axis, separated by bare strip. The pads are found by
+# fitting an evenly spaced grid of PAD_COUNT windows to the profile of
+# color deviation from the bare strip, so a pad that happens to look like
+# the strip itself is still placed by its neighbours.
+
+def _block_average(profile, samples):
+    """Average a (n, ...) profile down to at most `samples` rows"""
+    n = len(profile)
+    if n <= samples:
+        return profile, 1.0
+    edges = np.linspace(0, n, samples + 1).astype(int)
+    sums = np.add.reduceat(profile, edges[:-1], axis=0)
+    counts = np.diff(edges).reshape(-1, *([1] * (profile.ndim - 1)))
+    return sums / counts, n / samples
+
+
+def _deviation_profile(col_means):
+    """Distance of every column's mean color from the bare-strip color"""
+    chroma = col_means.max(axis=1) - col_means.min(axis=1)
+    base = np.median(col_means[chroma <= np.percentile(chroma, 25)], axis=0)
+    return np.linalg.norm(col_means - base, axis=1), base
+
+
+def _fit_pad_grid(deviation, pad_count=PAD_COUNT):
+    """Best (offset, pitch, width) of pad_count evenly spaced windows"""
+    n = len(deviation)
+    cs = np.concatenate([[0.0], np.cumsum(deviation)])
+    pads = np.arange(pad_count)
+
+    best = (-np.inf, 0, n // pad_count, max(1, n // pad_count // 2))
+    min_pitch = max(2, int(n * MIN_PADS_SPAN / pad_count))
+
+    for fraction in PAD_FRACTIONS:
+        max_pitch = int(n / (pad_count - 1 + fraction))
+        for pitch in range(min_pitch, max_pitch + 1):
+            width = max(1, int(round(fraction * pitch)))
+            if width >= pitch:
+                continue
+            offsets = np.arange(0, n - (pad_count - 1) * pitch - width + 1)
+            if len(offsets) == 0:
+                continue
+
+            starts = offsets[:, None] + pitch * pads
+            pad_mean = (cs[starts + width] - cs[starts]).sum(axis=1) / (pad_count * width)
+            gap_starts = starts[:, :-1] + width
+            gap_mean = ((cs[gap_starts + pitch - width] - cs[gap_starts]).sum(axis=1)
+                        / ((pad_count - 1) * (pitch - width)))
+
+            scores = pad_mean - gap_mean
+            i = scores.argmax()
+            if scores[i] > best[0]:
+                best = (scores[i], int(offsets[i]), pitch, width)
+
+    _, offset, pitch, width = best
+    return offset, pitch, width
+
+
+def locate_pads(img_bgr, pad_count=PAD_COUNT, orientation="auto", inset=INSET):
+    """Sampling boxes (y0, y1, x0, x1) for every pad, in PAD_SEQUENCE order.
+
+    With orientation="auto", pad 1 is the pad nearest the handle, i.e. the
+    end of the strip with the larger bare margin. "forward" numbers pads
+    from the left/top of the image, "reverse" from the right/bottom.
+    """
+    transposed = img_bgr.shape[0] > img_bgr.shape[1]
+    img = img_bgr.transpose(1, 0, 2) if transposed else img_bgr
+    h, w = img.shape[:2]
+
+    # Long-axis profile from the central band of the short axis
+    band_margin = int(h * (1 - SEARCH_BAND) / 2)
+    band = img[band_margin:h - band_margin]
+    col_means = band.mean(axis=0)
+
+    profile, scale = _block_average(col_means, PROFILE_SAMPLES)
+    deviation, base = _deviation_profile(profile)
+    offset, pitch, width = _fit_pad_grid(deviation, pad_count)
+
+    x0 = np.round((offset + pitch * np.arange(pad_count)) * scale).astype(int)
+    x1 = np.minimum(np.round(x0 + width * scale).astype(int), w)
+
+    # Short-axis extent of the pads: rows whose color deviates like the pads do
+    pad_columns = np.concatenate([np.arange(a, b) for a, b in zip(x0, x1)])
+    row_means = img[:, pad_columns].mean(axis=1)
+    row_deviation = np.linalg.norm(row_means - base, axis=1)
+    pad_rows = np.flatnonzero(row_deviation >= 0.5 * row_deviation.max())
+    y0, y1 = (pad_rows[0], pad_rows[-1] + 1) if len(pad_rows) else (0, h)
+
+    # Keep away from pad edges
+    dx = ((x1 - x0) * inset).astype(int)
+    x0, x1 = x0 + dx, np.maximum(x1 - dx, x0 + dx + 1)
+    dy = int((y1 - y0) * inset)
+    y0, y1 = y0 + dy, max(y1 - dy, y0 + dy + 1)
+
+    if orientation == "auto":
+        margin_before = x0[0]
+        margin_after = w - x1[-1]
+        reverse = margin_after > margin_before
+    elif orientation in ("forward", "reverse"):
+        reverse = orientation == "reverse"
+    else:
+        raise ValueError("orientation must be 'auto', 'forward' or 'reverse'")
+
+    if reverse:
+        x0, x1 = x0[::-1], x1[::-1]
+
+    if transposed:
+        return [(int(a), int(b), y0, y1) for a, b in zip(x0, x1)]
+    return [(y0, y1, int(a), int(b)) for a, b in zip(x0, x1)]
+
+
+def box_means_rgb(img_bgr, boxes):
+    """Mean [R, G, B] of every box, all computed from one integral image"""
+    integral = cv2.integral(img_bgr, sdepth=cv2.CV_64F)
+    y0, y1, x0, x1 = (np.array(v) for v in zip(*boxes))
+
+    sums = (integral[y1, x1] - integral[y0, x1]
+            - integral[y1, x0] + integral[y0, x0])
+    means = sums / ((y1 - y0) * (x1 - x0))[:, None]
+    return means[:, ::-1].astype(int)
+
+
+def strip_margin_rgb(img_bgr, boxes):
+    """Median [R, G, B] of the bare strip between neighbouring pads.
+
+    Only the middle third of each gap between sampling boxes is used, so
+    the inset pad edges stay out of the sample. Used as the white
+    reference for color correction.
+    """
+    along_x = len({box[0] for box in boxes}) == 1
+    start, stop = (2, 3) if along_x else (0, 1)
+    ordered = sorted(boxes, key=lambda box: box[start])
+
+    pixels = []
+    for a, b in zip(ordered, ordered[1:]):
+        gap = b[start] - a[stop]
+        lo, hi = a[stop] + gap // 3, b[start] - gap // 3
+        if hi <= lo:
+            continue
+        if along_x:
+            region = img_bgr[a[0]:a[1], lo:hi]
+        else:
+            region = img_bgr[lo:hi, a[2]:a[3]]
+        pixels.append(region.reshape(-1, 3))
+    if not pixels:
+        raise ValueError("Pads leave no bare strip between them")
+    return np.median(np.concatenate(pixels), axis=0)[::-1].astype(int)
+
+
+def extract_strip_rgbs(path, orientation="auto", gate=None):
+    """{pad_index: [R, G, B]} from a single photo of the whole strip"""
+    with timed("decode"):
+        img = cv2.imread(path)
+    if img is None:
+        count("images_rejected")
+        raise ValueError(f"Could not read image: {path}")
+    count("images_decoded")
+    return strip_rgbs(img, orientation, gate)
+
+
+def strip_rgbs(img_bgr, orientation="auto", gate=None):
+    """{pad_index: [R, G, B]} from an already decoded whole-strip image.
+
+    With a QualityGate the photo's focus and then every pad's sampling
+    box are checked first; the first failure raises ImageRejected.
+    """
+    if gate is not None:
+        gate.check_focus(img_bgr, "strip")
+    with timed("locate_pads"):
+        boxes = locate_pads(img_bgr, orientation=orientation)
+    if gate is not None:
+        for idx, (y0, y1, x0, x1) in enumerate(boxes, start=1):
+            gate.check(img_bgr[y0:y1, x0:x1], f"pad {idx}")
+    with timed("color_statistic"):
+        means = box_means_rgb(img_bgr, boxes)
+    return {idx: rgb.tolist() for idx, rgb in enumerate(means, start=1)}
+
+# ==============================
+# MAIN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Locate the pads on a full-strip photo")
+    parser.add_argument("image", help="photo of the whole strip")
+    parser.add_argument("--orientation", default="auto", choices=["auto", "forward", "reverse"])
+    parser.add_argument("--debug", help="write a copy of the photo with the pad boxes drawn")
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image)
+    if img is None:
+        raise SystemExit(f"Could not read image: {args.image}")
+
+    boxes = locate_pads(img, orientation=args.orientation)
+    for idx, (box, rgb) in enumerate(zip(boxes, box_means_rgb(img, boxes)), start=1):
+        print(f"Pad {idx}: box={box} RGB={rgb.tolist()}")
+    print(f"Strip margin RGB={strip_margin_rgb(img, boxes).tolist()}")
+
+    if args.debug:
+        for idx, (y0, y1, x0, x1) in enumerate(boxes, start=1):
+            cv2.rectangle(img, (x0, y0), (x1 - 1, y1 - 1), (0, 0, 255), 1)
+            cv2.putText(img, str(idx), (x0, max(y0 - 4, 10)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
+        cv2.imwrite(args.debug, img)
@@ -0,0 +1,106 @@
+import os
+import math
+import hashlib
+
+from .constants import DB_PATH
+from .pipeline_metrics import count, timed
+
+# PIL is imported on first use, like in the GUI that uses this cache.
+
+# ==============================
+# CONFIG
+# ==============================
+THUMBNAIL_SIZE = 80                # pixels on the long side of a thumbnail
+MAX_BYTES = 32 * 1024 * 1024       # thumbnails kept before the least recently used go
+BACKGROUND = (236, 240, 241)       # fill around tiles that do not cover their cell
+
+# ==============================
+# THUMBNAIL CACHE
+# ==============================
+# A thumbnail is keyed by the path, size and modification time of its
+# images, so an unchanged folder is shown again from small PNGs without
+# decoding a full-size image; a rewritten image gets a new key. Several
+# images (the pads of a strip) are tiled into one thumbnail.
+
+def thumbnail_dir(db_path=DB_PATH):
+    """Thumbnail folder stored next to the lookup database"""
+    return os.path.splitext(db_path)[0] + "_thumbnails"
+
+
+class ThumbnailCache:
+    """PNG thumbnails of image files (or tiles of several), kept in one folder"""
+
+    def __init__(self, folder, size=THUMBNAIL_SIZE, max_bytes=MAX_BYTES):
+        self.folder = folder
+        self.size = size
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, paths):
+        digest = hashlib.sha1(str(self.size).encode("ascii"))
+        for path in paths:
+            stat = os.stat(path)
+            digest.update(f"\n{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+                          .encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, paths):
+        """PIL thumbnail of one image, or of several tiled in a square grid"""
+        from PIL import Image
+
+        path = os.path.join(self.folder, self.key(paths) + ".png")
+        try:
+            with Image.open(path) as cached:
+                cached.load()
+            os.utime(path)
+            count("thumbnail_cache_hits")
+            return cached
+        except (FileNotFoundError, OSError):
+            pass
+
+        with timed("thumbnail"):
+            thumbnail = self._render(paths)
+        count("thumbnail_cache_misses")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        thumbnail.save(tmp, format="PNG")
+        os.replace(tmp, path)
+        return thumbnail
+
+    def _render(self, paths):
+        from PIL import Image
+
+        columns = math.ceil(math.sqrt(len(paths)))
+        rows = math.ceil(len(paths) / columns)
+        tile = self.size // columns
+        sheet = Image.new("RGB", (columns * tile, rows * tile), BACKGROUND)
+        for n, path in enumerate(paths):
+            with Image.open(path) as img:
+                # JPEG decodes straight at a reduced scale
+                img.draft("RGB", (tile, tile))
+                img = img.convert("RGB")
+            img.thumbnail((tile, tile))
+            row, column = divmod(n, columns)
+            sheet.paste(img, (column * tile + (tile - img.width) // 2,
+                              row * tile + (tile - img.height) // 2))
+        return sheet
+
+    def trim(self):
+        """Delete the least recently used thumbnails beyond max_bytes; returns the number removed"""
+        entries = []
+        with os.scandir(self.folder) as scan:
+            for entry in scan:
+                if entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)
+
+        kept, removed = 0, 0
+        for _, size, path in entries:
+            kept += size
+            if kept > self.max_bytes:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed